@@ -0,0 +1,237 @@
+#!/usr/bin/python -tt
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Fleet benchmark.
+
+Runs the flood plugin on many simulated remote hosts, every host is
+a firstaidkit-shell started on this machine, and measures how the
+controller copes with the messages: its CPU time and memory, the number
+of messages per second and the time until the fleet issue summary is
+ready. The results are appended as one JSON line to the output file, so
+they can be compared between versions."""
+
+import sys, os, getopt, time, resource, tempfile, shutil, subprocess
+import logging, json, platform
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+from pyfirstaidkit import reporting, fleet
+from pyfirstaidkit.configuration import Config, FAKConfig
+
+shell = os.path.join(root, "firstaidkit-shell")
+plugins = os.path.join(root, "benchmark", "plugins")
+
+class Options:
+    hosts = 10
+    jobs = 8
+    messages = 1000
+    size = 64
+    issues = 10
+    transport = "local"
+    output = "fleet-benchmark.jsonl"
+    label = ""
+
+def usage(name):
+    print("""Usage:
+ %s [params]
+
+ params is none or more items from:
+  -n <hosts>     - number of simulated hosts (%d)
+  -j <jobs>      - number of sessions running at the same time (%d)
+  -m <messages>  - messages sent by every host (%d)
+  -s <size>      - size of one message in bytes (%d)
+  -i <issues>    - issues reported by every host (%d)
+  -t <transport> - local starts new shell for every host, agent passes
+                   the sessions to running shell agents (%s)
+  -o <file>      - the results are appended to this file (%s)
+  -l <label>     - label stored with the results
+  -h             - help
+""" % (name, Options.hosts, Options.jobs, Options.messages, Options.size,
+        Options.issues, Options.transport, Options.output))
+
+class Frontend(object):
+    """Formats the remote messages the way the text frontend does, but
+    throws the text away"""
+
+    def __init__(self):
+        self.messages = 0
+        self.first = None
+        self.last = None
+        self._null = open(os.devnull, "w")
+
+    def process(self, reports, message):
+        if not message["remote"]:
+            return
+        now = time.time()
+        if self.first is None:
+            self.first = now
+        self.last = now
+        self.messages += 1
+        if message["action"] == reporting.PROGRESS:
+            text = "[%s] PROGRESS: %d of %d (%s)" % (message["remote_name"],
+                    message["message"][0], message["message"][1],
+                    message["origin"].name)
+        else:
+            text = "[%s] %s (%s)" % (message["remote_name"],
+                    message["message"], message["origin"].name)
+        self._null.write(text)
+
+class AgentTransport(fleet.LocalTransport):
+    """Connects to the shell agents, the address is the agent socket"""
+
+    def spawn(self, address):
+        self._command = [sys.executable, shell, "--connect", address]
+        return fleet.LocalTransport.spawn(self, address)
+
+def startAgents(count, directory):
+    """Start shell agents and return list of (process, socket path)"""
+    agents = []
+    null = open(os.devnull, "w")
+    for i in range(count):
+        path = os.path.join(directory, "agent%d" % i)
+        agents.append((subprocess.Popen([sys.executable, shell, "-P",
+            plugins, "--socket", path], stdout = null, stderr = null,
+            close_fds = True), path))
+    for process, path in agents:
+        while not os.path.exists(path):
+            if process.poll() is not None:
+                raise RuntimeError("shell agent did not start")
+            time.sleep(0.1)
+    return agents
+
+def memory():
+    """Resident size of this process in kB"""
+    try:
+        pages = int(open("/proc/self/statm").read().split()[1])
+        return pages * resource.getpagesize() / 1024
+    except (IOError, IndexError, ValueError):
+        return None
+
+def run():
+    cfg = FAKConfig()
+    cfg.operation.mode = "plugin"
+    cfg.operation.plugin = "flood"
+    cfg.log.method = "none"
+    cfg.flood.messages = str(Options.messages)
+    cfg.flood.size = str(Options.size)
+    cfg.flood.issues = str(Options.issues)
+
+    directory = tempfile.mkdtemp(prefix = "firstaidkit-benchmark")
+    agents = []
+    try:
+        if Options.transport == "agent":
+            agents = startAgents(Options.jobs, directory)
+            transport = AgentTransport()
+            addresses = [path for process, path in agents]
+        else:
+            transport = fleet.LocalTransport([sys.executable, shell, "-P",
+                plugins])
+            addresses = ["localhost"]
+        hosts = [("host%d" % i, addresses[i % len(addresses)], cfg)
+                 for i in range(Options.hosts)]
+
+        reports = reporting.Reports(queue_importance = None)
+        reports.setProgressWindow(float(Config.reporting.progress))
+        frontend = Frontend()
+        issues = fleet.IssueAggregator()
+        reports.subscribe(frontend.process)
+        reports.subscribe(issues.process, actions = (reporting.ISSUE,))
+
+        executor = fleet.FleetExecutor(reports, transport,
+                jobs = Options.jobs, retries = 0, spool = directory)
+        before = resource.getrusage(resource.RUSAGE_SELF)
+        start = time.time()
+        results = executor.run(hosts)
+        summary = issues.summary()
+        finished = time.time()
+        after = resource.getrusage(resource.RUSAGE_SELF)
+    finally:
+        for process, path in agents:
+            process.terminate()
+            process.wait()
+        shutil.rmtree(directory, ignore_errors = True)
+    workers = resource.getrusage(resource.RUSAGE_CHILDREN)
+
+    wall = finished - start
+    failed = len([r for r in results.values() if r != fleet.OK])
+    return {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "label": Options.label,
+        "python": platform.python_version(),
+        "transport": Options.transport,
+        "hosts": Options.hosts,
+        "jobs": Options.jobs,
+        "messages": Options.messages,
+        "size": Options.size,
+        "issues": Options.issues,
+        "failed_hosts": failed,
+        "received": frontend.messages,
+        "summary_rows": len(summary),
+        "time_to_summary": round(wall, 3),
+        "first_message": frontend.first and round(frontend.first - start, 3),
+        "messages_per_second": round(frontend.messages / wall, 1),
+        "controller_cpu_user": round(after.ru_utime - before.ru_utime, 3),
+        "controller_cpu_system": round(after.ru_stime - before.ru_stime, 3),
+        "controller_maxrss_kb": after.ru_maxrss,
+        "controller_rss_kb": memory(),
+        "workers_cpu": round(workers.ru_utime + workers.ru_stime, 3),
+    }
+
+if __name__=="__main__":
+    try:
+        params, rest = getopt.getopt(sys.argv[1:], "n:j:m:s:i:t:o:l:h")
+        for key, val in params:
+            if key == "-n":
+                Options.hosts = int(val)
+            elif key == "-j":
+                Options.jobs = int(val)
+            elif key == "-m":
+                Options.messages = int(val)
+            elif key == "-s":
+                Options.size = int(val)
+            elif key == "-i":
+                Options.issues = int(val)
+            elif key == "-t":
+                if val not in ("local", "agent"):
+                    raise ValueError("unknown transport %s" % val)
+                Options.transport = val
+            elif key == "-o":
+                Options.output = val
+            elif key == "-l":
+                Options.label = val
+            elif key == "-h":
+                usage(sys.argv[0])
+                sys.exit(0)
+    except (getopt.GetoptError, ValueError), e:
+        print("\nError parsing the argument line: %s\n" % (e,))
+        usage(sys.argv[0])
+        sys.exit(1)
+
+    logging.getLogger("firstaidkit").addHandler(logging.NullHandler())
+    result = run()
+    f = open(Options.output, "a")
+    try:
+        f.write(json.dumps(result, sort_keys = True) + "\n")
+    finally:
+        f.close()
+
+    for key in sorted(result.keys()):
+        print("%-24s %s" % (key, result[key]))
+    if result["failed_hosts"]:
+        sys.exit(1)
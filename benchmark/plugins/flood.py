@@ -0,0 +1,73 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+from pyfirstaidkit.plugins import Plugin,Flow
+from pyfirstaidkit.reporting import PLUGIN
+from pyfirstaidkit.returns import *
+from pyfirstaidkit.issue import SimpleIssue
+from pyfirstaidkit.configuration import Config
+
+def _option(name, default):
+    try:
+        return int(getattr(Config.flood, name))
+    except Exception:
+        return default
+
+class FloodPlugin(Plugin):
+    """Synthetic plugin used by the fleet benchmark.
+
+    The amount of messages is set by the flood section of the config:
+    messages (info and progress messages), size (bytes of every info
+    message) and issues (number of issues, the even ones are detected)."""
+    name = "Flood"
+    description = "Sends configurable amount of messages"
+    version = "0.0.1"
+    author = "First Aid Kit developers"
+
+    flows = Flow.init(Plugin)
+
+    def prepare(self):
+        self._messages = _option("messages", 1000)
+        self._size = _option("size", 64)
+        self._issues = [SimpleIssue("Flood issue %d" % i,
+                                    "Synthetic issue number %d" % i)
+                        for i in range(_option("issues", 10))]
+        for issue in self._issues:
+            issue.set(reporting = self._reporting, origin = self,
+                    level = PLUGIN)
+        self._result=ReturnSuccess
+
+    def diagnose(self):
+        payload = "x" * self._size
+        for i in range(self._messages):
+            # every tenth message is a progress update
+            if i % 10 == 9:
+                self._reporting.progress(i + 1, self._messages, origin = self,
+                        level = PLUGIN)
+            else:
+                self._reporting.info(payload, origin = self, level = PLUGIN)
+
+        for idx, issue in enumerate(self._issues):
+            issue.set(checked = True, happened = idx % 2 == 0,
+                    reporting = self._reporting, origin = self, level = PLUGIN)
+        self._result=ReturnSuccess
+
+    def clean(self):
+        self._result=ReturnSuccess
+
+def get_plugin():
+    return FloodPlugin
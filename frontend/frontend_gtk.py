@@ -33,6 +33,10 @@ import thread
 import hashlib
 import re
 
+#color index of the issue states in the result list
+_state_colors = {"Error": 4, "No result": 0, "Fixed": 3, "Detected": 2,
+        "No problem": 1, "Waiting for check": 0}
+
 def _o(func, *args, **kwargs):
     """Always return False -> remove from the idle queue after first
     execution"""
@@ -337,6 +341,7 @@ class CallbacksMainWindow(object):
         self._data.result_list_store.clear()
         del self._data.result_list_iter
         self._data.result_list_iter = dict()
+        self._data.result_issues.reset()
         resetInfo()
         return True
 
@@ -779,6 +784,9 @@ class MainWindow(object):
         self.result_list = self._glade.get_widget("tree_Results")
         self.result_list.set_model(self.result_list_store)
         self.result_list_iter = {}
+        # the issues of the remote machines are shown grouped
+        self.result_issues = tasker.issues()
+        self.result_issues.watch(self.issue_group_changed)
 
         def result_rend_text_func(column, cell_renderer, tree_model, iter,
                 (use_state_fg, use_state_bg, col)):
@@ -972,6 +980,12 @@ class MainWindow(object):
                     "EXCEPTION: %s (%s)" % (message["message"],
                         message["origin"].name))
 
+        elif message["action"]==reporting.TIMEOUT:
+            ctx = self.status_text.get_context_id(message["origin"].name)
+            gobject.idle_add(_o, self.status_text.push, ctx,
+                    "TIMEOUT: %s (%s)" % (message["message"],
+                        message["origin"].name))
+
         elif message["action"]==reporting.TABLE:
             if self._importance<=message["importance"]:
                 print("TABLE %s FROM %s" % (message["title"],
@@ -990,6 +1004,9 @@ class MainWindow(object):
                 ctx = self.status_text.get_context_id(message["origin"].name)
                 gobject.idle_add(_o, self.status_text.push, ctx,
                     "[%s] %s: %s" % (message["remote_name"], str(i), i.description))
+                if message["remote"]:
+                    # grouped by issue_group_changed
+                    return
                 t,ids = issue_state(i)
                 if not self.result_list_iter.has_key(iid):
                     self.result_list_iter[iid] = self.result_list_store.append(
@@ -1003,6 +1020,36 @@ class MainWindow(object):
             print("FIXME: Unknown message action %d!!" % (message["action"],))
             print(message)
 
+    def issue_group_changed(self, key, count, description):
+        """Called by the Tasker's IssueAggregator in the reporting thread"""
+        gobject.idle_add(_o, self.update_issue_group, key, count, description)
+
+    def update_issue_group(self, key, count, description):
+        """Show the group of remote issues, the remote column lists the
+        hosts in it"""
+        if count == 0:
+            if self.result_list_iter.has_key(key):
+                self.result_list_store.remove(self.result_list_iter.pop(key))
+            return
+
+        plugin, name, state = key
+        # only a few hosts are shown, do not list the whole group
+        hosts = self.result_issues.hosts(plugin, name, state, limit = 3)
+        if count == 1 and hosts:
+            remote = hosts[0]
+        else:
+            remote = "%d hosts: %s" % (count, ", ".join(hosts))
+            if count > 3:
+                remote += ", ..."
+
+        row = [name, state, description, _state_colors[state], remote]
+        if not self.result_list_iter.has_key(key):
+            self.result_list_iter[key] = self.result_list_store.append(row)
+        else:
+            for idx,val in enumerate(row):
+                self.result_list_store.set(self.result_list_iter[key], idx,
+                        val)
+
     def run(self):
         gtk.gdk.threads_init()
         gtk.gdk.threads_enter()
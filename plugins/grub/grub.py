@@ -45,6 +45,20 @@ class Grub(Plugin):
         """ Use the backup object to replace the first 446 bytes in all devs.
         """
         report.info("Entering revert...", origin = Grub)
+        if backup.exists(name = "firstblocks"):
+            try:
+                backup.restoreRange("firstblocks")
+            except Exception, e:
+                report.debug("There was an error reverting the first 446 " \
+                        "bytes of the devices, It is very probable that " \
+                        "they are in an invalid state. Error: %s" % e, \
+                        origin = Grub)
+                return
+            report.info("Successfully reverted changes to all devices.", \
+                    origin = Grub)
+            return
+
+        # backups made by older versions
         try:
             firstblockdict = backup.restoreValue("firstblockdict")
         except:
@@ -255,27 +269,16 @@ class Grub(Plugin):
         # Since we are going to install the stage1 grub image in all the
         # devices in self.install_grub_devs, we will backup all of them.
         # FIXME: We have to modify the plugin to consider partitions.
-        firstblockdict = {}
-
         if len(self.install_grub_devs) > 0:
             self._reporting.info("Going to backup all the first 446 bytes of " \
                     "%s." % self.install_grub_devs, origin = self)
-        for device in self.install_grub_devs:
-            fd = os.open(device.path(), os.O_RDONLY)
-            first446btemp = os.read(fd, 446)
-            os.close(fd)
-            firstblockdict[device.name()] = [first446btemp, device]
-
         if len(self.install_grub_parts) > 0:
             self._reporting.info("Going to backup all the first 446 bytes of " \
                     "%s." % self.install_grub_parts, origin = self)
-        for part in self.install_grub_parts:
-            fd = os.open(part.path(), os.O_RDONLY)
-            first446btemp = os.read(fd, 446)
-            os.close(fd)
-            firstblockdict[part.name()] = [first446btemp, part]
 
-        self.backupSpace.backupValue( firstblockdict, "firstblockdict")
+        ranges = [(dev.path(), 0, 446) for dev in \
+                self.install_grub_devs + self.install_grub_parts]
+        self.backupSpace.backupRanges(ranges, "firstblocks")
         self._result = ReturnSuccess
 
     def fix(self):
@@ -335,29 +338,20 @@ class Grub(Plugin):
         self._result = ReturnSuccess
 
     def restore(self):
-        firstblockdict = self.backupSpace.restoreValue("firstblockdict")
-        for (dev, val) in firstblockdict.iteritems():
-            devpath = val[1].path()
-            first446bytes = val[0]
-            self._reporting.info("Restoring changes for device %s." % devpath, \
-                    origin = self)
-            try:
-                fd = os.open(devpath, os.O_WRONLY)
-                os.write(fd, first446bytes)
-                os.close(fd)
-            except IOError, ie:
-                self._reporting.debug("There was an error writing to %s, It " \
-                        " is very probable that this device is in an invalid " \
-                        "state. Error: %s" % (devpath, ie), origin = self)
-                continue
-            except Exception, e:
-                self._reporting.debug("There was an unexpected error: %s" % e, \
-                        origin = self)
-                continue
+        self._reporting.info("Restoring changes for devices %s." % \
+                (self.install_grub_devs + self.install_grub_parts), \
+                origin = self)
+        try:
+            self.backupSpace.restoreRange("firstblocks")
+        except Exception, e:
+            self._reporting.debug("There was an error writing the first 446 " \
+                    "bytes of the devices, It is very probable that they " \
+                    "are in an invalid state. Error: %s" % e, origin = self)
+            self._result = ReturnFailure
+            return
 
-            self._reporting.info("Successfully restored changes to device " \
-                    "%s." % devpath, \
-                    origin = self)
+        self._reporting.info("Successfully restored changes to all devices.", \
+                origin = self)
         self._result = ReturnSuccess
 
     def clean(self):
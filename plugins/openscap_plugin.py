@@ -33,16 +33,21 @@ class OpenSCAPPlugin(Plugin):
     flows = Flow.init()
     flows["oscap_scan"] = Flow({
         Plugin.initial: {Return: "prepare"},
-        "prepare": {ReturnSuccess: "policy", ReturnFailure: "clean"},
+        "prepare": {ReturnSuccess: "policy", ReturnFailure: "clean",
+                    None: "clean"},
         "policy": {ReturnSuccess: "rules", ReturnFailure: "clean",
-                   ReturnAbort: "clean"},
+                   ReturnAbort: "clean", None: "clean"},
         "rules": {ReturnSuccess: "tailoring", ReturnFailure: "clean",
-                  ReturnBack: "policy", ReturnAbort: "clean"},
+                  ReturnBack: "policy", ReturnAbort: "clean", None: "clean"},
         "tailoring": {ReturnSuccess: "diagnose", ReturnFailure: "clean",
-                      ReturnBack: "rules", ReturnAbort: "clean"},
-        "diagnose": {ReturnSuccess: "results", ReturnFailure: "clean"},
-        "results": {ReturnSuccess: "clean", ReturnFailure: "clean"},
-        "clean": {ReturnSuccess: Plugin.final}
+                      ReturnBack: "rules", ReturnAbort: "clean",
+                      None: "clean"},
+        "diagnose": {ReturnSuccess: "results", ReturnFailure: "clean",
+                     None: "clean"},
+        "results": {ReturnSuccess: "clean", ReturnFailure: "clean",
+                    None: "clean"},
+        "clean": {ReturnSuccess: Plugin.final, ReturnFailure: Plugin.final,
+                  None: Plugin.final}
         }, description = "Performs a security and configuration audit of running system")
     flows["oscap_scan"].title = "Security Audit"
 
@@ -35,7 +35,9 @@ class PasswdPlugin(Plugin):
     flows = {}
     flows["resetRoot"] = Flow({
                     Plugin.initial: {Return: "resetRoot"},
-                    "resetRoot"     : {ReturnSuccess: Plugin.final}
+                    "resetRoot"     : {ReturnSuccess: Plugin.final,
+                                       ReturnFailure: Plugin.final,
+                                       None: Plugin.final}
                     }, description="Reset root password to random value so " \
                             "the user can login and change it",
                     title="Reset root password")
@@ -28,13 +28,13 @@ class Sample2Plugin(Plugin):
     flows = Flow.init(Plugin)
     flows["fix"] = Flow({
                     Plugin.initial: {Return: "prepare"},
-                    "prepare"     : {ReturnSuccess: "diagnose"},
-                    "diagnose"    : {ReturnSuccess: "clean", ReturnFailure: "backup"},
-                    "backup"      : {ReturnSuccess: "fix", ReturnFailure: "clean"},
-                    "restore"     : {ReturnSuccess: "clean", ReturnFailure: "clean"},
-                    "fix"         : {ReturnSuccess: "extraStep", ReturnFailure: "restore"},
-                    "extraStep"   : {ReturnSuccess: "clean", ReturnFailure: "clean"},
-                    "clean"       : {ReturnSuccess: Plugin.final}
+                    "prepare"     : {ReturnSuccess: "diagnose", ReturnFailure: "clean", None: "clean"},
+                    "diagnose"    : {ReturnSuccess: "clean", ReturnFailure: "backup", None: "clean"},
+                    "backup"      : {ReturnSuccess: "fix", ReturnFailure: "clean", None: "clean"},
+                    "restore"     : {ReturnSuccess: "clean", ReturnFailure: "clean", None: "clean"},
+                    "fix"         : {ReturnSuccess: "extraStep", ReturnFailure: "restore", None: "restore"},
+                    "extraStep"   : {ReturnSuccess: "clean", ReturnFailure: "clean", None: "clean"},
+                    "clean"       : {ReturnSuccess: Plugin.final, ReturnFailure: Plugin.final, None: Plugin.final}
                     }, description="Fixing sequence with one added extraStep")
 
     name = "Sample2Plugin"
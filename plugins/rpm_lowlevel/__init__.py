@@ -49,21 +49,21 @@ class RPMLowlevelPlugin(IssuesPlugin):
         self.rpm = None
 
     def prepare(self):
-        self.backup = self._backups.getBackup(self.__class__.__name__+" -- "+self.name)
+        self.backupSpace = self._backups.getBackup(self.__class__.__name__+" -- "+self.name)
         IssuesPlugin.prepare(self)
 
     def backup(self):
+        # the issues back up the files they change (see backupSpace.unlink)
         IssuesPlugin.backup(self)
-        self.backup.backupPath(path = os.path.join(Config.system.root,"/var/lib/rpm"), name="rpm")
         self._result=ReturnSuccess
 
     def restore(self):
-        self.backup.restorePath(path = os.path.join(Config.system.root,"/var/lib/rpm"), name="rpm")
+        self.backupSpace.restoreAll()
         IssuesPlugin.restore(self)
         self._result=ReturnSuccess
 
     def clean(self):
-        self._backups.closeBackup(self.backup._id)
+        self._backups.closeBackup(self.backupSpace._id)
         IssuesPlugin.clean(self)
         self._result=ReturnSuccess
 
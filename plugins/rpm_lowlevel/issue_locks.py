@@ -62,7 +62,7 @@ class Locks(Issue):
             return result
 
         for f in self.locks:
-            os.unlink(f)
+            self._plugin.backupSpace.unlink(f)
 
         self._fixed = True
         return True
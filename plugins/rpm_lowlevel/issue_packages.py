@@ -64,6 +64,8 @@ class Packages(Issue):
             return result
 
         dbname = os.path.join(Config.system.root,"/var/lib/rpm/Packages")
+        # rpm rewrites all the files of the database
+        self._plugin.backupSpace.preserve(os.path.dirname(dbname))
 
         if not self._db_missing:
             #dump&load the database
@@ -34,10 +34,10 @@ class UndeletePartition(Plugin):
     # We have not restore in the noBackup flow because we have no information to restore with.
     flows["noBackup"] = Flow({
                     Plugin.initial: {Return: "prepare"},
-                    "prepare"     : {ReturnSuccess: "diagnose"},
-                    "diagnose"    : {ReturnSuccess: "clean", ReturnFailure: "fix"},
-                    "fix"         : {ReturnSuccess: "clean", ReturnFailure: "clean"},
-                    "clean"       : {ReturnSuccess: Plugin.final}
+                    "prepare"     : {ReturnSuccess: "diagnose", ReturnFailure: "clean", None: "clean"},
+                    "diagnose"    : {ReturnSuccess: "clean", ReturnFailure: "fix", None: "clean"},
+                    "fix"         : {ReturnSuccess: "clean", ReturnFailure: "clean", None: "clean"},
+                    "clean"       : {ReturnSuccess: Plugin.final, ReturnFailure: Plugin.final, None: Plugin.final}
                     }, description="This flow skips the backup test.  Use with care.")
 
     name = "Undelete Partitions"
@@ -30,12 +30,18 @@ class Xserver(Plugin):
     flows = Flow.init(Plugin)
     flows["force"] = Flow({
             Plugin.initial: {Return: "prepare"},
-            "prepare"     : {ReturnSuccess: "diagnose2"},
-            "diagnose2"   : {ReturnSuccess: "clean", ReturnFailure: "backup"},
-            "backup"      : {ReturnSuccess: "fix", ReturnFailure: "clean"},
-            "restore"     : {ReturnSuccess: "clean", ReturnFailure: "clean"},
-            "fix"         : {ReturnSuccess: "clean", ReturnFailure: "restore"},
-            "clean"       : {ReturnSuccess: Plugin.final}
+            "prepare"     : {ReturnSuccess: "diagnose2", ReturnFailure: "clean",
+                None: "clean"},
+            "diagnose2"   : {ReturnSuccess: "clean", ReturnFailure: "backup",
+                None: "clean"},
+            "backup"      : {ReturnSuccess: "fix", ReturnFailure: "clean",
+                None: "clean"},
+            "restore"     : {ReturnSuccess: "clean", ReturnFailure: "clean",
+                None: "clean"},
+            "fix"         : {ReturnSuccess: "clean", ReturnFailure: "restore",
+                None: "restore"},
+            "clean"       : {ReturnSuccess: Plugin.final,
+                ReturnFailure: Plugin.final, None: Plugin.final}
           }, description="This flow skips the search for the xserver lock file")
     name = "X server"
     version = "0.0.1"
@@ -182,9 +188,16 @@ class Xserver(Plugin):
                     chroot = Config.system.root)
             self._reporting.info("Waiting for the X server to start...",
                     level = PLUGIN, origin = self)
-            time.sleep(5)
-            if proc.poll() is not None:
-                # process has terminated, failed.
+            # The server is up when its socket appears, give it at most
+            # 5 seconds (it may not create the socket in the chroot)
+            socket = join(Config.system.root,
+                    "/tmp/.X11-unix/X%s" % self.display.lstrip(":"))
+            deadline = time.time() + 5
+            while time.time() < deadline and self.continuing() \
+                  and proc.poll() is None and not os.path.exists(socket):
+                time.sleep(0.1)
+            if proc.poll() is not None or not self.continuing():
+                # process has terminated or we were cancelled, failed.
                 raise OSError
         except:
             self._reporting.info("The X server has failed to start",
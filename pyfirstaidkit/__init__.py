@@ -27,6 +27,8 @@ def initLogger(config=None):
 
     if config.log.method == "none":
         handler = logging.FileHandler("/dev/null")
+        # nobody reads the log, do not even format the records
+        Logger.setLevel(logging.CRITICAL + 1)
 
     elif config.log.method == "stdout" or config.log.method == None:
         handler = logging.StreamHandler(sys.stdout)
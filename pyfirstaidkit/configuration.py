@@ -18,6 +18,7 @@
 import ConfigParser
 import os
 import sys
+import atexit
 from cStringIO import StringIO
 from shlex import shlex
 import zipfile
@@ -40,6 +41,24 @@ def createDefaultConfig(config):
     config.operation.dependencies = "True"
     config.operation.interactive = "False"
     config.operation.printinfo = "False"
+    config.operation.jobs = "1"
+    config.operation.isolate = "False"
+    config.operation.timeout = ""
+    config.operation.grace = "30"
+    config.reporting.dispatcher = ""
+    config.reporting.buffer = "1000"
+    config.reporting.batch = "50"
+    config.reporting.progress = "0.1"
+    config.fleet.jobs = "8"
+    config.fleet.retries = "2"
+    config.fleet.backoff = "2"
+    config.fleet.timeout = ""
+    config.fleet.transport = "ssh"
+    config.fleet.shell = "firstaidkit-shell"
+    config.fleet.persist = "60"
+    config.fleet.connect_timeout = "10"
+    config.fleet.spool = ""
+    config.fleet.resume = "3"
     config.log.method = "file"
     config.log.filename = "/var/log/firstaidkit.log"
     config.log.fallbacks = "firstaidkit.log,/tmp/firstaidkit.log,/dev/null"
@@ -47,6 +66,8 @@ def createDefaultConfig(config):
     config.backup.method = "file"
     config.backup.rootpath = "/tmp"
     config.backup.fullpath = ""
+    config.backup.pool = ""
+    config.backup.jobs = "0"
     config.revert.all = "False"
     config.revert.dir = ""
     config.system.debug = "False"
@@ -172,6 +193,17 @@ Config = FAKConfig()
 createDefaultConfig(Config)
 Config.read(cfgfile)
 
+def resetConfig(config = Config):
+    """Return the config to the state it had after start, used by the long
+    running processes before every run"""
+    config.unlock()
+    for section in config.sections():
+        config.remove_section(section)
+    for option in config.defaults().keys():
+        config.remove_option("DEFAULT", option)
+    createDefaultConfig(config)
+    config.read(cfgfile)
+
 def getConfigBits(name, cfg = Config):
     """Returns conf object loaded with bits from designated config file/service
 
@@ -189,6 +221,7 @@ class FAKInfo(ConfigParser.SafeConfigParser, FAKConfigMixIn):
         FAKConfigMixIn.__init__(self)
         self._attachments = []
         self._raw_attachments = []
+        self._temporary = []
 
     def write(self, fd=sys.stdout):
         fd.write("--- Result files ---\n")
@@ -209,10 +242,26 @@ class FAKInfo(ConfigParser.SafeConfigParser, FAKConfigMixIn):
             fd.writestr(fas, c)
         fd.close()
 
-    def attach(self, file, saveas = None):
+    def attach(self, file, saveas = None, temporary = False):
+        """Add file to the results, the file is read when the results are
+        dumped.
+
+        temporary - remove the file when the results are reset or
+                    firstaidkit ends"""
         if saveas is None:
             saveas = file
         self._attachments.append((file, saveas))
+        if temporary:
+            self._temporary.append(file)
+
+    def cleanup(self):
+        """Remove the temporary attachments"""
+        for f in self._temporary:
+            try:
+                os.unlink(f)
+            except OSError:
+                pass
+        self._temporary = []
 
     def attachRaw(self, content, saveas):
         self._raw_attachments.append((content, saveas))
@@ -232,6 +281,9 @@ Info.lock()
 
 def resetInfo():
     global Info
+    Info._obj.cleanup()
     Info._obj = FAKInfo()
     Info.lock()
+
+atexit.register(lambda: Info.cleanup())
     
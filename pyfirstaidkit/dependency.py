@@ -21,32 +21,58 @@
 
 import logging
 import copy
+import threading
 from errors import *
 
 Logger=logging.getLogger("firstaidkit")
 
 class Dependencies(object):
-    """Encapsulate flags used to control the dependencies between plugins"""
+    """Encapsulate flags used to control the dependencies between plugins
+
+    The object can be shared by plugins running in parallel threads, all
+    the flag operations are serialized by the reentrant lock stored in the
+    lock attribute. Watchers are called with this lock held."""
     def __init__(self):
         self._provide = None
         self._known = set()
+        self._watchers = []
+        self.lock = threading.RLock()
         self.reset()
 
+    def _set(self, id):
+        if id not in self._provide:
+            self._provide.add(id)
+            self._changed(id, True)
+
+    def _unset(self, id):
+        if id in self._provide:
+            self._provide.remove(id)
+            self._changed(id, False)
+
+    def _changed(self, id, present):
+        for cb in self._watchers:
+            cb(id, present)
+
     def provide(self, id, setactionflag = True):
         """Add flag"""
         Logger.info("Setting dependency flag %s", id)
-        self._provide.add(id)
-        #Action flags denote activity happening on some regular flag
-        if setactionflag: self._provide.add(id+"?")
+        self.lock.acquire()
+        try:
+            self._set(id)
+            #Action flags denote activity happening on some regular flag
+            if setactionflag: self._set(id+"?")
+        finally:
+            self.lock.release()
 
     def unprovide(self, id, setactionflag = True):
         """Remove flag"""
         Logger.info("Resetting dependency flag %s", id)
+        self.lock.acquire()
         try:
-            self._provide.remove(id)
-        except KeyError: #not there
-            pass
-        if setactionflag: self._provide.add(id+"?")
+            self._unset(id)
+            if setactionflag: self._set(id+"?")
+        finally:
+            self.lock.release()
 
     donotprovide = unprovide #alias
     failed = unprovide #alias
@@ -59,16 +85,50 @@ class Dependencies(object):
         """Notifies the system about dep names used in the plugins.
 
         This allows us to list them in help"""
-        self._known = self._known.union(s)
+        self.lock.acquire()
+        try:
+            self._known = self._known.union(s)
+        finally:
+            self.lock.release()
 
     def known(self):
         """Returns list of known flags"""
-        return list(self._known.union(self._provide))
+        self.lock.acquire()
+        try:
+            return list(self._known.union(self._provide))
+        finally:
+            self.lock.release()
 
     def valid(self):
         """Returns list of valid/provided flags"""
-        return list(self._provide)
+        self.lock.acquire()
+        try:
+            return list(self._provide)
+        finally:
+            self.lock.release()
+
+    def watch(self, cb):
+        """Register callback cb(flag, present) to be called every time
+        a flag really changes its state"""
+        self.lock.acquire()
+        try:
+            self._watchers.append(cb)
+        finally:
+            self.lock.release()
+
+    def unwatch(self, cb):
+        """Remove callback registered by watch"""
+        self.lock.acquire()
+        try:
+            self._watchers.remove(cb)
+        finally:
+            self.lock.release()
 
     def reset(self):
-        self._provide = set()
+        """Remove all flags, watchers are not notified"""
+        self.lock.acquire()
+        try:
+            self._provide = set()
+        finally:
+            self.lock.release()
 
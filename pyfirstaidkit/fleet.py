@@ -0,0 +1,694 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Running firstaidkit-shell on remote machines.
+
+RemoteTask drives one firstaidkit-shell session, the transports decide how
+the shell gets started and FleetExecutor runs the sessions for many hosts
+with limited concurrency. IssueAggregator summarizes the issues the hosts
+report."""
+
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import time
+import hashlib
+import cPickle as pickle
+from collections import deque
+from itertools import islice
+from threading import Thread
+
+from reporting import FIRSTAIDKIT, END, ISSUE
+from configuration import Info, getConfigBits
+from issue import SimpleIssue
+import protocol
+
+#results of the RemoteTask
+OK = "ok"
+FAILED = "failed"
+TRANSIENT = "transient" #the shell could not be started, can be retried
+TIMEOUT = "timeout"
+
+class LocalTransport(object):
+    """Starts the shell on this machine, the address is ignored.
+
+    Useful for testing and for running firstaidkit-shell in a chroot or
+    a container (command can be eg. ["chroot", "/mnt", "firstaidkit-shell"])"""
+
+    def __init__(self, command = ("firstaidkit-shell",)):
+        self._command = list(command)
+
+    def spawn(self, address):
+        return subprocess.Popen(self._command, stdin = subprocess.PIPE,
+                stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                bufsize = 1, close_fds = True)
+
+    def transient(self, returncode):
+        """Return True when the failure to start the shell is worth
+        retrying"""
+        return False
+
+    def close(self):
+        pass
+
+class SSHTransport(LocalTransport):
+    """Starts the shell over ssh.
+
+    All sessions to one host share one ssh connection through a control
+    socket, the connection is kept open persist seconds after its last
+    session ends, so the retries and the next sessions do not have to go
+    through the handshake again."""
+
+    def __init__(self, command = "firstaidkit-shell", persist = 60,
+            connect_timeout = None, multiplex = True):
+        self._command = command
+        self._persist = persist
+        self._connect_timeout = connect_timeout
+        self._addresses = set()
+        self._lock = threading.Lock()
+        if multiplex:
+            self._controldir = tempfile.mkdtemp(prefix = "firstaidkit-ssh")
+        else:
+            self._controldir = None
+
+    def _options(self):
+        options = ["-q", "-T"]
+        if self._connect_timeout:
+            options.extend(["-o", "ConnectTimeout=%d" %
+                    self._connect_timeout])
+        if self._controldir is not None:
+            options.extend(["-o", "ControlMaster=auto",
+                    "-o", "ControlPath=%s" %
+                        os.path.join(self._controldir, "%r@%h:%p"),
+                    "-o", "ControlPersist=%d" % self._persist])
+        return options
+
+    def spawn(self, address):
+        self._lock.acquire()
+        try:
+            self._addresses.add(address)
+        finally:
+            self._lock.release()
+        return subprocess.Popen(["ssh"] + self._options() +
+                [address, self._command], stdin = subprocess.PIPE,
+                stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                bufsize = 1, close_fds = True)
+
+    def transient(self, returncode):
+        # ssh uses 255 for its own errors (connection refused, timeout, ..)
+        return returncode == 255
+
+    def close(self):
+        """Close the shared connections"""
+        if self._controldir is None:
+            return
+        null = open(os.devnull, "w")
+        try:
+            for address in self._addresses:
+                subprocess.call(["ssh"] + self._options() +
+                        ["-O", "exit", address], stdout = null,
+                        stderr = null, close_fds = True)
+        finally:
+            null.close()
+        shutil.rmtree(self._controldir, ignore_errors = True)
+        self._controldir = None
+
+class Archive(object):
+    """Result archive of a remote session, written to a temporary file as
+    it arrives"""
+
+    def __init__(self, name, directory = None):
+        fd, self.path = tempfile.mkstemp(prefix = "firstaidkit-%s-" % name,
+                suffix = ".zip", dir = directory)
+        self._file = os.fdopen(fd, "wb")
+        self._hash = hashlib.sha256()
+        self.size = 0
+
+    def write(self, data):
+        self._file.write(data)
+        self._hash.update(data)
+        self.size += len(data)
+
+    def copy(self, stream):
+        """Write everything from the file object"""
+        while True:
+            data = stream.read(protocol.CHUNK)
+            if not data:
+                break
+            self.write(data)
+
+    def hexdigest(self):
+        return self._hash.hexdigest()
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self.close()
+        os.unlink(self.path)
+
+class RemoteTask(Thread):
+    # how much of the shell's stderr is kept
+    stderr_limit = 64*1024
+
+    # seconds to wait before the first attempt to resume the session
+    resume_delay = 1.0
+
+    def __init__(self, reporting, name, address, configData,
+            transport = None, timeout = None, spool = None, resume = 0):
+        """configData - name of the config file sent to the shell (see
+                        getConfigBits) or the config object itself
+        timeout - seconds the whole session may take
+        spool - directory for the received result archives, None for the
+                system temporary directory
+        resume - how many times to reconnect and continue the session when
+                 the connection breaks"""
+        Thread.__init__(self)
+        self.state = SimpleIssue("Remote run on %s" % name, address)
+        self.conn = None
+        if isinstance(configData, basestring):
+            self.cfg = getConfigBits(configData)
+        else:
+            self.cfg = configData
+        self.reporting = reporting
+        self.name = name
+        self.address = address
+        if transport is None:
+            transport = SSHTransport(multiplex = False)
+        self.transport = transport
+        self.timeout = timeout
+        self.spool = spool
+        self.resume = resume
+        self.result = None
+        self.stderr = ""
+        self.session = None # name of the spooled session on the shell side
+        self.offset = 0 # how much of the session stream was read
+        self._ended = False
+        self._killed = False
+        self._drains = []
+        self._timedout = False
+        self._lock = threading.Lock()
+
+    def kill(self):
+        """Kill the session, the run returns as soon as possible"""
+        self._lock.acquire()
+        try:
+            self._killed = True
+            if self.conn is not None and self.conn.returncode is None:
+                try:
+                    self.conn.kill()
+                except OSError:
+                    pass
+        finally:
+            self._lock.release()
+
+    def _expire(self):
+        self._timedout = True
+        self.kill()
+
+    def run(self):
+        self.reporting.issue(issue = self.state, level = FIRSTAIDKIT, origin = self)
+        self._lock.acquire()
+        try:
+            self.conn = self.transport.spawn(self.address)
+        except OSError, e:
+            self.result = FAILED
+            self.state.set(checked = True, happened = True,
+                    reporting = self.reporting, origin = self)
+            self.reporting.error(message = "Could not start the session "
+                    "with %s: %s", args = (self.name, e),
+                    level = FIRSTAIDKIT, origin = self)
+            return
+        finally:
+            self._lock.release()
+
+        timer = None
+        if self.timeout:
+            timer = threading.Timer(self.timeout, self._expire)
+            timer.setDaemon(True)
+            timer.start()
+        try:
+            self.result = self._session()
+        finally:
+            if timer is not None:
+                timer.cancel()
+
+        if self._timedout:
+            self.result = TIMEOUT
+            self.reporting.timeout(message = "Remote run on %s did not "
+                    "finish in %s seconds and was killed", args = (self.name,
+                    self.timeout), level = FIRSTAIDKIT, origin = self)
+
+    def _session(self):
+        running = True
+        welcomeLine = self.conn.stdout.readline()
+        # start wasn't successful
+        if not welcomeLine.startswith("[firstaidkit-shell] Ready"):
+            self.state.set(checked = True, happened = True, reporting = self.reporting, origin = self)
+            if welcomeLine.startswith("The autenticity "): # ssh waiting for the fingerprint
+                (report_file, stderr) = self.conn.communicate("no\n")
+            else:
+                (report_file, stderr) = self.conn.communicate()
+            if not welcomeLine and \
+               self.transport.transient(self.conn.returncode):
+                return TRANSIENT
+            return FAILED
+
+        # use the framed protocol if the shell knows it
+        features = welcomeLine.split()
+        framed = "protocol=%d" % protocol.VERSION in features
+        resumable = framed and self.resume and "resume" in features
+        if framed:
+            self.conn.stdin.write("[protocol] %d\n" % protocol.VERSION)
+        if resumable:
+            self.conn.stdin.write("[resumable]\n")
+        self.cfg.write(self.conn.stdin)
+        self.conn.stdin.write("\n[commit]\n")
+
+        welcomeLine = self.conn.stdout.readline()
+        # config wasn't successful
+        if not welcomeLine.startswith("[firstaidkit-shell] Starting"):
+            self.state.set(checked = True, happened = True, reporting = self.reporting, origin = self)
+            (report_file, stderr) = self.conn.communicate("[abort]\n")
+            return FAILED
+        else:
+            self.state.set(checked = True, happened = False, reporting = self.reporting, origin = self)
+
+        self._startDrain()
+        archive = Archive(self.name, self.spool)
+        try:
+            if framed:
+                expected = self.receiveFrames(archive)
+                attempt = 0
+                while resumable and not self._ended and \
+                      self.session is not None and attempt < self.resume:
+                    attempt += 1
+                    if not self._reconnect(attempt):
+                        continue
+                    expected = self.receiveFrames(archive, self.offset) or \
+                            expected
+            else:
+                expected = None
+                while running:
+                    try:
+                        msg = pickle.load(self.conn.stdout)
+                    except EOFError:
+                        break
+                    except pickle.UnpicklingError, e:
+                        print e
+                        raise
+                    running = self.received(msg)
+                archive.copy(self.conn.stdout)
+            archive.close()
+        except:
+            archive.discard()
+            raise
+
+        if expected is not None and \
+           expected != (archive.size, archive.hexdigest()):
+            archive.discard()
+            self.reporting.error(message = "Result archive from %s is "
+                    "damaged (%d bytes received, %d expected)", args = (
+                    self.name, archive.size, expected[0]),
+                    level = FIRSTAIDKIT, origin = self)
+        elif archive.size == 0:
+            archive.discard()
+        else:
+            Info.attach(archive.path, "remote_report_%s.zip" % self.name,
+                    temporary = True)
+
+        # the shell in agent mode waits for the next session until its
+        # input is closed, the resumable one waits for the confirmation
+        try:
+            if resumable and self._ended:
+                self.conn.stdin.write("[done]\n")
+            self.conn.stdin.close()
+        except IOError:
+            pass
+        for drain in self._drains:
+            drain.join()
+        self.conn.wait()
+        if self.conn.returncode:
+            return FAILED
+        return OK
+
+    def _startDrain(self):
+        # the shell must never block on full stderr pipe
+        drain = Thread(target = self._drain, args = (self.conn,))
+        drain.setDaemon(True)
+        drain.start()
+        self._drains.append(drain)
+
+    def _reconnect(self, attempt):
+        """Start new shell and ask it for the rest of the session, return
+        False when it did not work"""
+        self.reporting.info("Connection to %s was lost, resuming the "
+                "session (attempt %d of %d)", args = (self.name, attempt,
+                self.resume), level = FIRSTAIDKIT, origin = self)
+        time.sleep(self.resume_delay * 2 ** (attempt - 1))
+
+        self._lock.acquire()
+        try:
+            if self._killed:
+                return False
+            old = self.conn
+            try:
+                old.stdin.close()
+            except IOError:
+                pass
+            if old.poll() is None:
+                try:
+                    old.kill()
+                except OSError:
+                    pass
+            old.wait()
+            try:
+                self.conn = self.transport.spawn(self.address)
+            except OSError:
+                self.conn = old
+                return False
+        finally:
+            self._lock.release()
+
+        try:
+            welcomeLine = self.conn.stdout.readline()
+            if "resume" not in welcomeLine.split():
+                return False
+            self.conn.stdin.write("[resume] %s %d\n" % (self.session,
+                self.offset))
+            if not self.conn.stdout.readline().startswith(
+                    "[firstaidkit-shell] Starting"):
+                return False
+        except IOError:
+            return False
+        self._startDrain()
+        return True
+
+    def _drain(self, conn):
+        """Read the stderr of the shell, keep only the end of it"""
+        while True:
+            data = conn.stderr.read(protocol.CHUNK)
+            if not data:
+                break
+            self.stderr = (self.stderr + data)[-self.stderr_limit:]
+
+    def received(self, msg):
+        """Pass message from the remote machine to our reporting, return
+        False after the final message"""
+
+        # set issue origin if it comes from this machine
+        if not msg["remote"] and msg["action"] == ISSUE:
+            msg["message"].remote_name = self.name
+            msg["message"].remote_address = self.address
+
+        # set message origin and remote state so nobody changes the origin again
+        if not msg["remote"]:
+            msg["remote"] = True
+            msg["remote_name"] = self.name
+            msg["remote_address"] = self.address
+
+        self.reporting.put_raw(msg)
+        return not (msg["level"]==FIRSTAIDKIT and msg["action"]==END)
+
+    def receiveFrames(self, archive, offset = 0):
+        """Read the framed stream of the remote shell, write the result file
+        to the archive. Return the (size, sha256 digest) the shell announced
+        for the result file, None when it did not send any.
+
+        offset - where in the session stream the shell starts, when
+                 resuming the session"""
+        reader = protocol.FrameReader(self.conn.stdout, offset)
+        expected = None
+        while True:
+            frame = reader.read()
+            if frame is None:
+                break
+            self.offset = reader.offset
+            channel, payload = frame
+            if channel == protocol.ATTACHMENT:
+                archive.write(payload)
+                continue
+
+            data = protocol.decode(payload)
+            if data is None:
+                reader.broken += 1
+            elif channel == protocol.MESSAGES:
+                for msg in data:
+                    self.received(msg)
+            elif channel == protocol.CONTROL:
+                command, args = data
+                if command == "end":
+                    self._ended = True
+                    break
+                elif command == "session":
+                    self.session = args[0]
+                elif command == "attachment":
+                    expected = tuple(args)
+                elif command == "error":
+                    self.reporting.error(message = "%s: %s", args = (
+                        self.name, args[0]), level = FIRSTAIDKIT,
+                        origin = self)
+
+        if reader.skipped or reader.broken:
+            self.reporting.alert(message = "Stream from %s was damaged, "
+                    "%d bytes and %d frames were skipped", args = (self.name,
+                    reader.skipped, reader.broken), level = FIRSTAIDKIT,
+                    origin = self)
+        return expected
+
+class FleetExecutor(object):
+    """Runs the remote sessions for a list of hosts.
+
+    At most jobs sessions run at the same time, the rest of the hosts wait
+    in a queue. Sessions which failed before the shell was started (see
+    Transport.transient) are retried with exponential backoff."""
+
+    name = "Fleet"
+
+    def __init__(self, reporting, transport, jobs = 8, retries = 2,
+            backoff = 2.0, timeout = None, spool = None, resume = 0):
+        """timeout - seconds one session may take, None for no limit
+        spool - directory for the result archives, see RemoteTask
+        resume - how many times to resume a broken session, see RemoteTask"""
+        self._reporting = reporting
+        self._transport = transport
+        self._spool = spool
+        self._resume = resume
+        self._jobs = max(1, jobs)
+        self._retries = retries
+        self._backoff = backoff
+        self._timeout = timeout
+        self._hosts = deque()
+        self._threads = []
+        self._active = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self.results = {} # host name -> result of its last attempt
+
+    def start(self, hosts):
+        """Start working on the hosts, list of (name, address, configData)
+        triples, in the background"""
+        self._hosts.extend(hosts)
+        for i in range(min(self._jobs, len(self._hosts))):
+            th = Thread(target = self._worker)
+            th.setDaemon(True)
+            th.start()
+            self._threads.append(th)
+
+    def run(self, hosts):
+        """Process all the hosts and return the results"""
+        self.start(hosts)
+        self.join()
+        return self.results
+
+    def join(self):
+        """Wait for all the hosts to be processed and close the
+        transport"""
+        for th in self._threads:
+            th.join()
+        self._threads = []
+        self._transport.close()
+
+    def cancel(self):
+        """Do not start any more sessions and kill the running ones"""
+        self._stopped.set()
+        self._lock.acquire()
+        try:
+            for task in self._active:
+                task.kill()
+        finally:
+            self._lock.release()
+
+    def _worker(self):
+        while not self._stopped.isSet():
+            self._lock.acquire()
+            try:
+                if not self._hosts:
+                    return
+                name, address, cfg = self._hosts.popleft()
+            finally:
+                self._lock.release()
+            self.results[name] = self._runHost(name, address, cfg)
+
+    def _runHost(self, name, address, cfg):
+        attempt = 0
+        while True:
+            task = RemoteTask(self._reporting, name, address, cfg,
+                    transport = self._transport, timeout = self._timeout,
+                    spool = self._spool, resume = self._resume)
+            self._lock.acquire()
+            self._active.add(task)
+            self._lock.release()
+            try:
+                task.run()
+            finally:
+                self._lock.acquire()
+                self._active.discard(task)
+                self._lock.release()
+
+            if task.result != TRANSIENT or attempt >= self._retries or \
+               self._stopped.isSet():
+                return task.result
+
+            delay = self._backoff * 2 ** attempt
+            attempt += 1
+            self._reporting.info("Could not connect to %s, retrying in %s "
+                    "seconds", args = (name, delay), level = FIRSTAIDKIT,
+                    origin = self)
+            self._stopped.wait(delay)
+
+def issueState(issue):
+    """Return name of the state the issue is in"""
+    if issue._exception or issue._error:
+        return "Error"
+    elif issue._skipped:
+        return "No result"
+    elif issue._fixed:
+        return "Fixed"
+    elif issue._happened and issue._checked:
+        return "Detected"
+    elif issue._checked:
+        return "No problem"
+    else:
+        return "Waiting for check"
+
+class IssueAggregator(object):
+    """Fleet-wide summary of the issues reported by the remote machines.
+
+    The issues are grouped by (plugin, issue name, state) and every group
+    keeps only the names of its hosts, so the same problem found on hundreds
+    of machines is one row of the summary. When an issue changes its state,
+    the host moves to another group. Issues of the local machine are
+    ignored."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers = []
+        self.reset()
+
+    def reset(self):
+        self._groups = {} # (plugin, name, state) -> set of hosts
+        self._order = [] # the keys in the order they appeared
+        self._states = {} # (plugin, name) -> states which have a group
+        self._descriptions = {} # (plugin, name) -> description
+
+    def watch(self, callback):
+        """Call callback(key, number of hosts, description) whenever
+        a group changes"""
+        self._watchers.append(callback)
+
+    def add(self, message):
+        """Account the ISSUE message, return list of (key, number of hosts)
+        pairs for the groups which have changed"""
+        if message["action"] != ISSUE or not message["remote"]:
+            return []
+        issue = message["message"]
+        host = message["remote_name"]
+        issuekey = (message["origin"].name, issue.name)
+        state = issueState(issue)
+        key = issuekey + (state,)
+
+        self._lock.acquire()
+        try:
+            self._descriptions[issuekey] = issue.description
+            if host in self._groups.get(key, ()):
+                return []
+            changed = []
+            for old in self._states.get(issuekey, ()):
+                oldkey = issuekey + (old,)
+                if host in self._groups[oldkey]:
+                    self._groups[oldkey].discard(host)
+                    changed.append((oldkey, len(self._groups[oldkey])))
+                    break
+            if key not in self._groups:
+                self._groups[key] = set()
+                self._order.append(key)
+                self._states.setdefault(issuekey, []).append(state)
+            self._groups[key].add(host)
+            changed.append((key, len(self._groups[key])))
+        finally:
+            self._lock.release()
+
+        for callback in self._watchers:
+            for changedkey, count in changed:
+                callback(changedkey, count, issue.description)
+        return changed
+
+    def process(self, reports, message):
+        """Callback for the Reports.subscribe"""
+        self.add(message)
+
+    def summary(self):
+        """Return list of (plugin, issue name, state, number of hosts,
+        description) rows, the most common ones first"""
+        self._lock.acquire()
+        try:
+            rows = [key + (len(self._groups[key]),
+                           self._descriptions[key[:2]])
+                    for key in self._order if self._groups[key]]
+        finally:
+            self._lock.release()
+        rows.sort(key = lambda row: -row[3])
+        return rows
+
+    def hosts(self, plugin, name, state, limit = None):
+        """Return sorted list of the hosts in the group, at most limit
+        of them (any ones) when it is given"""
+        self._lock.acquire()
+        try:
+            hosts = self._groups.get((plugin, name, state), ())
+            if limit is not None:
+                hosts = islice(hosts, limit)
+            return sorted(hosts)
+        finally:
+            self._lock.release()
+
+    def host(self, host):
+        """Return sorted list of (plugin, issue name, state) reported by
+        the host"""
+        self._lock.acquire()
+        try:
+            return sorted([key for key in self._order
+                           if host in self._groups[key]])
+        finally:
+            self._lock.release()
+
+    def __len__(self):
+        """Number of the non-empty groups"""
+        return len([hosts for hosts in self._groups.itervalues() if hosts])
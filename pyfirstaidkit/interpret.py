@@ -20,82 +20,46 @@ import sys
 from plugins import PluginSystem
 from reporting import Reports, TASKER, PLUGINSYSTEM, FIRSTAIDKIT, END, ISSUE
 import logging
-import copy
 from errors import *
-from utils import FileBackupStore
+from utils import FileBackupStore, ChunkedBackupStore
 from dependency import Dependencies
+from scheduler import Scheduler
 from configuration import Info, getConfigBits
 from threading import Thread
 from issue import SimpleIssue
-import subprocess
-import cPickle as pickle
+from fleet import RemoteTask, FleetExecutor, SSHTransport, LocalTransport, \
+        IssueAggregator
 import ConfigParser
-
-class RemoteTask(Thread):
-    def __init__(self, reporting, name, address, configData):
+import shlex
+
+def option(section, key, convert, default):
+    """Return the converted value of the numeric option, report the value
+    which cannot be converted and use the default instead"""
+    value = getattr(section, key)
+    try:
+        return convert(value)
+    except ValueError:
+        logging.getLogger("firstaidkit").error("Invalid value %r of option "
+                "%s in section %s, using %s", value, key,
+                section.__dict__["__section_name"], default)
+        return default
+
+class Worker(Thread):
+    """One of the threads running plugins in the parallel mode"""
+
+    def __init__(self, tasker, scheduler):
         Thread.__init__(self)
-        self.state = SimpleIssue("Remote run on %s" % name, address)
-        self.conn = None
-        self.cfg = getConfigBits(configData)
-        self.reporting = reporting
-        self.name = name
-        self.address = address
-        
+        self.tasker = tasker
+        self.scheduler = scheduler
+        self.exc_info = None
+
     def run(self):
-        running = True
-        self.reporting.issue(issue = self.state, level = FIRSTAIDKIT, origin = self)
-        self.conn = subprocess.Popen(["ssh", "-q", "-T", self.address, "firstaidkit-shell"],
-                                stdin = subprocess.PIPE, stdout = subprocess.PIPE, stderr = subprocess.PIPE,
-                                bufsize = 1, close_fds = True)
-
-        welcomeLine = self.conn.stdout.readline()
-        # start wasn't successful
-        if not welcomeLine.startswith("[firstaidkit-shell] Ready"):
-            self.state.set(checked = True, happened = True, reporting = self.reporting, origin = self)
-            if welcomeLine.startswith("The autenticity "): # ssh waiting for the fingerprint
-                (report_file, stderr) = self.conn.communicate("no\n")
-            else:
-                (report_file, stderr) = self.conn.communicate()
-            return
-        
-        self.cfg.write(self.conn.stdin)
-        self.conn.stdin.write("\n[commit]\n")
-
-        welcomeLine = self.conn.stdout.readline()
-        # config wasn't successful
-        if not welcomeLine.startswith("[firstaidkit-shell] Starting"):
-            self.state.set(checked = True, happened = True, reporting = self.reporting, origin = self)
-            (report_file, stderr) = self.conn.communicate("[abort]\n")
-            return
-        else:
-            self.state.set(checked = True, happened = False, reporting = self.reporting, origin = self)
-            
-        while running:
-            try:
-                msg = pickle.load(self.conn.stdout)
-            except pickle.UnpicklingError, e:
-                print e
-                raise
-            if msg["level"]==FIRSTAIDKIT and msg["action"]==END:
-                running = False
-
-            # set issue origin if it comes from this machine
-            if not msg["remote"] and msg["action"] == ISSUE:
-                msg["message"].remote_name = self.name
-                msg["message"].remote_address = self.address
-
-            # set message origin and remote state so nobody changes the origin again
-            if not msg["remote"]:
-                msg["remote"] = True
-                msg["remote_name"] = self.name
-                msg["remote_address"] = self.address
-                
-            self.reporting.put_raw(msg)
-            
-        report_file = self.conn.stdout.read()
-        stderr = self.conn.stderr.read()
-        Info.attachRaw(report_file, "remote_report_%s.zip" % self.name)
-        self.conn.wait()
+        try:
+            self.tasker.runTasks(self.scheduler, wait = True)
+        except:
+            # let the other workers finish and reraise it in the Tasker
+            self.exc_info = sys.exc_info()
+            self.scheduler.stop()
 
 class Tasker(object):
     """The main interpret of tasks described in Config object"""
@@ -106,6 +70,8 @@ class Tasker(object):
             backups = None, pluginsystem = None):
         self._config = cfg
         self._running = True
+        self._scheduler = None
+        self._fleet = None
 
         if dependencies is None:
             self._provide = Dependencies()
@@ -117,13 +83,40 @@ class Tasker(object):
         else:
             self._reporting = reporting
 
+        # summary of the issues found on the remote machines
+        self._issues = IssueAggregator()
+        self._reporting.subscribe(self._issues.process, actions = (ISSUE,))
+
+        try:
+            self._reporting.setProgressWindow(float(cfg.reporting.progress))
+        except ValueError:
+            pass
+
+        if cfg.reporting.dispatcher:
+            try:
+                self._reporting.startDispatcher(
+                        size = int(cfg.reporting.buffer),
+                        batch = int(cfg.reporting.batch),
+                        policy = cfg.reporting.dispatcher)
+            except ValueError, e:
+                logging.getLogger("firstaidkit").error(
+                        "Reporting dispatcher not started: %s", e)
+
         if backups is None:
             if cfg.backup.fullpath:
                 # rootpath is silly if fullpath is set by user.
                 cfg.backup.rootpath = ""
 
-            self._backups = FileBackupStore(rootpath = cfg.backup.rootpath,
-                    fullpath = cfg.backup.fullpath)
+            if cfg.backup.method == "chunked":
+                self._backups = ChunkedBackupStore(
+                        rootpath = cfg.backup.rootpath,
+                        fullpath = cfg.backup.fullpath, pool = cfg.backup.pool)
+            else:
+                jobs = option(cfg.backup, "jobs", int, 0)
+                self._backups = FileBackupStore(rootpath = cfg.backup.rootpath,
+                        fullpath = cfg.backup.fullpath,
+                        compress = cfg.backup.method == "compressed",
+                        jobs = jobs)
             cfg.backup.fullpath = self._backups._path
         else:
             self._backups = backups
@@ -132,10 +125,18 @@ class Tasker(object):
             self.pluginSystem = PluginSystem(interpret = self, reporting = self._reporting,
                     dependencies = self._provide, backups = self._backups)
         else:
+            # plugins imported for previous run
+            pluginsystem.rebind(interpret = self, reporting = self._reporting,
+                    dependencies = self._provide, backups = self._backups)
             self.pluginSystem = pluginsystem
 
     def interrupt(self):
         self._running = False
+        if self._scheduler is not None:
+            self._scheduler.stop()
+        if self._fleet is not None:
+            self._fleet.cancel()
+        self.pluginSystem.cancel("The step was interrupted")
         self._reporting.info("You sent an interrupt signal to "
                 "Tasker! This is not recommended.", level = TASKER,
                 origin = self, importance = logging.WARNING)
@@ -152,9 +153,56 @@ class Tasker(object):
     def pluginsystem(self):
         return self.pluginSystem
 
+    def issues(self):
+        return self._issues
+
+    def backups(self):
+        return self._backups
+
+    def runTasks(self, scheduler, wait = False):
+        """Run the (plugin, flow) tasks provided by scheduler until there
+        is no task ready or the Tasker is interrupted.
+
+        wait - wait for tasks which get ready when some other worker
+               finishes its plugin"""
+        while self._running:
+            task = scheduler.get(wait = wait)
+            if task is None:
+                break
+            plugin, flow = task
+            try:
+                if self._config.operation.isolate == "True":
+                    self.pluginSystem.isolatedrun(plugin, flow = flow,
+                            dependencies = False)
+                else:
+                    self.pluginSystem.autorun(plugin, flow = flow,
+                            dependencies = False)
+            finally:
+                scheduler.done(task)
+
+    def fleet(self):
+        """Return FleetExecutor configured by the fleet section"""
+        cfg = self._config.fleet
+        timeout = None
+        if cfg.timeout:
+            timeout = option(cfg, "timeout", float, None)
+        if cfg.transport == "local":
+            transport = LocalTransport(shlex.split(cfg.shell))
+        else:
+            transport = SSHTransport(cfg.shell,
+                    persist = option(cfg, "persist", int, 60),
+                    connect_timeout = option(cfg, "connect_timeout", int, 10))
+        return FleetExecutor(self._reporting, transport,
+                jobs = option(cfg, "jobs", int, 8),
+                retries = option(cfg, "retries", int, 2),
+                backoff = option(cfg, "backoff", float, 2),
+                timeout = timeout, spool = cfg.spool or None,
+                resume = option(cfg, "resume", int, 3))
+
     def end(self):
         """Signalize end of operations to all necessary places"""
         self._reporting.end(origin = self, level = FIRSTAIDKIT)
+        self._reporting.stopDispatcher()
 
     def run(self):
         self._reporting.start(level = TASKER, origin = self)
@@ -191,7 +239,7 @@ class Tasker(object):
             elif self._config.operation.mode == "monitor":
                 pluginlist = []
             else:
-                pluginlist = set(pluginSystem.list())
+                pluginlist = sorted(pluginSystem.list())
 
             if self._config.operation.mode == "auto-flow":
                 flows = len(pluginlist)*[self._config.operation.flow]
@@ -201,62 +249,80 @@ class Tasker(object):
             else:
                 flows = len(pluginlist)*[None]
 
-            #prepare remote tasks
-            remoteThreads = []
+            #start remote tasks, they run in the background
             if self._config.has_section("remote"):
-                targets = self._config.items("remote")
-                for (name, spec) in targets:
+                hosts = []
+                for (name, spec) in self._config.items("remote"):
                     address, cfg = spec.split(None, 1)
-                    remoteThreads.append(RemoteTask(self._reporting, name, address, cfg))
-
-            #start remote tasks
-            for th in remoteThreads:
-                th.start()
-
-            #iterate through plugins until there is no plugin left or no
-            #action performed during whole iteration
-            oldlist = set()
-            actlist = set(zip(pluginlist, flows))
-
+                    hosts.append((name, address, cfg))
+                self._issues.reset()
+                self._fleet = self.fleet()
+                self._fleet.start(hosts)
+
+            #build the readiness graph, plugins which can never run are
+            #reported here, before anything is started
+            scheduler = Scheduler(self._provide,
+                    usedeps = self._config.operation.dependencies != "False")
+            for plugin, flow in zip(pluginlist, flows):
+                pklass = pluginSystem.getplugin(plugin)
+                if (flow or pklass.default_flow) not in pklass.getFlows():
+                    self._reporting.info("Plugin %s does not contain "
+                            "flow %s"% (plugin, flow or pklass.default_flow,),
+                            level = TASKER, origin = self)
+                    continue
+                scheduler.add((plugin, flow), pklass.getDeps(),
+                        pklass.getConflicts())
+
+            impossible = scheduler.impossible()
+            for (plugin, flow), flags in impossible.iteritems():
+                self._reporting.info("Plugin %s can never be called, it "
+                        "both requires and conflicts with %s" %
+                        (plugin, ", ".join(flags)), level = TASKER,
+                        origin = self, importance = logging.WARNING)
+
+            #start every plugin as soon as its last condition is satisfied,
+            #the scheduler has already checked the flags for autorun
             self._running = True
-            while self._running and len(actlist)>0 and oldlist!=actlist:
-                oldlist = copy.copy(actlist)
-
-                for plugin,flow in oldlist:
-                    #If interruption was requested, stop
-                    if not self._running:
-                        break
-                    
-                    #If plugin does not contain the automated flow or if
-                    #it ran correctly, remove it from list
-                    if ((flow and
-                        not flow in pluginSystem.getplugin(plugin).getFlows())
-                        or (not flow and
-                            not pluginSystem.getplugin(plugin).default_flow in
-                            pluginSystem.getplugin(plugin).getFlows())):
-
-                        self._reporting.info("Plugin %s does not contain "
-                                "flow %s"% (plugin, flow or \
-                                pluginSystem.getplugin(plugin).default_flow,), \
-                                level = TASKER, origin = self)
-
-                        actlist.remove((plugin, flow))
-
-                    elif (pluginSystem.autorun(plugin, flow = flow,
-                            dependencies = self._config.operation.dependencies
-                            != "False")):
-                        actlist.remove((plugin, flow))
+            self._scheduler = scheduler
+            jobs = option(self._config.operation, "jobs", int, 1)
+
+            try:
+                if jobs > 1:
+                    self._reporting.info("Running up to %d plugins in "
+                            "parallel" % jobs, level = TASKER, origin = self)
+                    workers = [Worker(self, scheduler) for i in range(jobs)]
+                    for th in workers:
+                        th.start()
+                    for th in workers:
+                        th.join()
+                    for th in workers:
+                        if th.exc_info is not None:
+                            raise th.exc_info[0], th.exc_info[1], \
+                                    th.exc_info[2]
+                else:
+                    self.runTasks(scheduler)
+            finally:
+                self._scheduler = None
+                scheduler.close()
 
             #some plugins may not be called because of unfavorable flags
             if self._running:
-                for plugin in set(map(lambda x: x[0], actlist)):
-                    self._reporting.info("Plugin %s was not called because of "
-                                         "unsatisfied dependencies"% (plugin,), level = TASKER, \
-                                         origin = self, importance = logging.WARNING)
+                for (plugin, flow), missing, present in scheduler.blocked():
+                    if (plugin, flow) in impossible:
+                        continue
+                    self._reporting.info("Plugin %s was not called because "
+                            "of unsatisfied dependencies (missing: %s, "
+                            "conflicting: %s)" % (plugin,
+                                ", ".join(missing) or "none",
+                                ", ".join(present) or "none"), level = TASKER,
+                            origin = self, importance = logging.WARNING)
 
             #wait until the remotes finish
-            for th in remoteThreads:
-                th.join()
+            if self._fleet is not None:
+                self._fleet.join()
+                self._fleet = None
+                self._reporting.table(self._issues.summary(), level = TASKER,
+                        origin = self, title = "Fleet issue summary")
                 
         # For the flags case
         elif self._config.operation.mode == "flags":
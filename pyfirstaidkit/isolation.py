@@ -0,0 +1,169 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Support for running plugin flows in forked worker processes.
+
+The worker sends everything the parent needs to know as records over
+a pipe: reporting messages, flag changes, the Info section of the plugin
+and the final result."""
+
+import os
+import thread
+import select
+import struct
+import time
+import logging
+import cPickle as pickle
+
+from reporting import Reports, ISSUE, ALERT, FIRSTAIDKIT, QUESTIONS
+from issue import SimpleIssue
+
+class ChannelTimeout(Exception):
+    pass
+
+class Channel(object):
+    """Length prefixed pickled records sent over one direction of a pipe"""
+
+    _header = struct.Struct("!I")
+
+    def __init__(self, fd):
+        self._fd = fd
+        # the pending progress is sent from a timer thread
+        self._lock = thread.allocate_lock()
+
+    def send(self, *record):
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        data = self._header.pack(len(data)) + data
+        self._lock.acquire()
+        try:
+            while data:
+                written = os.write(self._fd, data)
+                data = data[written:]
+        finally:
+            self._lock.release()
+
+    def _read(self, size, deadline):
+        chunks = []
+        while size > 0:
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ChannelTimeout()
+                r, w, x = select.select([self._fd], [], [], remaining)
+                if not r:
+                    raise ChannelTimeout()
+            chunk = os.read(self._fd, size)
+            if not chunk:
+                return None
+            chunks.append(chunk)
+            size -= len(chunk)
+        return "".join(chunks)
+
+    def receive(self, deadline = None):
+        """Return next record or None when the other side closed the pipe.
+
+        deadline - time.time() value, ChannelTimeout is raised when no
+                   complete record arrives before it"""
+        header = self._read(self._header.size, deadline)
+        if header is None:
+            return None
+        data = self._read(self._header.unpack(header)[0], deadline)
+        if data is None:
+            return None
+        return pickle.loads(data)
+
+    def close(self):
+        os.close(self._fd)
+
+def fork(locks = ()):
+    """os.fork which holds the given locks and the locks of the logging
+    system during the fork, so the child does not inherit them in locked
+    state from some other thread"""
+    handlers = []
+    for name in (None, "firstaidkit"):
+        handlers.extend(logging.getLogger(name).handlers)
+
+    for lock in locks:
+        lock.acquire()
+    logging._acquireLock()
+    for handler in handlers:
+        handler.acquire()
+    try:
+        return os.fork()
+    finally:
+        for handler in reversed(handlers):
+            handler.release()
+        logging._releaseLock()
+        for lock in reversed(locks):
+            lock.release()
+
+def portable(data):
+    """Return copy of the message which can be sent to another process.
+
+    Issues are replaced by their plain snapshots (they reference the plugin
+    instance) and the reply mailboxes are dropped."""
+    data = data.copy()
+    data["reply"] = None
+    if data["action"] == ISSUE and isinstance(data["message"], SimpleIssue):
+        data["message"] = data["message"].snapshot()
+    try:
+        pickle.dumps(data["message"], pickle.HIGHEST_PROTOCOL)
+    except Exception:
+        data["message"] = str(data["message"])
+    return data
+
+class PipeReports(Reports):
+    """Reports object used inside the worker, sends everything to parent.
+
+    Questions cannot be answered from the worker, they are reported as
+    alerts and the plugin receives no answer."""
+
+    def __init__(self, channel, parent_filter = None, *args, **kwargs):
+        """parent_filter - Reports object of the parent process, only the
+                           messages it wants are sent"""
+        Reports.__init__(self, *args, **kwargs)
+        self._channel = channel
+        self._filter = parent_filter
+        if parent_filter is not None:
+            # do not send the progress the parent would throw away
+            self.setProgressWindow(parent_filter._progress_window)
+
+    def wants(self, importance, action):
+        if self._filter is None:
+            return True
+        return self._filter.wants(importance, action)
+
+    def put_raw(self, data, destination = None):
+        if destination is not None:
+            return destination.put_raw(data)
+
+        for data in self._throttle(data):
+            self._put(data)
+
+    def _put(self, data):
+        if data["action"] in QUESTIONS:
+            data["reply"].end(level = FIRSTAIDKIT, origin = self)
+            data = data.copy()
+            data["action"] = ALERT
+            data["message"] = "Question '%s' can't be answered from an " \
+                    "isolated plugin" % (data["message"].prompt,)
+
+        self._channel.send("message", portable(data))
+
+    def notifyAll(self, data, sender = None):
+        # mailboxes inside the worker are local only
+        pass
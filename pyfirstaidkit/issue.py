@@ -89,6 +89,22 @@ Return values:
     def skipped(self):
         return self._skipped
 
+    def snapshot(self):
+        """Return plain SimpleIssue with the same id and state.
+
+        Useful when the issue has to leave the plugin, eg. to be pickled and
+        sent to other process."""
+        s = SimpleIssue(self.name, self.description, self.remote_name,
+                self.remote_address)
+        s.id = self.id
+        s._checked = self._checked
+        s._happened = self._happened
+        s._fixed = self._fixed
+        s._exception = self._exception
+        s._error = self._error
+        s._skipped = self._skipped
+        return s
+
     def error(self):
         return self._error
 
@@ -0,0 +1,115 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Cache of the plugin metadata, so the plugins do not have to be imported
+just to be listed or scheduled."""
+
+import os
+import tempfile
+import cPickle as pickle
+
+def stamp(path, module):
+    """Return the names, mtimes and sizes of the files the module in path
+    consists of, the cached metadata is valid only for the same stamp"""
+    fullpath = os.path.join(path, module)
+    if os.path.isdir(fullpath):
+        files = []
+        for root, dirs, names in os.walk(fullpath):
+            files.extend([os.path.join(root, n) for n in names])
+    else:
+        files = [fullpath+ext for ext in (".py", ".so", ".pyc", ".pyo")]
+
+    res = []
+    for f in sorted(files):
+        # compiled files change when python rewrites them, use the sources
+        if f[-4:] in (".pyc", ".pyo") and os.path.exists(f[:-1]):
+            continue
+        try:
+            st = os.stat(f)
+        except OSError:
+            continue
+        res.append((f[len(path):], st.st_mtime, st.st_size))
+    return tuple(res)
+
+class PluginManifest(object):
+    """Metadata of all the plugins from one plugin directory.
+
+    The manifest is stored in the directory itself. For every module it
+    remembers the stamp of its files and the list of (plugin name, metadata)
+    pairs for all the plugins the module provides."""
+
+    filename = ".firstaidkit-manifest"
+    version = 2
+
+    def __init__(self, path):
+        self._path = path
+        self._entries = {}
+        self._changed = False
+        try:
+            f = open(os.path.join(path, self.filename), "rb")
+            try:
+                version, entries = pickle.load(f)
+            finally:
+                f.close()
+            if version == self.version:
+                self._entries = entries
+        except Exception:
+            # missing or broken manifest, everything gets imported
+            pass
+
+    def get(self, module, stamp):
+        """Return the plugin list for module or None if it is not known or
+        the module has changed"""
+        entry = self._entries.get(module)
+        if entry is None or entry[0] != stamp:
+            return None
+        return entry[1]
+
+    def set(self, module, stamp, plugins):
+        self._entries[module] = (stamp, plugins)
+        self._changed = True
+
+    def prune(self, modules):
+        """Forget all the modules which are not in modules"""
+        for m in self._entries.keys():
+            if m not in modules:
+                del self._entries[m]
+                self._changed = True
+
+    def save(self):
+        """Write the manifest if it has changed, the plugin directory is
+        often read only, so the errors are ignored"""
+        if not self._changed:
+            return
+        try:
+            fd, tmp = tempfile.mkstemp(prefix = self.filename,
+                    dir = self._path)
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    pickle.dump((self.version, self._entries), f,
+                            pickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                os.chmod(tmp, 0644)
+                os.rename(tmp, os.path.join(self._path, self.filename))
+            except:
+                os.unlink(tmp)
+                raise
+        except (IOError, OSError, pickle.PicklingError):
+            return
+        self._changed = False
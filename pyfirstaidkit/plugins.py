@@ -21,32 +21,157 @@ from errors import *
 from reporting import *
 from copy import copy,deepcopy
 from issue import *
+from isolation import Channel, ChannelTimeout, PipeReports, fork
+from utils import killChildren
+from manifest import PluginManifest, stamp
 
 import FirstAidKit
 import logging
 
 import imp
+import inspect
 import os
 import re
+import signal
 import subprocess
+import sys
+import thread
+import threading
+import time
 from cStringIO import StringIO
 
 Logger = logging.getLogger("firstaidkit")
 
+class _Frozen(dict):
+    """dict which can not be changed"""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("The compiled flow table is read only")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = \
+            update = _readonly
+
 class Flow(dict):
+    """Rules of the flow: state -> {Return class or None: next state}
+
+    The rules are compiled into a transition table when the flow is used
+    for the first time, they must not be changed afterwards. The Flow
+    objects are shared by the plugin classes deriving from each other."""
+
     def __init__(self, rules, description="", title="", *args, **kwargs):
         self.description = description
         self.title = title
+        self._table = None
+        self._memo = {}
         dict.__init__(self, rules, *args, **kwargs)
 
     @staticmethod
     def init(parent = None):
         if parent:
-            flows = deepcopy(parent.flows)
+            flows = dict(parent.flows)
         else:
             flows = dict()
         return flows
 
+    def compile(self):
+        """Build the transition table from the rules"""
+        if self._table is None:
+            self._memo = {}
+            self._table = _Frozen([(state, _Frozen(edges))
+                                   for state, edges in self.iteritems()])
+        return self._table
+
+    @staticmethod
+    def _keys(result):
+        """Return the edge keys which can be used for result, in order of
+        preference.
+
+        Class results can use the edges of their parent classes, None
+        result needs its own edge."""
+        if result is None:
+            return (None,)
+        elif inspect.isclass(result):
+            return inspect.getmro(result)
+        else:
+            return inspect.getmro(result.__class__)
+
+    def next(self, state, result):
+        """Return the state which follows state when it returned result,
+        None if the flow defines no such transition"""
+        try:
+            return self._memo[(state, result)]
+        except KeyError:
+            pass
+
+        table = self.compile()
+        nextstate = None
+        if state in table:
+            for key in self._keys(result):
+                if key in table[state]:
+                    nextstate = table[state][key]
+                    break
+        self._memo[(state, result)] = nextstate
+        return nextstate
+
+    def validate(self, pklass):
+        """Return list of problems found in the flow when used by pklass"""
+        table = self.compile()
+        problems = []
+        if pklass.initial not in table:
+            return ["there is no initial state"]
+
+        # every state has to be a method and has to handle all the results
+        # its step can end with
+        steps = set(table.keys())
+        for edges in table.itervalues():
+            steps.update(edges.values())
+        steps.difference_update([pklass.initial, pklass.final])
+        for state in sorted(steps):
+            if not callable(getattr(pklass, str(state), None)):
+                problems.append("step %s is not a method" % (state,))
+            if state not in table:
+                problems.append("step %s has no transitions" % (state,))
+                continue
+            required = [None]
+            if [k for k in table[state] if k is not None and
+                inspect.isclass(k) and
+                issubclass(k, (ReturnSuccess, ReturnFailure))]:
+                required.extend([ReturnSuccess, ReturnFailure])
+            for result in required:
+                if self.next(state, result) is None:
+                    problems.append("step %s has no transition for %s "
+                            "result" % (state, getattr(result, "__name__",
+                                result)))
+
+        # all states should be reachable and should be able to reach final
+        reachable = set()
+        todo = [pklass.initial]
+        while todo:
+            state = todo.pop()
+            if state in reachable:
+                continue
+            reachable.add(state)
+            todo.extend(table.get(state, {}).values())
+        for state in sorted(steps):
+            if state not in reachable:
+                problems.append("step %s can't be reached" % (state,))
+
+        finishing = set([pklass.final])
+        changed = True
+        while changed:
+            changed = False
+            for state, edges in table.iteritems():
+                if state not in finishing and \
+                   finishing.intersection(edges.values()):
+                    finishing.add(state)
+                    changed = True
+        for state in sorted(reachable - finishing):
+            if state in table:
+                problems.append("step %s never reaches the final state" %
+                        (state,))
+
+        return problems
+
 class Plugin(object):
     #
     # Some information vars.
@@ -149,25 +274,172 @@ class Plugin(object):
         #
         self._result = None  #edge from the state we are in
 
+        #
+        # Deadlines, see setTimeouts. The step which is running when its
+        # deadline passes is cancelled.
+        #
+        self._timeout = None
+        self._steptimeouts = {}
+        self._grace = 0
+        self._deadline = None
+        self._overtime = False
+        self._running = None #step which is running
+        self._cancelled = None #step which was cancelled
+        self._reason = ""
+        self._timedout = False
+        self._started = None
+        self._thread = None
+        self._timer = None
+        self._timer_lock = threading.Lock()
+
         #
         # Choose the flow for the instance.
         #
         self.defineFlow(flow)
 
+    def setTimeouts(self, timeout = None, steps = {}, grace = 0):
+        """Set the deadlines for automated run of the flow.
+
+        timeout -- number of seconds the whole flow may take
+        steps -- dictionary step name -> number of seconds the step may take,
+                 the step names are not case sensitive
+        grace -- number of seconds the remaining steps (clean, restore, ...)
+                 get after the flow deadline has passed
+        """
+        self._timeout = timeout
+        self._grace = grace
+        self._steptimeouts = {}
+        steps = dict([(k.lower(), v) for k, v in steps.iteritems()])
+        for state in self.cflow:
+            if isinstance(state, basestring) and state.lower() in steps:
+                self._steptimeouts[state] = steps[state.lower()]
+
     def continuing(self):
+        """Return False when the running step should end as soon as
+        possible, because it was cancelled or the Tasker was interrupted"""
+        if self._cancelled is not None and self._cancelled == self._running:
+            return False
         if self._interpret:
             return self._interpret.continuing()
         else:
             return True
 
     def call(self, step):
-        """call one step from plugin"""
+        """call one step from plugin
+
+        When the step does not finish before its deadline, it is cancelled.
+        The processes it started are killed, continuing() returns False and
+        the step result is None regardless of what the step returns."""
         self._result = None #mark new unfinished step
         self._state = step
         self._reporting.start(level = TASK, origin = self, message = step)
-        r = getattr(self, step)()
+        if self._watch(step):
+            try:
+                try:
+                    r = getattr(self, step)()
+                except Exception:
+                    # exceptions caused by the cancellation are not errors
+                    if self._cancelled != step:
+                        raise
+            finally:
+                self._unwatch()
+
+        if self._cancelled == step:
+            self._result = None
+            if self._timedout:
+                self._reporting.timeout(level = TASK, origin = self,
+                        message = self._reason)
+            else:
+                self._reporting.alert(level = TASK, origin = self,
+                        message = self._reason)
         self._reporting.stop(level = TASK, origin = self, message = step)
 
+    def _watch(self, step):
+        """Start the watchdog for step, returns False when the step
+        deadline has already passed and the step must not be started"""
+        self._cancelled = None
+        timeout = self._steptimeouts.get(step)
+        overall = False
+        if self._deadline is not None:
+            remaining = self._deadline - time.time()
+            if timeout is None or remaining < timeout:
+                timeout = remaining
+                overall = True
+
+        self._timer_lock.acquire()
+        try:
+            self._running = step
+            self._started = time.time()
+            self._thread = thread.get_ident()
+            if timeout is None:
+                return True
+            self._timer = threading.Timer(max(timeout, 0), self._expire,
+                    [step, overall])
+            self._timer.setDaemon(True)
+        finally:
+            self._timer_lock.release()
+
+        if timeout <= 0:
+            self._expire(step, overall)
+            self._unwatch()
+            return False
+
+        self._timer.start()
+        return True
+
+    def _unwatch(self):
+        """Stop the watchdog of the running step"""
+        self._timer_lock.acquire()
+        try:
+            self._running = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        finally:
+            self._timer_lock.release()
+
+    def _expire(self, step, overall):
+        """Watchdog callback, cancels the step if it is still running"""
+        self._timer_lock.acquire()
+        try:
+            if self._running != step:
+                return
+            if not overall:
+                reason = "Step %s did not finish in %s seconds" % \
+                        (step, self._steptimeouts[step])
+            elif not self._overtime:
+                reason = "Deadline of %s seconds passed in step %s" % \
+                        (self._timeout, step)
+                # let the flow clean up after itself
+                self._overtime = True
+                self._deadline = time.time() + self._grace
+            else:
+                reason = "Cleanup did not finish in %s seconds after the " \
+                        "deadline, step %s was cancelled" % (self._grace, step)
+            self._cancelled = step
+            self._reason = reason
+            self._timedout = True
+            ident, started = self._thread, self._started
+        finally:
+            self._timer_lock.release()
+
+        killChildren(ident, since = started)
+
+    def cancel(self, reason = "The step was cancelled"):
+        """Cancel the running step, see call"""
+        self._timer_lock.acquire()
+        try:
+            if self._running is None:
+                return
+            self._cancelled = self._running
+            self._reason = reason
+            self._timedout = False
+            ident, started = self._thread, self._started
+        finally:
+            self._timer_lock.release()
+
+        killChildren(ident, since = started)
+
     @classmethod
     def info(cls):
         """Returns tuple (Plugin name, Plugin version, Plugin author)"""
@@ -190,6 +462,7 @@ class Plugin(object):
         #
         if flow in self.flows.keys():
             self.cflow = self.flows[flow]
+            self.cflow.compile()
         else:
             raise InvalidFlowNameException(flow)
 
@@ -207,6 +480,15 @@ class Plugin(object):
         else:
             raise InvalidFlowNameException(name)
 
+    @classmethod
+    def validate(cls):
+        """Return list of problems found in the flows of the plugin"""
+        problems = []
+        for name in sorted(cls.getFlows()):
+            problems.extend(["flow %s: %s" % (name, problem)
+                             for problem in cls.getFlow(name).validate(cls)])
+        return problems
+
     #dependency stuff
     @classmethod
     def getDeps(cls):
@@ -247,14 +529,13 @@ class Plugin(object):
             result=self._result
         # The self.initial state does not have any return code.
         # It will only work with the Return.
-        try:
-            if state == self.initial:
-                self._state = self.cflow[self.initial][Return]
-            else:
-                self._state = self.cflow[state][result]
-            return self._state
-        except KeyError:
+        if state == self.initial:
+            result = Return
+        nextstate = self.cflow.next(state, result)
+        if nextstate is None:
             raise InvalidFlowStateException(self.cflow)
+        self._state = nextstate
+        return self._state
 
     #
     #iterate protocol allows us to use loops
@@ -262,6 +543,11 @@ class Plugin(object):
     def __iter__(self):
         self._state = self.initial
         self._result = None
+        self._overtime = False
+        if self._timeout:
+            self._deadline = time.time() + self._timeout
+        else:
+            self._deadline = None
         return self
 
     def next(self):
@@ -454,7 +740,7 @@ class FlagTrackerPlugin(Plugin):
     flows = Flow.init(Plugin)
     flows["diagnose"] = Flow({
             Plugin.initial : {Return: "decide"},
-            "decide"    : {Return: Plugin.final}
+            "decide"    : {Return: Plugin.final, None: Plugin.final}
             }, description="The default, fully automated, deciding sequence")
     flows["fix"] = flows["diagnose"]
 
@@ -478,11 +764,137 @@ class FlagTrackerPlugin(Plugin):
         return Return
 
 
+def _import(path, name, reuse = False):
+    """Import module name from path as FirstAidKit.name
+
+    reuse - return the module if it was already imported from path"""
+    fullname = ".".join([FirstAidKit.__name__, name])
+    module = sys.modules.get(fullname)
+    if reuse and module is not None and \
+       getattr(module, "__file__", "").startswith(os.path.join(path, name)):
+        return module
+
+    moduleinfo = imp.find_module(name, [path])
+    try:
+        return imp.load_module(fullname, *moduleinfo)
+    finally:
+        if moduleinfo[0] is not None:
+            moduleinfo[0].close()
+
+def _describe(path, module):
+    """Return the metadata of the plugin from module, which are stored in
+    the manifest"""
+    pklass = module.get_plugin()
+    flows = {}
+    for f in pklass.getFlows():
+        flow = pklass.getFlow(f)
+        flows[f] = (flow.description, flow.title)
+    return {"name": pklass.name, "version": pklass.version,
+            "author": pklass.author, "description": pklass.description,
+            "default_flow": pklass.default_flow, "flows": flows,
+            "deps": set(pklass.getDeps()),
+            "conflicts": set(pklass.getConflicts()),
+            "problems": pklass.validate(),
+            "file": os.path.relpath(module.__file__, path)}
+
+class LazyPlugin(object):
+    """Stands in for the plugin class until it is really needed.
+
+    Everything needed to list and schedule the plugin comes from the
+    manifest. The module gets imported when the plugin is instantiated or
+    when any other attribute is accessed."""
+
+    def __init__(self, module, info):
+        self._module = module
+        self._info = info
+        self.name = info["name"]
+        self.version = info["version"]
+        self.author = info["author"]
+        self.description = info["description"]
+        self.default_flow = info["default_flow"]
+
+    def info(self):
+        return (self.name, self.version, self.author)
+
+    def getFlows(self):
+        return set(self._info["flows"].keys())
+
+    def getFlow(self, name):
+        """Return the Flow object, the transitions are available only
+        after the plugin has been imported"""
+        if name not in self._info["flows"]:
+            raise InvalidFlowNameException(name)
+        description, title = self._info["flows"][name]
+        return Flow({}, description = description, title = title)
+
+    def getDeps(self):
+        return set(self._info["deps"])
+
+    def getConflicts(self):
+        return set(self._info["conflicts"])
+
+    def __call__(self, *args, **kwargs):
+        return self._module.load().get_plugin()(*args, **kwargs)
+
+    def __getattr__(self, attr):
+        return getattr(self._module.load().get_plugin(), attr)
+
+class LazyModule(object):
+    """Plugin module which is imported on the first use"""
+
+    def __init__(self, path, modname, name, info, module = None):
+        """path - plugin directory
+        modname - name of the module in path
+        name - name of the plugin (modname.subname for the submodules)
+        info - metadata of the plugin from the manifest
+        module - the already imported module"""
+        self._path = path
+        self._modname = modname
+        self._name = name
+        self._module = module
+        self._plugin = LazyPlugin(self, info)
+        self.__file__ = os.path.join(path, info["file"])
+        self.__name__ = ".".join([FirstAidKit.__name__, name])
+
+    def load(self):
+        """Import the module if it was not yet imported and return it"""
+        imp.acquire_lock()
+        try:
+            if self._module is None:
+                module = _import(self._path, self._modname, reuse = True)
+                if self._name != self._modname:
+                    subname = self._name[len(self._modname)+1:]
+                    module = dict(module.get_plugin())[subname]
+                self._module = module
+            return self._module
+        finally:
+            imp.release_lock()
+
+    def get_plugin(self):
+        if self._module is not None:
+            return self._module.get_plugin()
+        return self._plugin
+
+    def problems(self):
+        """Return the flow problems found when the plugin was described"""
+        return self._plugin._info.get("problems", [])
+
+def _seconds(value):
+    """Convert config value to number of seconds, None when not set"""
+    try:
+        return float(value) or None
+    except ValueError:
+        return None
+
 class PluginSystem(object):
     """Encapsulate all plugin detection and import stuff"""
 
     name = "Plugin System"
 
+    # seconds the isolated worker gets after the cleanup grace period,
+    # before it is killed
+    killdelay = 5
+
     def __init__(self, interpret, reporting, dependencies, config=Config, backups=None):
         self._paths = Config.paths.valueItems()
         self._backups = backups
@@ -492,48 +904,62 @@ class PluginSystem(object):
         self._interpret = interpret
         self._plugins = {}
         self._flow_titles = {}
+        self._active = [] # running plugin instances
+        self._workers = {} # pid -> plugin of running isolated workers
+        self._cancelled = set() # pids of workers killed by cancel
+        self._active_lock = threading.Lock()
 
         for path in self._paths:
             if not os.path.isdir(path):
-                self._reporting.debug("The path %s does not exist" % path,
-                        level = PLUGINSYSTEM, origin = self)
+                self._reporting.debug("The path %s does not exist",
+                        args = (path,), level = PLUGINSYSTEM, origin = self)
                 continue
             #create list of potential modules in the path
             importlist = set()
             for f in os.listdir(path):
                 fullpath = os.path.join(path, f)
-                self._reporting.debug("Processing file: %s" % (f,),
+                self._reporting.debug("Processing file: %s", args = (f,),
                         level = PLUGINSYSTEM, origin = self)
                 if os.path.isdir(fullpath) \
                     and os.path.isfile(os.path.join(path, f, "__init__.py")):
                     importlist.add(f)
-                    self._reporting.debug("Adding python module (directory): %s"
-                            % (f,), level = PLUGINSYSTEM, origin = self)
+                    self._reporting.debug("Adding python module (directory): %s",
+                            args = (f,), level = PLUGINSYSTEM, origin = self)
 
                 elif os.path.isfile(fullpath) and (f[-3:]==".so"
                         or f[-3:]==".py"):
                     importlist.add(f[:-3])
-                    self._reporting.debug("Adding python module (file): %s"
-                            % (f,), level = PLUGINSYSTEM, origin = self)
+                    self._reporting.debug("Adding python module (file): %s",
+                            args = (f,), level = PLUGINSYSTEM, origin = self)
 
                 elif os.path.isfile(fullpath) and (f[-4:]==".pyc"
                         or f[-4:]==".pyo"):
                     importlist.add(f[:-4])
-                    self._reporting.debug("Adding python module (compiled): %s"
-                            % (f,), level = PLUGINSYSTEM, origin = self)
+                    self._reporting.debug("Adding python module (compiled): %s",
+                            args = (f,), level = PLUGINSYSTEM, origin = self)
 
-            #try to import the modules as FirstAidKit.plugins.modulename
+            #import the modules as FirstAidKit.plugins.modulename, but only
+            #when their plugins are not already described in the manifest
+            manifest = PluginManifest(path)
+            manifest.prune(importlist)
             for m in importlist:
                 if m in Config.plugin._list("disabled"):
                     continue
 
+                modstamp = stamp(path, m)
+                plugins = manifest.get(m, modstamp)
+                if plugins is not None:
+                    self._reporting.debug("Module %s found in the manifest",
+                            args = (m,), level = PLUGINSYSTEM, origin = self)
+                    for name, info in plugins:
+                        self._register(name, LazyModule(path, m, name, info))
+                    continue
+
                 imp.acquire_lock()
                 try:
-                    self._reporting.debug("Importing module %s from %s"
-                            % (m, path), level = PLUGINSYSTEM, origin = self)
-                    moduleinfo = imp.find_module(m, [path])
-                    module = imp.load_module(".".join([FirstAidKit.__name__,m]),
-                            *moduleinfo)
+                    self._reporting.debug("Importing module %s from %s",
+                            args = (m, path), level = PLUGINSYSTEM, origin = self)
+                    module = _import(path, m)
 
                     # check if the module actually contains a plugin or just submodules
                     pl = module.get_plugin()
@@ -543,25 +969,21 @@ class PluginSystem(object):
                     except TypeError:
                         pl = [(m, module)]
 
+                    plugins = []
                     for name, module in pl:
-                        #notify the dependency system about all used dependencies
-                        self._deps.introduce(module.get_plugin().getDeps())
-                        
-                        #notify the dependency system about all used
-                        #reverse-dependencies
-                        self._deps.introduce(module.get_plugin().getConflicts())
-                        self._plugins[name] = module
-                        self._reporting.debug("Module %s successfully imported "
-                                              "with basedir %s" %
-                                              (m, os.path.dirname(module.__file__)),
-                                              level = PLUGINSYSTEM, origin = self)
+                        info = _describe(path, module)
+                        plugins.append((name, info))
+                        self._register(name,
+                                LazyModule(path, m, name, info, module))
+                    manifest.set(m, modstamp, plugins)
                 except Exception, e:
                     self._reporting.error(message = "Module %s was NOT "
                             "imported, because of %s" %
                             (m, str(e)), level = PLUGINSYSTEM, origin = self)
                 finally:
                     imp.release_lock()
-            
+            manifest.save()
+
         #initialize gettext
         trans = None
         try:
@@ -591,6 +1013,37 @@ class PluginSystem(object):
             if not title:
                 self._flow_titles[flow] = flow
 
+    def rebind(self, interpret, reporting, dependencies, backups = None):
+        """Use the already imported plugins with another interpret, so long
+        running processes do not have to import them for every run"""
+        self._interpret = interpret
+        self._reporting = reporting
+        self._deps = dependencies
+        self._backups = backups
+        self._reporting.start(level = PLUGINSYSTEM, origin = self)
+        for module in self._plugins.itervalues():
+            pklass = module.get_plugin()
+            self._deps.introduce(pklass.getDeps())
+            self._deps.introduce(pklass.getConflicts())
+
+    def _register(self, name, module):
+        """Make the plugin from module available under name"""
+        pklass = module.get_plugin()
+        #notify the dependency system about all used dependencies
+        self._deps.introduce(pklass.getDeps())
+
+        #notify the dependency system about all used
+        #reverse-dependencies
+        self._deps.introduce(pklass.getConflicts())
+        self._plugins[name] = module
+        self._reporting.debug("Module %s successfully registered with "
+                "basedir %s", args = (name, os.path.dirname(module.__file__)),
+                level = PLUGINSYSTEM, origin = self)
+        for problem in module.problems():
+            self._reporting.info("Plugin %s has invalid %s" %
+                    (name, problem), level = PLUGINSYSTEM, origin = self,
+                    importance = logging.WARNING)
+
     def list(self):
         """Return the list of imported plugins"""
         return self._plugins.keys()
@@ -599,6 +1052,43 @@ class PluginSystem(object):
         """Return flow title"""
         return self._flow_titles[flow]
 
+    def cancel(self, reason = "The step was cancelled"):
+        """Cancel the running steps of all plugins and kill the isolated
+        workers"""
+        self._active_lock.acquire()
+        try:
+            active = list(self._active)
+            for pid in self._workers:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                    self._cancelled.add(pid)
+                except OSError:
+                    pass
+        finally:
+            self._active_lock.release()
+
+        for p in active:
+            p.cancel(reason)
+
+    def timeouts(self, plugin):
+        """Return (timeout, step timeouts, grace) for plugin, see
+        Plugin.setTimeouts
+
+        The deadlines are read from the timeouts section of the config,
+        where key plugin sets the deadline for the whole flow and key
+        plugin/step the deadline for one step. Plugins without their own
+        deadline use operation.timeout."""
+        timeout = _seconds(Config.operation.timeout)
+        steps = {}
+        if Config.has_section("timeouts"):
+            prefix = plugin.lower()+"/"
+            for (name, value) in Config.items("timeouts"):
+                if name == plugin.lower():
+                    timeout = _seconds(value)
+                elif name.startswith(prefix) and _seconds(value) is not None:
+                    steps[name[len(prefix):]] = _seconds(value)
+        return (timeout, steps, _seconds(Config.operation.grace) or 0)
+
     def autorun(self, plugin, flow = None, dependencies = True):
         """Perform automated run of plugin with condition checking
 
@@ -620,18 +1110,18 @@ class PluginSystem(object):
         plugindir = os.path.dirname(self._plugins[plugin].__file__)
         self._reporting.info(message = "Plugin information...", \
                 level = PLUGINSYSTEM, origin = self)
-        self._reporting.info(message = "name:%s , version:%s , author:%s " \
-                % pklass.info(), level = PLUGINSYSTEM, origin = self)
+        self._reporting.info(message = "name:%s , version:%s , author:%s ",
+                args = pklass.info(), level = PLUGINSYSTEM, origin = self)
 
         flows = pklass.getFlows()
-        self._reporting.info(message = "Provided flows : %s " % flows, \
+        self._reporting.info(message = "Provided flows : %s ", args = (flows,),
                 level = PLUGINSYSTEM, origin = self)
         if flow==None:
             flowName = pklass.default_flow
         else:
             flowName = flow
 
-        self._reporting.info(message = "Using %s flow" % flowName, \
+        self._reporting.info(message = "Using %s flow", args = (flowName,),
                 level = PLUGINSYSTEM, origin = self)
         if flowName not in flows:
             self._reporting.exception(message = "Flow %s does not exist in "
@@ -679,21 +1169,204 @@ class PluginSystem(object):
                 if m:
                     args.append(value.lstrip(plugin+'/'+flowName).strip(" "))
 
+        try:
+            #the manifest might have spared us the import until now
+            pklass = self._plugins[plugin].load().get_plugin()
+        except Exception, e:
+            self._reporting.exception(message = "Module %s was NOT "
+                    "imported, because of %s" % (plugin, str(e)),
+                    level = PLUGINSYSTEM, origin = self)
+            self._reporting.stop(level = PLUGIN, origin = self, message = plugin)
+            return False
+
         infosection = getattr(Info, plugin)
         infosection.unlock()
         p = pklass(flowName, interpret = self._interpret, reporting = self._reporting,
                 dependencies = self._deps, backups = self._backups,
                 path = plugindir, info = infosection, args = " ".join(args))
-        for (step, rv) in p: #autorun all the needed steps
-            self._reporting.info(message = "Running step %s in plugin %s ..."% \
-                    (step, plugin), level = PLUGINSYSTEM, origin = self)
-            self._reporting.info(message = "%s is current step and %s is result " \
-                    "of that step." % (step, rv), level = PLUGINSYSTEM, \
-                    origin = self)
+        p.setTimeouts(*self.timeouts(plugin))
+        self._active_lock.acquire()
+        self._active.append(p)
+        self._active_lock.release()
+        try:
+            for (step, rv) in p: #autorun all the needed steps
+                self._reporting.info(message = "Running step %s in plugin %s ...",
+                        args = (step, plugin), level = PLUGINSYSTEM, origin = self)
+                self._reporting.info(message = "%s is current step and %s is result "
+                        "of that step.", args = (step, rv), level = PLUGINSYSTEM,
+                        origin = self)
+        finally:
+            self._active_lock.acquire()
+            self._active.remove(p)
+            self._active_lock.release()
 
         self._reporting.stop(level = PLUGIN, origin = self, message = plugin)
         return True
 
+    def isolatedrun(self, plugin, flow = None, dependencies = True,
+            timeout = None):
+        """Perform autorun of plugin in a forked worker process
+
+        The worker streams the reporting messages, the flag changes and the
+        Info section of the plugin back over a pipe, so a crash in the plugin
+        (or C library used by it) does not take down the whole First Aid Kit.
+
+        timeout - number of seconds after which the worker is killed, by
+                  default it is the plugin deadline plus the cleanup grace
+                  period (see timeouts), so the worker gets the chance to
+                  cancel the step cooperatively first
+
+        returns - the same as autorun, True when the worker died or had
+        to be killed (the reason is reported)"""
+
+        if timeout is None and plugin in self._plugins:
+            overall, steps, grace = self.timeouts(plugin)
+            if overall:
+                timeout = overall + grace + self.killdelay
+
+        rfd, wfd = os.pipe()
+        attachments = len(Info._attachments)
+        raw_attachments = len(Info._raw_attachments)
+
+        # do not fork while other thread holds locks the worker needs
+        pid = fork(locks = [self._deps.lock, self._active_lock])
+
+        if pid == 0:
+            os.close(rfd)
+            self._isolatedworker(Channel(wfd), plugin, flow, dependencies,
+                    attachments, raw_attachments)
+
+        self._active_lock.acquire()
+        self._workers[pid] = plugin
+        self._active_lock.release()
+        os.close(wfd)
+        channel = Channel(rfd)
+        if timeout:
+            deadline = time.time() + timeout
+        else:
+            deadline = None
+
+        result = None
+        error = None
+        killed = False
+        started = [] # unfinished START messages from the worker
+        try:
+            while True:
+                try:
+                    record = channel.receive(deadline)
+                except ChannelTimeout:
+                    os.kill(pid, signal.SIGKILL)
+                    killed = True
+                    self._reporting.timeout(message = "Plugin %s did not "
+                            "finish in %s seconds and was killed" %
+                            (plugin, timeout), level = PLUGINSYSTEM,
+                            origin = self)
+                    break
+
+                if record is None:
+                    break
+                elif record[0] == "message":
+                    data = record[1]
+                    if data["action"] == START:
+                        started.append(data)
+                    elif data["action"] == STOP and started:
+                        started.pop()
+                    self._reporting.put_raw(data)
+                elif record[0] == "flag":
+                    if record[2]:
+                        self._deps.provide(record[1], setactionflag = False)
+                    else:
+                        self._deps.unprovide(record[1], setactionflag = False)
+                elif record[0] == "info":
+                    infosection = getattr(Info, plugin)
+                    infosection.unlock()
+                    try:
+                        for key, value in record[1]:
+                            setattr(infosection, key, value)
+                    finally:
+                        infosection.lock()
+                    Info._attachments.extend(record[2])
+                    Info._raw_attachments.extend(record[3])
+                elif record[0] == "backups":
+                    for id, persistent in record[1]:
+                        self._backups.adoptBackup(id, persistent)
+                elif record[0] == "result":
+                    result = record[1]
+                elif record[0] == "exception":
+                    error = record[1]
+        finally:
+            channel.close()
+            pid, status = os.waitpid(pid, 0)
+            self._active_lock.acquire()
+            del self._workers[pid]
+            cancelled = pid in self._cancelled
+            self._cancelled.discard(pid)
+            self._active_lock.release()
+
+        if cancelled and not killed:
+            killed = True
+            self._reporting.alert(message = "Plugin %s was cancelled" %
+                    (plugin,), level = PLUGINSYSTEM, origin = self)
+
+        if result is None and error is None:
+            if killed:
+                pass #already reported
+            else:
+                if os.WIFSIGNALED(status):
+                    reason = "signal %d" % os.WTERMSIG(status)
+                else:
+                    reason = "exit code %d" % os.WEXITSTATUS(status)
+                self._reporting.exception(message = "Worker running plugin "
+                        "%s died (%s)" % (plugin, reason),
+                        level = PLUGINSYSTEM, origin = self)
+            #close the levels opened by the dead worker
+            for data in reversed(started):
+                self._reporting.stop(level = data["level"],
+                        origin = data["origin"], message = data["message"])
+            return True
+
+        if error is not None:
+            raise GeneralPluginException(plugin, error)
+
+        return result
+
+    def _isolatedworker(self, channel, plugin, flow, dependencies,
+            attachments, raw_attachments):
+        """Body of the worker process started by isolatedrun, never
+        returns"""
+        status = 0
+        if self._backups is not None:
+            known = set([id for id, persistent
+                         in self._backups.openBackups()])
+        try:
+            try:
+                # the copy of our Reports still knows what the parent wants
+                self._reporting = PipeReports(channel,
+                        parent_filter = self._reporting, name = plugin)
+                self._deps.watch(lambda flag, present:
+                        channel.send("flag", flag, present))
+                result = self.autorun(plugin, flow = flow,
+                        dependencies = dependencies)
+                if Info.has_section(plugin):
+                    # only the options of the section, not the DEFAULT ones
+                    items = [(key, value) for key, value in
+                            Info._obj._sections[plugin].iteritems()
+                            if key != "__name__"]
+                else:
+                    items = []
+                channel.send("info", items, Info._attachments[attachments:],
+                        Info._raw_attachments[raw_attachments:])
+                channel.send("result", result)
+            except Exception, e:
+                channel.send("exception", str(e))
+                status = 1
+            # the parent store takes over the spaces the plugin left open
+            if self._backups is not None:
+                channel.send("backups", [(id, persistent) for id, persistent
+                    in self._backups.openBackups() if id not in known])
+        finally:
+            os._exit(status)
+
     def getplugin(self, plugin):
         """Get top level class of plugin, so we can create the instance and
         call the steps manually"""
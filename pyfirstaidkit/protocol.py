@@ -0,0 +1,414 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Framed protocol used between firstaidkit-shell and the master.
+
+Every frame has a fixed header followed by the payload:
+
+    magic (4s), version (B), channel (B), flags (B), reserved (B),
+    payload length (I), payload crc32 (I), header crc32 (I)
+
+The CONTROL channel carries pickled (command, arguments) tuples, the
+MESSAGES channel pickled lists of reporting messages and the ATTACHMENT
+channel raw chunks of the result file. The result file is announced by
+("attachment", size, sha256 hex digest) control record. The payload can be compressed by
+zlib (COMPRESSED flag).
+
+The reader skips everything which is not a valid frame, so garbage in the
+stream (eg. text printed by some plugin) costs only the damaged frames.
+
+The shell can keep a copy of the stream in a Spool. When the connection
+breaks, the master connects again and asks for the rest of the stream
+starting at the offset of the last frame it has read (see follow)."""
+
+import os
+import re
+import stat
+import errno
+import time
+import uuid
+import shutil
+import socket
+import struct
+import zlib
+import threading
+import hashlib
+import cPickle as pickle
+
+MAGIC = "FAK\xf1"
+VERSION = 1
+
+#channels
+CONTROL = 0
+MESSAGES = 1
+ATTACHMENT = 2
+
+#flags
+COMPRESSED = 1
+
+#payloads smaller than this are never compressed
+COMPRESS_MIN = 256
+#frames longer than this are considered corrupted
+MAX_PAYLOAD = 16*1024*1024
+#size of the ATTACHMENT chunks
+CHUNK = 64*1024
+
+_header = struct.Struct("!4sBBBBII")
+_crc = struct.Struct("!I")
+HEADER_SIZE = _header.size + _crc.size
+
+def _checksum(data):
+    return zlib.crc32(data) & 0xffffffff
+
+def frame(channel, payload, compress = True):
+    """Return the frame carrying payload on the channel"""
+    flags = 0
+    if compress and len(payload) >= COMPRESS_MIN:
+        packed = zlib.compress(payload)
+        if len(packed) < len(payload):
+            payload = packed
+            flags |= COMPRESSED
+    header = _header.pack(MAGIC, VERSION, channel, flags, 0, len(payload),
+            _checksum(payload))
+    return header + _crc.pack(_checksum(header)) + payload
+
+class FrameWriter(object):
+    """Sends frames to a file object, can be used from more threads"""
+
+    def __init__(self, stream, compress = True):
+        self._stream = stream
+        self._compress = compress
+        self._lock = threading.Lock()
+
+    def send(self, channel, payload):
+        data = frame(channel, payload, self._compress)
+        self._lock.acquire()
+        try:
+            self._stream.write(data)
+            self._stream.flush()
+        finally:
+            self._lock.release()
+
+    def control(self, command, *args):
+        self.send(CONTROL, pickle.dumps((command, args),
+            pickle.HIGHEST_PROTOCOL))
+
+    def messages(self, messages):
+        self.send(MESSAGES, pickle.dumps(list(messages),
+            pickle.HIGHEST_PROTOCOL))
+
+    def attachment(self, stream):
+        """Send the content of the file object in ATTACHMENT frames"""
+        while True:
+            data = stream.read(CHUNK)
+            if not data:
+                break
+            self.send(ATTACHMENT, data)
+
+class MessageBatcher(object):
+    """Collects reporting messages and sends them as one MESSAGES frame.
+
+    The batch is sent when it is full, when one of the urgent messages
+    (eg. END) arrives or at the latest delay seconds after the first message
+    of the batch arrived."""
+
+    def __init__(self, writer, size = 50, delay = 0.2, urgent = ()):
+        self._writer = writer
+        self._size = size
+        self._delay = delay
+        self._urgent = frozenset(urgent)
+        self._pending = []
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def put(self, message):
+        self._lock.acquire()
+        try:
+            self._pending.append(message)
+            if len(self._pending) < self._size and \
+               message["action"] not in self._urgent:
+                if self._timer is None:
+                    self._timer = threading.Timer(self._delay, self.flush)
+                    self._timer.setDaemon(True)
+                    self._timer.start()
+                return
+            self._flush()
+        finally:
+            self._lock.release()
+
+    def flush(self):
+        self._lock.acquire()
+        try:
+            self._flush()
+        finally:
+            self._lock.release()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._pending:
+            pending, self._pending = self._pending, []
+            self._writer.messages(pending)
+
+class FrameReader(object):
+    """Reads frames from a file object.
+
+    Data which do not form a valid frame are skipped, the number of the
+    skipped bytes is kept in the skipped attribute."""
+
+    def __init__(self, stream, offset = 0):
+        """offset - position of the stream start in the whole session
+                    stream, when reading resumed session"""
+        self._stream = stream
+        self._buffer = ""
+        self._read = offset
+        self.skipped = 0
+        self.broken = 0 # frames with valid header and invalid payload
+        self.offset = offset # position just after the last returned frame
+
+    def _fill(self, size):
+        """Read until there are at least size bytes in the buffer, return
+        False on end of the stream"""
+        while len(self._buffer) < size:
+            data = self._stream.read(size - len(self._buffer))
+            if not data:
+                return False
+            self._buffer += data
+            self._read += len(data)
+        return True
+
+    def _skip(self, size):
+        self._buffer = self._buffer[size:]
+        self.skipped += size
+
+    def read(self):
+        """Return next (channel, payload) pair or None at the end of the
+        stream"""
+        while True:
+            if not self._fill(HEADER_SIZE):
+                self._skip(len(self._buffer))
+                return None
+
+            idx = self._buffer.find(MAGIC)
+            if idx < 0:
+                # the magic can start in the last few bytes
+                self._skip(len(self._buffer) - len(MAGIC) + 1)
+                continue
+            elif idx > 0:
+                self._skip(idx)
+                continue
+
+            header = self._buffer[:_header.size]
+            crc = _crc.unpack(self._buffer[_header.size:HEADER_SIZE])[0]
+            magic, version, channel, flags, reserved, length, payload_crc = \
+                    _header.unpack(header)
+            if crc != _checksum(header) or version != VERSION or \
+               length > MAX_PAYLOAD:
+                self._skip(1)
+                continue
+
+            if not self._fill(HEADER_SIZE + length):
+                self._skip(len(self._buffer))
+                return None
+
+            payload = self._buffer[HEADER_SIZE:HEADER_SIZE + length]
+            if _checksum(payload) != payload_crc:
+                # the header is valid, so is the length
+                self.broken += 1
+                self._skip(HEADER_SIZE + length)
+                continue
+            self._buffer = self._buffer[HEADER_SIZE + length:]
+            self.offset = self._read - len(self._buffer)
+
+            if flags & COMPRESSED:
+                try:
+                    payload = zlib.decompress(payload)
+                except zlib.error:
+                    self.broken += 1
+                    continue
+            return channel, payload
+
+def digest(path):
+    """Return size and sha256 hex digest of the file"""
+    h = hashlib.sha256()
+    size = 0
+    f = open(path, "rb")
+    try:
+        while True:
+            data = f.read(CHUNK)
+            if not data:
+                break
+            h.update(data)
+            size += len(data)
+    finally:
+        f.close()
+    return size, h.hexdigest()
+
+def decode(payload):
+    """Unpickle the CONTROL or MESSAGES payload, None when it is damaged"""
+    try:
+        return pickle.loads(payload)
+    except Exception:
+        return None
+
+#name of the spooled session
+SESSION = re.compile(r"^[0-9a-f]{32}$")
+
+def _checkSpool(directory):
+    """Raise OSError unless the spool directory is a real directory of the
+    user which nobody else can access, the frames in it are unpickled by
+    the master"""
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or \
+       st.st_mode & 077:
+        raise OSError(errno.EPERM, "Unsafe spool directory", directory)
+
+def spoolDirectory(directory):
+    """Create the spool directory or check the existing one"""
+    try:
+        os.makedirs(directory, 0700)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+    _checkSpool(directory)
+
+class Spool(object):
+    """File object which writes everything to the spool of the session
+    first and then to the connection.
+
+    When the connection breaks, the session goes on and only the spool is
+    written. Every session has its own directory holding the "frames" file,
+    the "pid" of the shell and the "done" mark created by close."""
+
+    def __init__(self, directory, stream, disconnected = None):
+        """disconnected - called without arguments when the connection
+                          breaks"""
+        spoolDirectory(directory)
+        self.session = uuid.uuid4().hex
+        self.path = os.path.join(directory, self.session)
+        os.mkdir(self.path, 0700)
+        f = open(os.path.join(self.path, "pid"), "w")
+        f.write("%d\n" % os.getpid())
+        f.close()
+        self._file = open(os.path.join(self.path, "frames"), "wb")
+        self._stream = stream
+        self._disconnected = disconnected
+        self.connected = True
+
+    def _broken(self):
+        self.connected = False
+        if self._disconnected is not None:
+            self._disconnected()
+
+    def write(self, data):
+        self._file.write(data)
+        self._file.flush()
+        if self.connected:
+            try:
+                self._stream.write(data)
+            except (IOError, socket.error):
+                self._broken()
+
+    def flush(self):
+        if self.connected:
+            try:
+                self._stream.flush()
+            except (IOError, socket.error):
+                self._broken()
+
+    def close(self):
+        """Mark the session as finished"""
+        self._file.close()
+        open(os.path.join(self.path, "done"), "w").close()
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors = True)
+
+def _alive(path):
+    """Return True when the shell which owns the spool is running"""
+    try:
+        pid = int(open(os.path.join(path, "pid")).read())
+        os.kill(pid, 0)
+    except (IOError, ValueError):
+        return False
+    except OSError, e:
+        return e.errno == errno.EPERM
+    return True
+
+def follow(directory, session, offset, stream, poll = 0.2):
+    """Copy the spooled stream of the session from offset to stream and
+    wait for more until the session is finished.
+
+    Return False when the session is not known or when its shell died
+    before finishing it."""
+    if not SESSION.match(session):
+        return False
+    path = os.path.join(directory, session)
+    try:
+        _checkSpool(directory)
+        f = open(os.path.join(path, "frames"), "rb")
+    except (IOError, OSError):
+        return False
+    try:
+        f.seek(offset)
+        while True:
+            # check the mark first, the data written before it are in
+            # the file
+            done = os.path.exists(os.path.join(path, "done"))
+            data = f.read(CHUNK)
+            if data:
+                stream.write(data)
+                continue
+            stream.flush()
+            if done:
+                return True
+            if not _alive(path):
+                return False
+            time.sleep(poll)
+    finally:
+        f.close()
+
+def removeSpool(directory, session):
+    """Forget the spooled session"""
+    if not SESSION.match(session):
+        return
+    try:
+        _checkSpool(directory)
+    except OSError:
+        return
+    shutil.rmtree(os.path.join(directory, session), ignore_errors = True)
+
+def expireSpool(directory, age):
+    """Remove the spooled sessions older than age seconds which nobody
+    writes to"""
+    try:
+        _checkSpool(directory)
+        names = os.listdir(directory)
+    except OSError:
+        return
+    limit = time.time() - age
+    for name in names:
+        path = os.path.join(directory, name)
+        try:
+            if os.path.getmtime(path) > limit or \
+               os.path.getmtime(os.path.join(path, "frames")) > limit:
+                continue
+        except OSError:
+            pass
+        if not _alive(path):
+            shutil.rmtree(path, ignore_errors = True)
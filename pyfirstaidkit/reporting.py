@@ -18,9 +18,11 @@
 import Queue
 import logging
 import thread
+import threading
 import weakref
 import re
 import time
+from collections import deque
 
 from errors import *
 
@@ -45,6 +47,7 @@ EXCEPTION = 5
 TABLE = 6 #types for arbitrary table-like organized iterables
 TREE = 7  #nested iterables organized as tree
 ISSUE = 8  #New issue object was created or changed
+TIMEOUT = 9 #Step or plugin did not finish before its deadline
 CHOICE_QUESTION = 990 #a Question object, "reply" specifies a Reports object
 TEXT_QUESTION = 991
 FILENAME_QUESTION = 992
@@ -53,6 +56,14 @@ CONFIG_QUESTION = 994
 ANSWER = 999 #Data sent in reply to a *_QUESTION
 END = 1000 #End of operations, final message
 
+QUESTIONS = (CHOICE_QUESTION, TEXT_QUESTION, FILENAME_QUESTION,
+             PASSWORD_QUESTION, CONFIG_QUESTION)
+
+#what the dispatcher does when its buffer is full
+BLOCK = "block" #wait for the subscribers to catch up
+DROP = "drop" #drop the oldest INFO and PROGRESS messages of low importance
+COALESCE = "coalesce" #keep only the last pending PROGRESS of each origin
+
 class Origin(object):
     """Class which defines mandatory interface for origin,
     when using the reporting system"""
@@ -61,6 +72,103 @@ class Origin(object):
     def __init__(self, name):
         self.name = name
 
+_origins = weakref.WeakKeyDictionary()
+_origins_by_name = weakref.WeakValueDictionary()
+
+def _origin(sender):
+    """Return the Origin object standing for sender in the messages.
+
+    The same Origin is reused for all the messages of one sender as long
+    as the sender lives and does not change its name."""
+    name = sender.name
+    try:
+        origin = _origins.get(sender)
+    except TypeError:
+        # the sender can't be weakly referenced
+        return Origin(name)
+    if origin is None or origin.name != name:
+        origin = Origin(name)
+        try:
+            _origins[sender] = origin
+        except TypeError:
+            pass
+    return origin
+
+def _named_origin(name):
+    """Origin for messages received from another process, the messages of
+    one sender share it as long as somebody holds one of them"""
+    origin = _origins_by_name.get(name)
+    if origin is None:
+        origin = Origin(name)
+        _origins_by_name[name] = origin
+    return origin
+
+def _message(level, origin, action, importance, message, reply,
+        inreplyto, title, remote, remote_name, remote_address):
+    """Rebuild the Message from its pickled form"""
+    return Message(level, _named_origin(origin), action, importance, message,
+            reply, inreplyto, title, remote, remote_name, remote_address)
+
+class Message(object):
+    """One message sent through the reporting system.
+
+    It can be read (and the fields changed) as dictionary with the keys
+    described in Reports, the origin is pickled as its name only."""
+
+    __slots__ = ("level", "origin", "action", "importance", "message",
+                 "reply", "inreplyto", "title", "remote", "remote_name",
+                 "remote_address")
+
+    def __init__(self, level, origin, action, importance, message,
+            reply = None, inreplyto = None, title = "", remote = False,
+            remote_name = "LOCAL", remote_address = ""):
+        self.level = level
+        self.origin = origin
+        self.action = action
+        self.importance = importance
+        self.message = message
+        self.reply = reply
+        self.inreplyto = inreplyto
+        self.title = title
+        self.remote = remote
+        self.remote_name = remote_name
+        self.remote_address = remote_address
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __setitem__(self, key, value):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __contains__(self, key):
+        return key in self.__slots__
+
+    def get(self, key, default = None):
+        if key not in self.__slots__:
+            return default
+        return getattr(self, key)
+
+    def keys(self):
+        return list(self.__slots__)
+
+    def items(self):
+        return [(k, getattr(self, k)) for k in self.__slots__]
+
+    def copy(self):
+        return Message(*[getattr(self, k) for k in self.__slots__])
+
+    def __reduce__(self):
+        values = [getattr(self, k) for k in self.__slots__]
+        values[1] = self.origin.name
+        return (_message, tuple(values))
+
+    def __repr__(self):
+        return "<Message %r>" % (dict(self.items()),)
+
 class Question(object):
     """A pending question to the user.
 
@@ -126,6 +234,171 @@ class PasswordQuestion(Question):
         super(PasswordQuestion, self).__init__(prompt, options)
         self.confirm = confirm
 
+class Format(object):
+    """Message text which gets formatted only when somebody reads it.
+
+    The helper methods of Reports accept the format arguments separately,
+    so the messages which are filtered out never get formatted. It is sent
+    to other processes as the resulting string."""
+
+    __slots__ = ("fmt", "args", "_text")
+
+    def __init__(self, fmt, args):
+        self.fmt = fmt
+        self.args = args
+        self._text = None
+
+    def __str__(self):
+        if self._text is None:
+            self._text = self.fmt % self.args
+        return self._text
+
+    def __repr__(self):
+        return repr(str(self))
+
+    def __reduce__(self):
+        return (str, (str(self),))
+
+def _lazy(message, args):
+    if args is None:
+        return message
+    return Format(message, args)
+
+class Dispatcher(threading.Thread):
+    """Thread delivering the messages of one Reports object to its
+    subscribers, so slow frontend does not stall the plugins.
+
+    The messages wait in a bounded buffer and are taken out in batches.
+    Questions and answers use separate lane which is always served first
+    and never waits for space. What happens when the buffer is full is
+    decided by the policy (BLOCK, DROP or COALESCE), when DROP or
+    COALESCE can't make any space, the sender waits as with BLOCK."""
+
+    def __init__(self, reports, size = 1000, batch = 50, policy = BLOCK):
+        threading.Thread.__init__(self, name = "Reports dispatcher")
+        self.setDaemon(True)
+        if policy not in (BLOCK, DROP, COALESCE):
+            raise ValueError("Unknown dispatcher policy %s" % (policy,))
+        self._reports = reports
+        self._size = max(1, size)
+        self._batch = max(1, batch)
+        self._policy = policy
+        self._buffer = deque()
+        self._urgent = deque()
+        self._busy = False
+        self._stopped = False
+        self._cond = threading.Condition(threading.Lock())
+        self.dropped = 0
+
+    def push(self, data, sender = None):
+        """Queue the message for delivery.
+
+        sender - None for messages of our Reports object, the mailbox for
+                 the messages which only go to the notify_all callbacks"""
+        if data["action"] == ISSUE and hasattr(data["message"], "snapshot"):
+            # the issue can change before the message gets delivered
+            data = data.copy()
+            data["message"] = data["message"].snapshot()
+
+        self._cond.acquire()
+        try:
+            if data["action"] in QUESTIONS or data["action"] == ANSWER:
+                self._urgent.append((data, sender))
+            else:
+                # the subscribers can send messages too, waiting for
+                # ourselves would never end
+                wait = threading.currentThread() is not self
+                while wait and not self._stopped and \
+                      len(self._buffer) >= self._size and not self._makeSpace():
+                    self._cond.wait()
+                self._buffer.append((data, sender))
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def _makeSpace(self):
+        """Apply the policy to the full buffer, return True when some space
+        was made"""
+        if self._policy == DROP:
+            for idx, (data, sender) in enumerate(self._buffer):
+                if data["action"] in (INFO, PROGRESS) and \
+                   data["importance"] <= logging.INFO:
+                    del self._buffer[idx]
+                    self.dropped += 1
+                    return True
+        elif self._policy == COALESCE:
+            last = {}
+            for item in self._buffer:
+                data = item[0]
+                if data["action"] == PROGRESS:
+                    last[(data["remote_name"], data["origin"].name)] = item
+            kept = deque()
+            for item in self._buffer:
+                data = item[0]
+                if data["action"] != PROGRESS or \
+                   last[(data["remote_name"], data["origin"].name)] is item:
+                    kept.append(item)
+            if len(kept) < len(self._buffer):
+                self.dropped += len(self._buffer) - len(kept)
+                self._buffer = kept
+                return True
+        return False
+
+    def run(self):
+        while True:
+            self._cond.acquire()
+            try:
+                self._busy = False
+                self._cond.notifyAll()
+                while not self._urgent and not self._buffer \
+                      and not self._stopped:
+                    self._cond.wait()
+                if not self._urgent and not self._buffer:
+                    return
+                batch = []
+                while self._urgent:
+                    batch.append(self._urgent.popleft())
+                while self._buffer and len(batch) < self._batch:
+                    batch.append(self._buffer.popleft())
+                self._busy = True
+                # there is space in the buffer again
+                self._cond.notifyAll()
+            finally:
+                self._cond.release()
+
+            for data, sender in batch:
+                try:
+                    if sender is None:
+                        self._reports._deliver(data)
+                    else:
+                        self._reports._notifyAll(data, sender)
+                except Exception:
+                    Logger.exception("Reporting callback failed")
+
+    def flush(self):
+        """Wait until all the queued messages are delivered"""
+        self._cond.acquire()
+        try:
+            while (self._urgent or self._buffer or self._busy) and \
+                  self.isAlive():
+                self._cond.wait(0.1)
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """Deliver the queued messages and end the thread"""
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+        if threading.currentThread() is not self:
+            self.join()
+        if self.dropped:
+            Logger.warning("%d reporting messages were dropped or coalesced",
+                    self.dropped)
+
 class Reports(object):
     """Instances of this class are used as reporting mechanism by which the
     plugins can comminucate back to whatever frontend we are using.
@@ -134,7 +407,7 @@ class Reports(object):
     origin - who sent the message (instance of the plugin, Pluginsystem, ...)
     level - which level of First Aid Kit sent the message (PLUGIN, TASKER, ..)
     action - what action does the message describe
-                (INFO, ALERT, PROGRESS, START, STOP, DATA, END)
+                (INFO, ALERT, PROGRESS, START, STOP, TIMEOUT, DATA, END)
     importance - how is that message important (debug, info, error, ...)
                  this must be number, possibly the same as in logging module
     message - the message itself
@@ -149,16 +422,31 @@ class Reports(object):
     title - title of the message
     """
 
-    def __init__(self, maxsize=-1, silent = False, parent  = None, name = None):
+    def __init__(self, maxsize=-1, silent = False, parent  = None, name = None,
+            queue_importance = 0, progress_window = 0):
         """silent - silently discard messages that don't fit in the queue
-        maxsize - size of the buffer"""
+        maxsize - size of the buffer
+        queue_importance - minimal importance of messages stored in the
+                           queue, None when only the subscribers get the
+                           messages
+        progress_window - see setProgressWindow"""
         self._queue = Queue.Queue(maxsize = maxsize)
         self._queue_lock = thread.allocate_lock()
+        self._queue_importance = queue_importance
         self._silent = silent
         self._mailboxes = []
         self._notify = []
         self._notify_all = []
         self._parent  = parent
+        self._dispatcher = None
+        self._progress_window = progress_window
+        # (remote name, origin name) -> [time, pending, flush timer]
+        self._progress = {}
+        # the timer delivers under it, so the pending update can not arrive
+        # after the next message of its origin, the delivery can report
+        # again from the same thread
+        self._progress_lock = threading.RLock()
+        self._progress_swept = 0
         if not name:
             self._name = "Reporting"
         else:
@@ -171,7 +459,7 @@ class Reports(object):
         The notification function has parameters: reporting object,
         message recorded to the queue, any parameters provided
         when registering"""
-        return self._notify.append((cb, args, kwargs))
+        return self.subscribe(cb, args = args, kwargs = kwargs)
     
     def notify_all(self, cb, *args, **kwargs):
         """When putting anything new into the Queue or mailboxes
@@ -180,7 +468,150 @@ class Reports(object):
         The notification function has parameters: reporting object,
         message recorded to the queue, any parameters provided
         when registering"""
-        return self._notify_all.append((cb, args, kwargs))
+        return self.subscribe(cb, mailboxes = True, args = args,
+                kwargs = kwargs)
+
+    def startDispatcher(self, size = 1000, batch = 50, policy = BLOCK):
+        """Deliver the messages to the subscribers from separate thread,
+        see Dispatcher. The queue is still filled by the sender."""
+        if self._dispatcher is not None:
+            return self._dispatcher
+        self._dispatcher = Dispatcher(self, size = size, batch = batch,
+                policy = policy)
+        self._dispatcher.start()
+        return self._dispatcher
+
+    def stopDispatcher(self):
+        """Deliver all the pending messages and return to synchronous
+        delivery"""
+        if self._dispatcher is None:
+            return
+        dispatcher = self._dispatcher
+        dispatcher.stop()
+        self._dispatcher = None
+
+    def flush(self):
+        """Wait until the dispatcher delivers all pending messages"""
+        if self._dispatcher is not None:
+            self._dispatcher.flush()
+
+    def setProgressWindow(self, seconds):
+        """Deliver at most one PROGRESS message per origin in the given
+        number of seconds, 0 delivers all of them.
+
+        The first update and the final one (position equal to maximum or
+        None) are always delivered. When newer update arrives in the
+        window, the older one is dropped, the last one is delivered when
+        the window passes or before the next message of the same origin."""
+        self._progress_window = seconds
+
+    def _sweep(self, now):
+        """Forget the origins whose window has passed with nothing pending,
+        so the other messages take the fast path again"""
+        if now - self._progress_swept < self._progress_window:
+            return
+        self._progress_swept = now
+        for key, state in self._progress.items():
+            if state[1] is None and now - state[0] >= self._progress_window:
+                del self._progress[key]
+
+    def _cancelFlush(self, state):
+        if state[2] is not None:
+            state[2].cancel()
+            state[2] = None
+
+    def _flushProgress(self, key):
+        """Deliver the update which is still pending when the window of its
+        origin has passed"""
+        self._progress_lock.acquire()
+        try:
+            state = self._progress.get(key)
+            if state is None or state[1] is None:
+                return
+            pending = state[1]
+            state[:] = [time.time(), None, None]
+            self._put(pending)
+        finally:
+            self._progress_lock.release()
+
+    def _throttle(self, data):
+        """Return list of messages which should be delivered now instead of
+        data"""
+        if not self._progress and (not self._progress_window or
+                                   data["action"] != PROGRESS):
+            return [data]
+
+        key = (data["remote_name"], data["origin"].name)
+        now = time.time()
+        self._progress_lock.acquire()
+        try:
+            self._sweep(now)
+            state = self._progress.get(key)
+            if data["action"] != PROGRESS:
+                if state is None or state[1] is None:
+                    return [data]
+                pending, state[1] = state[1], None
+                self._cancelFlush(state)
+                return [pending, data]
+
+            progress = data["message"]
+            if progress is None or progress[0] >= progress[1]:
+                # the final update makes the pending one obsolete
+                state = self._progress.pop(key, None)
+                if state is not None:
+                    self._cancelFlush(state)
+                return [data]
+            if state is None or now - state[0] >= self._progress_window:
+                if state is not None:
+                    self._cancelFlush(state)
+                self._progress[key] = [now, None, None]
+                return [data]
+            state[1] = data
+            if state[2] is None:
+                state[2] = threading.Timer(
+                        max(state[0] + self._progress_window - now, 0),
+                        self._flushProgress, (key,))
+                state[2].setDaemon(True)
+                state[2].start()
+            return []
+        finally:
+            self._progress_lock.release()
+
+    def subscribe(self, cb, importance = 0, actions = None, mailboxes = False,
+            args = (), kwargs = {}):
+        """Run callback cb for the messages with at least the given
+        importance and with one of the actions (None means any action).
+
+        The messages nobody subscribed to are not even created. See notify
+        and notify_all for the callback parameters.
+
+        mailboxes - receive also the messages sent to the mailboxes"""
+        if actions is not None:
+            actions = frozenset(actions)
+        sub = (cb, args, kwargs, importance, actions)
+        if mailboxes:
+            return self._notify_all.append(sub)
+        else:
+            return self._notify.append(sub)
+
+    def wants(self, importance, action):
+        """Return True when message with importance and action would be
+        delivered to somebody"""
+        if self._queue_importance is not None and \
+           importance >= self._queue_importance:
+            return True
+        for cb, args, kwargs, minimum, actions in self._notify:
+            if importance >= minimum and (actions is None or action in actions):
+                return True
+        return self._wantsAll(importance, action)
+
+    def _wantsAll(self, importance, action):
+        for cb, args, kwargs, minimum, actions in self._notify_all:
+            if importance >= minimum and (actions is None or action in actions):
+                return True
+        if self._parent:
+            return self._parent._wantsAll(importance, action)
+        return False
 
     def put(self, message, origin, level, action, importance = logging.INFO,
             reply = None, inreplyto = None, title = "", destination = None):
@@ -189,11 +620,11 @@ class Reports(object):
         if destination is not None:
             return destination.put(message = message, origin = origin, level = level, action = action, importance = importance, reply = reply, title = title, inreplyto = inreplyto)
 
-        origin_msg = Origin(origin.name)
-        
-        data = {"level": level, "origin": origin_msg, "action": action,
-                "importance": importance, "message": message,
-                "reply": reply, "inreplyto": inreplyto, "title": title, "remote": False, "remote_name": "LOCAL", "remote_address": ""}
+        if not self.wants(importance, action):
+            return
+
+        data = Message(level, _origin(origin), action, importance, message,
+                reply, inreplyto, title)
 
         self.put_raw(data)
 
@@ -201,18 +632,33 @@ class Reports(object):
         if destination is not None:
             return destination.put_raw(data)
 
-        try:
-            self._queue.put(data, block = False)
-        except Queue.Full:
-            if not self._silent:
-                raise
+        for data in self._throttle(data):
+            self._put(data)
+
+    def _put(self, data):
+        if self._queue_importance is not None and \
+           data["importance"] >= self._queue_importance:
+            try:
+                self._queue.put(data, block = False)
+            except Queue.Full:
+                if not self._silent:
+                    raise
+
+        dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.push(data)
+        else:
+            self._deliver(data)
 
+    def _deliver(self, data):
         #call all the notify callbacks
-        for func, args, kwargs in self._notify:
-            func(self, data, *args, **kwargs)
+        for func, args, kwargs, minimum, actions in self._notify:
+            if data["importance"] >= minimum and \
+               (actions is None or data["action"] in actions):
+                func(self, data, *args, **kwargs)
         
         #call all the notify-all callbacks
-        self.notifyAll(self, data)
+        self._notifyAll(data, self)
 
     def get(self, mailbox = None, *args, **kwargs):
         if mailbox is not None:
@@ -248,9 +694,18 @@ class Reports(object):
         if sender is None:
             sender = self
 
+        dispatcher = self._dispatcher
+        if dispatcher is not None:
+            dispatcher.push(data, sender)
+        else:
+            self._notifyAll(data, sender)
+
+    def _notifyAll(self, data, sender):
         #call all the notify-all callbacks
-        for func, args, kwargs in self._notify_all:
-            func(sender, data, *args, **kwargs)
+        for func, args, kwargs, minimum, actions in self._notify_all:
+            if data["importance"] >= minimum and \
+               (actions is None or data["action"] in actions):
+                func(sender, data, *args, **kwargs)
 
         if self._parent:
             self._parent.notifyAll(data, sender)
@@ -259,8 +714,10 @@ class Reports(object):
     def end(self, origin, level = PLUGIN):
         return self.put(None, origin, level, END, importance = 1000)
 
-    def error(self, message, origin, inreplyto = None, level = PLUGIN, action = INFO):
-        Logger.error(origin.name+": "+message)
+    def error(self, message, origin, inreplyto = None, level = PLUGIN, action = INFO,
+            args = None):
+        message = _lazy(message, args)
+        Logger.error("%s: %s", origin.name, message)
         return self.put(message, origin, level, action,
                 importance = logging.ERROR, inreplyto = inreplyto)
 
@@ -277,15 +734,19 @@ class Reports(object):
                 importance = importance, inreplyto = inreplyto)
 
     def issue(self, issue, origin, inreplyto = None, level = PLUGIN, importance = logging.INFO):
-        Logger.debug(origin.name+": issue changed state to "+str(issue))
+        Logger.debug("%s: issue changed state to %s", origin.name, issue)
         return self.put(issue, origin, level, ISSUE, importance = importance, inreplyto = inreplyto)
 
-    def info(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.INFO):
-        Logger.info(origin.name+": "+message)
+    def info(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.INFO,
+            args = None):
+        message = _lazy(message, args)
+        Logger.info("%s: %s", origin.name, message)
         return self.put(message, origin, level, INFO, importance = importance, inreplyto = inreplyto)
 
-    def debug(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.DEBUG):
-        Logger.debug(origin.name+": "+message)
+    def debug(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.DEBUG,
+            args = None):
+        message = _lazy(message, args)
+        Logger.debug("%s: %s", origin.name, message)
         return self.put(message, origin, level, INFO, importance = importance, inreplyto = inreplyto)
 
     def tree(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.INFO,
@@ -298,14 +759,25 @@ class Reports(object):
         return self.put(message, origin, level, TABLE,
                 importance = importance, title = title, inreplyto = inreplyto)
 
-    def alert(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.WARNING):
-        return self.put(message, origin, level, ALERT, importance = importance, inreplyto = inreplyto)
+    def alert(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.WARNING,
+            args = None):
+        return self.put(_lazy(message, args), origin, level, ALERT,
+                importance = importance, inreplyto = inreplyto)
 
-    def exception(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.ERROR):
-        Logger.error(origin.name+": "+message)
+    def exception(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.ERROR,
+            args = None):
+        message = _lazy(message, args)
+        Logger.error("%s: %s", origin.name, message)
         return self.put(message, origin, level, EXCEPTION,
                 importance = importance, inreplyto = inreplyto)
 
+    def timeout(self, message, origin, inreplyto = None, level = PLUGIN, importance = logging.ERROR,
+            args = None):
+        message = _lazy(message, args)
+        Logger.error("%s: %s", origin.name, message)
+        return self.put(message, origin, level, TIMEOUT,
+                importance = importance, inreplyto = inreplyto)
+
     def __blocking_question(self, fn, args, kwargs):
         mb = self.openMailbox()
         try:
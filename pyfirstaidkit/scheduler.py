@@ -0,0 +1,174 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+from collections import deque
+import threading
+
+class Scheduler(object):
+    """Decides when the automated tasks can be started.
+
+    Task is any hashable object (Tasker uses (plugin, flow) pairs). Every
+    task waits for all the flags it depends on to be set and for all the
+    flags it conflicts with to be unset. The scheduler watches the
+    Dependencies object and when a flag changes, it updates only the tasks
+    which mention that flag. The task is put to the ready queue in the moment
+    its last condition gets satisfied.
+
+    The scheduler shares the lock of the Dependencies object, so it can be
+    used by multiple worker threads. Every task returned by get has to be
+    confirmed by done when it finishes."""
+
+    def __init__(self, dependencies, usedeps = True):
+        """dependencies - Dependencies object holding the flags
+        usedeps - when False, the flags are ignored and all tasks are ready"""
+        self._deps = dependencies
+        self._usedeps = usedeps
+        self._order = [] # all tasks in the order they were added
+        self._pending = set() # tasks which were not started yet
+        self._flags = {} # task -> (deps, conflicts)
+        self._missing = {} # task -> flags it still waits for
+        self._present = {} # task -> conflicting flags which are set
+        self._required = {} # flag -> tasks which depend on it
+        self._conflicting = {} # flag -> tasks which conflict with it
+        self._ready = deque()
+        self._queued = set()
+        self._running = 0 # tasks returned by get, but not done yet
+        self._stopped = False
+        self._cond = threading.Condition(dependencies.lock)
+        self._deps.watch(self._changed)
+
+    def add(self, task, deps = (), conflicts = ()):
+        """Register new task with its dependencies and conflicts"""
+        if not self._usedeps:
+            deps = conflicts = ()
+
+        self._cond.acquire()
+        try:
+            if task in self._flags:
+                return
+            self._order.append(task)
+            self._pending.add(task)
+            self._flags[task] = (frozenset(deps), frozenset(conflicts))
+            self._missing[task] = set([d for d in deps
+                                       if not self._deps.require(d)])
+            self._present[task] = set([c for c in conflicts
+                                       if self._deps.require(c)])
+            for d in deps:
+                self._required.setdefault(d, []).append(task)
+            for c in conflicts:
+                self._conflicting.setdefault(c, []).append(task)
+
+            self._check(task)
+        finally:
+            self._cond.release()
+
+    def _check(self, task):
+        """Queue the task if it has become ready"""
+        if task in self._pending and task not in self._queued \
+           and not self._missing[task] and not self._present[task]:
+            self._queued.add(task)
+            self._ready.append(task)
+            self._cond.notifyAll()
+
+    def _changed(self, flag, present):
+        """Dependencies watcher, updates the tasks affected by flag"""
+        for task in self._required.get(flag, ()):
+            if present:
+                self._missing[task].discard(flag)
+            else:
+                self._missing[task].add(flag)
+            self._check(task)
+
+        for task in self._conflicting.get(flag, ()):
+            if present:
+                self._present[task].add(flag)
+            else:
+                self._present[task].discard(flag)
+            self._check(task)
+
+    def ready(self, task):
+        """Return True if all conditions of the task are satisfied"""
+        return not self._missing[task] and not self._present[task]
+
+    def get(self, wait = False):
+        """Return next task which can be started or None when there is none.
+
+        wait - when no task is ready, but some are still running, wait
+               until they finish or make some other task ready
+
+        The returned task is considered started and won't be returned
+        again."""
+        self._cond.acquire()
+        try:
+            while not self._stopped:
+                while self._ready:
+                    task = self._ready.popleft()
+                    self._queued.discard(task)
+                    # some flag might have changed since the task was queued
+                    if self.ready(task):
+                        self._pending.remove(task)
+                        self._running += 1
+                        return task
+                if not wait or self._running == 0:
+                    break
+                self._cond.wait()
+            return None
+        finally:
+            self._cond.release()
+
+    def done(self, task):
+        """Confirm that the task returned by get has finished"""
+        self._cond.acquire()
+        try:
+            self._running -= 1
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def stop(self):
+        """Do not return any more tasks and wake up all the waiting
+        workers"""
+        self._cond.acquire()
+        try:
+            self._stopped = True
+            self._cond.notifyAll()
+        finally:
+            self._cond.release()
+
+    def impossible(self):
+        """Return dict task -> flags for the tasks which both require and
+        conflict with the same flags, those can never be started"""
+        res = {}
+        for task in self._order:
+            deps, conflicts = self._flags[task]
+            if deps & conflicts:
+                res[task] = deps & conflicts
+        return res
+
+    def blocked(self):
+        """Return list of (task, missing flags, conflicting flags) for all
+        the tasks which were not started, in the order of adding"""
+        return [(task, self._missing[task], self._present[task])
+                for task in self._order if task in self._pending]
+
+    def close(self):
+        """Stop watching the flags"""
+        self._deps.unwatch(self._changed)
+
+    def __len__(self):
+        """Number of tasks which were not started yet"""
+        return len(self._pending)
@@ -18,8 +18,12 @@
 import os
 import os.path
 import sys
+import signal
 import subprocess
+import thread
+import time
 from backup import *
+from chunkstore import ChunkedBackupStore, ObjectPool, openBackup
 from errors import *
 
 def chroot_func(dir):
@@ -37,13 +41,81 @@ def spawnvch(executable, args, chroot, env = None):
  args - it's parameters
  chroot - directory to chroot to
 
-Returns the subprocess.Popen object"""
+Returns the subprocess.Popen object
 
-    return subprocess.Popen(executable = executable, args = args,
+The process is remembered, so it can be killed by killChildren when
+the plugin step which started it gets cancelled"""
+
+    proc = subprocess.Popen(executable = executable, args = args,
             preexec_fn = chroot_func(chroot), env = env,
             stdin = subprocess.PIPE, stdout = subprocess.PIPE,
             stderr = subprocess.PIPE)
 
+    _children_lock.acquire()
+    try:
+        ident = thread.get_ident()
+        procs = [(p, t) for p, t in _children.get(ident, [])
+                 if p.returncode is None]
+        procs.append((proc, time.time()))
+        _children[ident] = procs
+    finally:
+        _children_lock.release()
+
+    return proc
+
+_children = {} # thread ident -> [(process, start time)] from spawnvch
+_children_lock = thread.allocate_lock()
+
+def killChildren(ident, since = None, grace = 2):
+    """Kill the running processes started by spawnvch from thread ident
+ since - kill only processes started after this time.time() value
+ grace - number of seconds the processes get to exit after SIGTERM,
+         before they are killed by SIGKILL
+
+Returns the number of processes which were signalled"""
+
+    _children_lock.acquire()
+    try:
+        procs = [p for p, t in _children.get(ident, [])
+                 if since is None or t >= since]
+    finally:
+        _children_lock.release()
+
+    # only the thread which started the process reaps it, we must not poll
+    # here, so just check whether it is still alive
+    procs = [p for p in procs if _exists(p)]
+    for p in procs:
+        _signal(p, signal.SIGTERM)
+
+    deadline = time.time() + grace
+    while time.time() < deadline and [p for p in procs if _exists(p)]:
+        time.sleep(0.1)
+
+    for p in procs:
+        if _exists(p):
+            _signal(p, signal.SIGKILL)
+    return len(procs)
+
+def _signal(proc, sig):
+    try:
+        os.kill(proc.pid, sig)
+    except OSError:
+        pass
+
+def _exists(proc):
+    """Return True if the process is still running, zombies waiting for
+    their parent do not count"""
+    if proc.returncode is not None:
+        return False
+    try:
+        f = open("/proc/%d/stat" % proc.pid)
+        try:
+            return f.read().split(") ", 1)[1][0] != "Z"
+        finally:
+            f.close()
+    except (IOError, IndexError):
+        return False
+
 
 def join(path1, path2):
     """Avoids the os.path.join behavioir.
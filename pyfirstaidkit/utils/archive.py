@@ -0,0 +1,186 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Compressed archives of the backed up paths.
+
+The archive is a tar stream cut to blocks, which are compressed by zlib
+independently of each other, so more threads can compress them at the same
+time. Every block is stored as its compressed and raw length followed by
+the compressed data."""
+
+import os
+import copy
+import struct
+import tarfile
+import zlib
+import collections
+from multiprocessing.pool import ThreadPool
+
+#size of the uncompressed blocks
+BLOCK = 1024*1024
+#name of the archived path inside the tar stream
+ROOT = "root"
+
+_header = struct.Struct("!II")
+
+def cpus():
+    try:
+        return max(os.sysconf("SC_NPROCESSORS_ONLN"), 1)
+    except (ValueError, OSError):
+        return 1
+
+class BlockWriter(object):
+    """File object which compresses the written data by blocks.
+
+    With more jobs the blocks are compressed by a pool of threads, at most
+    two blocks per thread are kept in the memory. The pool is started by
+    the first full block, data shorter than one block are compressed
+    directly."""
+
+    def __init__(self, stream, jobs = 1, level = 6, blocksize = None):
+        self._stream = stream
+        self._jobs = max(jobs, 1)
+        self._level = level
+        self._blocksize = blocksize or BLOCK
+        self._buffer = []
+        self._buffered = 0
+        self._pending = collections.deque() # (size, compressed data result)
+        self._pool = None
+
+    def write(self, data):
+        self._buffer.append(data)
+        self._buffered += len(data)
+        if self._buffered < self._blocksize:
+            return
+        data = "".join(self._buffer)
+        start = 0
+        while len(data) - start >= self._blocksize:
+            self._submit(data[start:start + self._blocksize])
+            start += self._blocksize
+        self._buffer = [data[start:]]
+        self._buffered = len(data) - start
+
+    def _submit(self, block, last = False):
+        if self._pool is None and self._jobs > 1 and not last:
+            self._pool = ThreadPool(self._jobs)
+        if self._pool is None:
+            self._write(len(block), zlib.compress(block, self._level))
+            return
+        self._pending.append((len(block), self._pool.apply_async(zlib.compress,
+            (block, self._level))))
+        while len(self._pending) > 2 * self._jobs:
+            self._writeNext()
+
+    def _writeNext(self):
+        size, result = self._pending.popleft()
+        self._write(size, result.get())
+
+    def _write(self, size, data):
+        self._stream.write(_header.pack(len(data), size) + data)
+
+    def close(self):
+        """Write the rest of the data, the stream stays open"""
+        try:
+            if self._buffered:
+                self._submit("".join(self._buffer), last = True)
+                self._buffer = []
+                self._buffered = 0
+            while self._pending:
+                self._writeNext()
+        finally:
+            if self._pool is not None:
+                self._pool.close()
+                self._pool.join()
+                self._pool = None
+
+class BlockReader(object):
+    """File object which decompresses the blocks written by BlockWriter"""
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._buffer = ""
+        self._pos = 0
+
+    def _next(self):
+        """Decompress next block, return False at the end of the stream"""
+        header = self._stream.read(_header.size)
+        if not header:
+            return False
+        if len(header) < _header.size:
+            raise IOError("Truncated compressed archive")
+        length, size = _header.unpack(header)
+        data = self._stream.read(length)
+        try:
+            data = zlib.decompress(data)
+        except zlib.error, e:
+            raise IOError("Damaged compressed archive: %s" % (e,))
+        if len(data) != size:
+            raise IOError("Damaged compressed archive")
+        self._buffer = self._buffer[self._pos:] + data
+        self._pos = 0
+        return True
+
+    def read(self, size = -1):
+        while size < 0 or len(self._buffer) - self._pos < size:
+            if not self._next():
+                break
+        if size < 0:
+            size = len(self._buffer) - self._pos
+        data = self._buffer[self._pos:self._pos + size]
+        self._pos += len(data)
+        return data
+
+def pack(path, stream, jobs = 1):
+    """Write the compressed archive of the file or directory path to
+    stream"""
+    writer = BlockWriter(stream, jobs)
+    try:
+        tar = tarfile.open(fileobj = writer, mode = "w|")
+        try:
+            tar.add(path, arcname = ROOT)
+        finally:
+            tar.close()
+    finally:
+        writer.close()
+
+def _rename(name, base):
+    return base + name[len(ROOT):]
+
+def unpack(stream, path):
+    """Create path from the archive read from stream"""
+    parent, base = os.path.split(os.path.abspath(path))
+    tar = tarfile.open(fileobj = BlockReader(stream), mode = "r|")
+    directories = []
+    try:
+        for info in tar:
+            info.name = _rename(info.name, base)
+            if info.islnk():
+                info.linkname = _rename(info.linkname, base)
+            if info.isdir():
+                # the attributes are set when the content is there
+                directories.append(info)
+                info = copy.copy(info)
+                info.mode = 0700
+            tar.extract(info, parent)
+
+        for info in reversed(directories):
+            target = os.path.join(parent, info.name)
+            tar.chown(info, target)
+            tar.utime(info, target)
+            tar.chmod(info, target)
+    finally:
+        tar.close()
@@ -19,7 +19,16 @@
 # the Free Software Foundation, Inc., 675 Mass Ave, Cambridge, MA
 # 02139, USA.
 from errors import NotImplemented
+import archive
 import os
+import io
+import mmap
+import stat
+import errno
+import fcntl
+import struct
+import time
+import zlib
 import shutil
 import hashlib
 import weakref
@@ -32,15 +41,372 @@ import logging
 class BackupException(Exception):
     pass
 
+# ioctl cloning the data blocks of one file to another (btrfs, XFS)
+FICLONE = 0x40049409
+
+# (source device, destination device) pairs which can not share the data
+_noreflink = set()
+
+def reflink(src, dst):
+    """Create the file dst sharing the data blocks with src, raise
+    IOError or OSError when the filesystem can not do it"""
+    devices = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or ".").st_dev)
+    if devices in _noreflink:
+        raise OSError(errno.EOPNOTSUPP, "reflink not supported")
+    s = open(src, "rb")
+    try:
+        d = open(dst, "wb")
+        try:
+            fcntl.ioctl(d.fileno(), FICLONE, s.fileno())
+        except IOError, e:
+            d.close()
+            os.unlink(dst)
+            if e.errno in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                    errno.EINVAL):
+                _noreflink.add(devices)
+            raise
+        d.close()
+    finally:
+        s.close()
+
+def snapshotFile(src, dst, replace = False):
+    """Make backup copy dst of the file src, the cheapest way possible.
+
+    replace - the file will be replaced (new file renamed over it), not
+              modified in place, so it is safe to keep it by hardlink
+
+    Returns "reflink", "hardlink" or "copy", the way it was done"""
+    if stat.S_ISREG(os.lstat(src).st_mode):
+        try:
+            reflink(src, dst)
+            shutil.copystat(src, dst)
+            return "reflink"
+        except (IOError, OSError):
+            pass
+        if replace:
+            try:
+                os.link(src, dst)
+                return "hardlink"
+            except OSError:
+                pass
+    shutil.copy2(src, dst)
+    return "copy"
+
+def snapshotTree(src, dst, replace = False, index = None, previous = None):
+    """Same as shutil.copytree(src, dst, symlinks = True), but the files are
+    copied by snapshotFile. Returns the set of the ways they were copied.
+
+    index - dict which gets the stamps (see _stamp) of all the files
+    previous - (index, path) of an older backup of src, the files which did
+               not change since then are hardlinked from it ("reference")"""
+    kinds = set()
+    _snapshotTree(src, dst, "", replace, index, previous, kinds)
+    return kinds
+
+def _stamp(st):
+    # ctime catches the changes whose mtime was put back (touch -r)
+    return (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime,
+            st.st_mode, st.st_uid, st.st_gid)
+
+def _snapshotTree(src, dst, rel, replace, index, previous, kinds):
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        r = os.path.join(rel, name)
+        if os.path.islink(s):
+            os.symlink(os.readlink(s), d)
+        elif os.path.isdir(s):
+            _snapshotTree(s, d, r, replace, index, previous, kinds)
+        else:
+            kinds.add(_snapshotEntry(s, d, r, replace, index, previous))
+    shutil.copystat(src, dst)
+
+def _snapshotEntry(src, dst, rel, replace, index, previous):
+    if index is not None:
+        st = os.lstat(src)
+        if stat.S_ISREG(st.st_mode):
+            index[rel] = _stamp(st)
+            if previous is not None and previous[0].get(rel) == index[rel]:
+                older = os.path.join(previous[1], rel)
+                try:
+                    # the older file can be a hardlink of src itself
+                    if os.lstat(older).st_ino != st.st_ino:
+                        os.link(older, dst)
+                        return "reference"
+                except OSError:
+                    pass
+    return snapshotFile(src, dst, replace)
+
+def _private(path):
+    """Return True when path is a directory of the effective user which
+    nobody else can access"""
+    try:
+        st = os.lstat(path)
+    except OSError:
+        return False
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.geteuid() and \
+            not st.st_mode & 077
+
+def _kind(kinds):
+    """Describe the set of snapshotFile results by one word"""
+    if len(kinds) == 1:
+        return list(kinds)[0]
+    elif not kinds:
+        return "copy"
+    else:
+        return "mixed"
+
+class Journal(object):
+    """Append only log of pickled records.
+
+    Every record is prefixed by its length and crc32, so a record which was
+    not completely written when firstaidkit crashed ends the log. The file
+    is flushed after every record, but synced to the disk at most once per
+    delay seconds (and by sync)."""
+
+    _header = struct.Struct("!II")
+
+    def __init__(self, path, delay = 1.0):
+        self._path = path
+        self._delay = delay
+        self._file = None
+        self._synced = 0
+        self._valid = None # length of the complete records
+
+    def records(self):
+        """Return the list of all the complete records"""
+        res = []
+        self._valid = 0
+        try:
+            f = open(self._path, "rb")
+        except IOError:
+            return res
+        try:
+            while True:
+                header = f.read(self._header.size)
+                if len(header) < self._header.size:
+                    break
+                length, crc = self._header.unpack(header)
+                data = f.read(length)
+                if len(data) < length or zlib.crc32(data) & 0xffffffff != crc:
+                    break
+                try:
+                    res.append(pickle.loads(data))
+                except Exception:
+                    break
+                self._valid += self._header.size + length
+        finally:
+            f.close()
+        return res
+
+    def append(self, record):
+        if self._file is None:
+            if self._valid is None:
+                self.records()
+            self._file = open(self._path, "ab")
+            # forget the damaged tail, the new records would be lost after it
+            self._file.truncate(self._valid)
+        data = pickle.dumps(record, pickle.HIGHEST_PROTOCOL)
+        self._file.write(self._header.pack(len(data),
+            zlib.crc32(data) & 0xffffffff) + data)
+        self._file.flush()
+        if time.time() - self._synced >= self._delay:
+            self.sync()
+
+    def sync(self):
+        if self._file is not None:
+            os.fsync(self._file.fileno())
+            self._synced = time.time()
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        self._valid = None
+        try:
+            os.unlink(self._path)
+        except OSError:
+            pass
+
+# direct reads have to be aligned to the logical block size of the device,
+# the page size is the multiple of all the usual ones
+ALIGN = mmap.PAGESIZE
+
+# file header of the ranges backup: magic, version, number of the ranges
+_rangesHeader = struct.Struct("!4sBI")
+# every range: length of the device path, block device flag, identity (rdev
+# of the block device, dev and inode of the other files), offset, length,
+# size of the device and crc32 of the data, followed by the path and data
+_rangeHeader = struct.Struct("!HBQQQQQI")
+
+def _identity(fd):
+    """Return (block device flag, identity) of the open device"""
+    st = os.fstat(fd)
+    if stat.S_ISBLK(st.st_mode):
+        return 1, (st.st_rdev, 0)
+    return 0, (st.st_dev, st.st_ino)
+
+def readRange(fd, offset, length):
+    """Read length bytes at offset, the read is aligned to ALIGN, so it works
+    with O_DIRECT descriptors"""
+    start = offset - offset % ALIGN
+    end = offset + length
+    end += -end % ALIGN
+    buf = mmap.mmap(-1, max(end - start, ALIGN))
+    try:
+        os.lseek(fd, start, os.SEEK_SET)
+        # only the end of the device makes the read shorter
+        read = io.FileIO(fd, closefd = False).readinto(buf)
+        data = buf[offset - start:min(read, offset - start + length)]
+    finally:
+        buf.close()
+    if len(data) < length:
+        raise BackupException("Range %d+%d is beyond the end of the device" %
+                (offset, length))
+    return data
+
+def _openDirect(path):
+    """Open the device for reading, bypassing the page cache when possible"""
+    direct = getattr(os, "O_DIRECT", 0)
+    if direct:
+        try:
+            return os.open(path, os.O_RDONLY | direct)
+        except OSError, e:
+            # not supported by the filesystem (eg. tmpfs)
+            if e.errno != errno.EINVAL:
+                raise
+    return os.open(path, os.O_RDONLY)
+
+class Stage(object):
+    """Shadow tree collecting the changes of a file or directory.
+
+    The changed entries are written to the shadow next to the target and
+    moved over the originals by commit, after the originals are preserved in
+    the backup space. Until then the target is untouched, so rollback only
+    removes the shadow. Both take time proportional to the number of the
+    changed entries, not to the size of the target."""
+
+    def __init__(self, backup, target):
+        self._backup = backup
+        self.target = os.path.abspath(target)
+        parent, self._base = os.path.split(self.target)
+        self.shadow = tempfile.mkdtemp(prefix = ".%s.fakstage-" % self._base,
+                dir = parent)
+        self._removed = set()
+
+    def _targetPath(self, rel):
+        return os.path.join(self.target, rel).rstrip("/")
+
+    def _shadowPath(self, rel):
+        return os.path.join(self.shadow, self._base, rel).rstrip("/")
+
+    def path(self, rel = "", copy = False):
+        """Return the shadow path of the entry rel of the target, the
+        changed content has to be written there.
+
+        copy - copy the current content to the shadow first, so it can be
+               modified in place"""
+        dst = self._shadowPath(rel)
+        src = self._targetPath(rel)
+        self._removed.discard(rel)
+        if not os.path.isdir(os.path.dirname(dst)):
+            os.makedirs(os.path.dirname(dst))
+        if copy and not os.path.lexists(dst) and os.path.lexists(src):
+            if os.path.isdir(src) and not os.path.islink(src):
+                snapshotTree(src, dst)
+            else:
+                snapshotFile(src, dst)
+        return dst
+
+    def open(self, rel = "", mode = "r", buffering = -1):
+        """Open the staged version of the entry rel"""
+        if mode[:1] in ("w", "a") or "+" in mode:
+            path = self.path(rel, copy = mode[:1] != "w")
+        elif os.path.lexists(self._shadowPath(rel)) or rel in self._removed:
+            path = self._shadowPath(rel)
+        else:
+            path = self._targetPath(rel)
+        return open(path, mode, buffering)
+
+    def remove(self, rel = ""):
+        """Remove the entry rel of the target on commit"""
+        path = self._shadowPath(rel)
+        if os.path.isdir(path) and not os.path.islink(path):
+            shutil.rmtree(path)
+        elif os.path.lexists(path):
+            os.unlink(path)
+        self._removed.add(rel)
+
+    def changes(self):
+        """Return the sorted list of the changed entries of the target. New
+        directories are listed as one entry."""
+        res = []
+        if not os.path.lexists(self._shadowPath("")):
+            return res
+        stack = [""]
+        while stack:
+            rel = stack.pop()
+            path = self._shadowPath(rel)
+            target = self._targetPath(rel)
+            if os.path.isdir(path) and not os.path.islink(path) and \
+               os.path.isdir(target) and not os.path.islink(target):
+                stack.extend([os.path.join(rel, name)
+                    for name in os.listdir(path)])
+            else:
+                res.append(rel)
+        res.sort()
+        return res
+
+    def commit(self):
+        """Move the changed entries over the originals"""
+        for rel in sorted(self._removed):
+            target = self._targetPath(rel)
+            if os.path.lexists(target):
+                self._backup.preserve(target, replace = True)
+                if os.path.isdir(target) and not os.path.islink(target):
+                    shutil.rmtree(target)
+                else:
+                    os.unlink(target)
+        for rel in self.changes():
+            target = self._targetPath(rel)
+            shadow = self._shadowPath(rel)
+            self._backup.preserve(target, replace = True)
+            # rename replaces only the entries of the same type, the
+            # directories of both were walked by changes
+            if os.path.isdir(target) and not os.path.islink(target):
+                shutil.rmtree(target)
+            elif os.path.lexists(target) and os.path.isdir(shadow) and \
+                 not os.path.islink(shadow):
+                os.unlink(target)
+            os.rename(shadow, target)
+        self.rollback()
+
+    def rollback(self):
+        """Throw away the changes which were not committed"""
+        shutil.rmtree(self.shadow, ignore_errors = True)
+        self._removed = set()
+        if self in self._backup._stages:
+            self._backup._stages.remove(self)
+
 class BackupStoreInterface(object):
     class Backup:
         def __init__(self, id):
             raise NotImplemented()
 
-        def backupPath(self, path, name = None):
+        def backupPath(self, path, name = None, replace = False,
+                incremental = False):
             raise NotImplemented()
         def backupValue(self, value, name):
             raise NotImplemented()
+        def backupRange(self, device, offset, length, name = None):
+            raise NotImplemented()
+        def backupRanges(self, ranges, name):
+            raise NotImplemented()
 
         def restoreName(self, name, path = None):
             raise NotImplemented()
@@ -48,6 +414,25 @@ class BackupStoreInterface(object):
             raise NotImplemented()
         def restoreValue(self, name):
             raise NotImplemented()
+        def restoreAll(self):
+            raise NotImplemented()
+        def restoreRange(self, name, check = True):
+            raise NotImplemented()
+
+        def preserve(self, path, replace = False):
+            raise NotImplemented()
+        def open(self, path, mode = "r", buffering = -1):
+            raise NotImplemented()
+        def unlink(self, path):
+            raise NotImplemented()
+        def rename(self, src, dst):
+            raise NotImplemented()
+        def rewrite(self, path, data):
+            raise NotImplemented()
+        def stage(self, path):
+            raise NotImplemented()
+        def rollback(self):
+            raise NotImplemented()
 
         def delete(self, name):
             raise NotImplemented()
@@ -63,6 +448,12 @@ class BackupStoreInterface(object):
     def getBackup(self, id, persistent = False):
         raise NotImplemented()
 
+    def adoptBackup(self, id, persistent = False):
+        raise NotImplemented()
+
+    def openBackups(self):
+        raise NotImplemented()
+
     def closeBackup(self, id):
         raise NotImplemented()
 
@@ -75,38 +466,137 @@ class FileBackupStore(BackupStoreInterface):
     _singleton = None
 
     class Backup(BackupStoreInterface.Backup):
-        def __init__(self, id, path, reverting = False):
+        # the replaced files may be kept by hardlinks, it is not safe when
+        # the backup outlives the run, the files can be modified later
+        hardlinks = True
+
+        def __init__(self, id, path, reverting = False, jobs = None):
+            """jobs - store the paths as compressed archives, using so many
+                      threads for the compression"""
             self._id = id
             self._path = path
+            self._jobs = jobs
             self._metafile = "__meta.pickle"
             self._data = {} # name -> (stored as, origin)
             self._origin = {} # origin -> name
+            self._kind = {} # name -> how was the path stored (see snapshotFile)
+            self._stages = [] # Stage objects which were not committed
+            # changes made since the metafile was written
+            self._journal = Journal(os.path.join(self._path, "__meta.journal"))
             # Because the dir is suppose to be there when we are reverting.
             if not reverting:
                 os.makedirs(self._path)
+                self._journal.append(("id", self._id))
+
+        def _apply(self, record):
+            if record[0] == "backup":
+                name, stored, origin, kind = record[1:]
+                self._data[name] = (stored, origin)
+                if origin is not None:
+                    self._origin[origin] = name
+                if kind is not None:
+                    self._kind[name] = kind
+            elif record[0] == "delete":
+                name = record[1]
+                stored, origin = self._data.pop(name, (None, None))
+                self._kind.pop(name, None)
+                if origin is not None:
+                    self._origin.pop(origin, None)
+            elif record[0] == "id" and record[1] != self._id:
+                raise BackupException("Loading metadata for different Backup " \
+                        "(ID mismatch: '%s' and '%s')" % (self._id, record[1]))
+
+        def _commit(self, *record):
+            """Apply the change and append it to the journal"""
+            self._apply(record)
+            self._journal.append(record)
 
         def saveMeta(self):
-            f = open(os.path.join(self._path, self._metafile), "wb")
-            pickle.dump((self._id, self._data, self._origin), f, \
-                    pickle.HIGHEST_PROTOCOL)
-            f.close()
+            """Write the whole metadata and start new journal"""
+            metafile = os.path.join(self._path, self._metafile)
+            f = open(metafile + ".tmp", "wb")
+            try:
+                pickle.dump((self._id, self._data, self._origin, self._kind),
+                        f, pickle.HIGHEST_PROTOCOL)
+                f.flush()
+                os.fsync(f.fileno())
+            finally:
+                f.close()
+            os.rename(metafile + ".tmp", metafile)
+            self._journal.remove()
             return True
 
         def loadMeta(self):
-            f = open(os.path.join(self._path, self._metafile), "rb")
-            (id, data, origin) = pickle.load(f)
-            f.close()
+            metafile = os.path.join(self._path, self._metafile)
+            if os.path.exists(metafile):
+                f = open(metafile, "rb")
+                meta = pickle.load(f)
+                f.close()
+
+                # the backups made by older versions do not have the kinds
+                (id, data, origin) = meta[:3]
+                if id==self._id:
+                    self._data = data
+                    self._origin = origin
+                    if len(meta) > 3:
+                        self._kind = meta[3]
+                else:
+                    raise BackupException("Loading metadata for different "
+                            "Backup (ID mismatch: '%s' and '%s')" %
+                            (self._id, id))
 
-            if id==self._id:
-                self._data = data
-                self._origin = origin
-            else:
-                raise BackupException("Loading metadata for different Backup " \
-                        "(ID mismatch: '%s' and '%s')" % (self._id, id))
+            # the changes which were not compacted (eg. after a crash), the
+            # replay is idempotent, so it does not matter if they were
+            for record in self._journal.records():
+                self._apply(record)
 
             return True
 
-        def backupPath(self, path, name = None):
+        def _previous(self, path):
+            """Return (index, path) of the directory path in the newest
+            persistent backup with the same id left by the older runs, or
+            None.
+
+            Only the stores of the effective user which nobody else can
+            access are used, their metadata are unpickled."""
+            store = os.path.dirname(self._path.rstrip("/"))
+            root = os.path.dirname(store)
+            if not _private(store):
+                return None
+            candidates = []
+            for entry in os.listdir(root):
+                older = os.path.join(root, entry, self._id)
+                if os.path.join(root, entry) == store or \
+                   not _private(os.path.join(root, entry)) or \
+                   os.path.islink(older) or not os.path.isdir(older):
+                    continue
+                candidates.append((os.path.getmtime(older), older))
+
+            candidates.sort(reverse = True)
+            for mtime, older in candidates:
+                try:
+                    backup = FileBackupStore.BackupPersistent(self._id, older,
+                            reverting = True)
+                    backup.loadMeta()
+                    stored = backup._data[backup._origin[path]][0]
+                    f = open(os.path.join(older, stored + ".index"), "rb")
+                    try:
+                        index = pickle.load(f)
+                    finally:
+                        f.close()
+                except Exception:
+                    continue
+                return index, os.path.join(older, stored)
+            return None
+
+        def backupPath(self, path, name = None, replace = False,
+                incremental = False):
+            """replace - the plugin replaces the files instead of modifying
+                         them, so they can be kept by hardlinks (not in
+                         the persistent backups)
+               incremental - files of the directory which did not change
+                             since the last persistent backup of it are only
+                             referenced (hardlinked)"""
             if name is None:
                 name = path
 
@@ -118,17 +608,34 @@ class FileBackupStore(BackupStoreInterface):
                         "store %s!" % (name,self._id))
 
             stored = hashlib.sha224(name).hexdigest()
+            replace = replace and self.hardlinks
 
-            if os.path.isdir(path):
-                shutil.copytree(path, os.path.join(self._path, stored),
-                        symlinks = True)
+            if self._jobs:
+                f = open(os.path.join(self._path, stored), "wb")
+                try:
+                    archive.pack(path, f, self._jobs)
+                finally:
+                    f.close()
+                kind = "archive"
+            elif os.path.isdir(path):
+                previous = None
+                if incremental:
+                    previous = self._previous(path)
+                # the stamps let the next backup be incremental
+                index = {}
+                kind = _kind(snapshotTree(path,
+                    os.path.join(self._path, stored), replace, index,
+                    previous))
+                f = open(os.path.join(self._path, stored + ".index"), "wb")
+                try:
+                    pickle.dump(index, f, pickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
             else:
-                shutil.copy2(path, os.path.join(self._path, stored))
-
-            self._origin[path] = name
-            self._data[name] = (stored, path)
+                kind = snapshotFile(path, os.path.join(self._path, stored),
+                        replace)
 
-            self.saveMeta()
+            self._commit("backup", name, stored, path, kind)
 
             return True
 
@@ -142,9 +649,7 @@ class FileBackupStore(BackupStoreInterface):
             pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
             f.close()
 
-            self._data[name] = (stored, None)
-
-            self.saveMeta()
+            self._commit("backup", name, stored, None, None)
 
             return True
 
@@ -161,29 +666,151 @@ class FileBackupStore(BackupStoreInterface):
 
             return val
 
+        def backupRange(self, device, offset, length, name = None):
+            """Back up length bytes of the device (or file) starting at offset,
+            return the name of the backup"""
+            if name is None:
+                name = "%s@%d+%d" % (device, offset, length)
+            return self.backupRanges([(device, offset, length)], name)
+
+        def backupRanges(self, ranges, name):
+            """Back up the list of (device, offset, length) ranges under one
+            name, return the name"""
+            if self._data.has_key(name):
+                raise BackupException("Named backup %s already in the backup "
+                        "store %s!" % (name,self._id))
+            stored = hashlib.sha224(name).hexdigest()
+
+            f = open(os.path.join(self._path, stored), "wb")
+            try:
+                f.write(_rangesHeader.pack("FAKR", 1, len(ranges)))
+                for device, offset, length in ranges:
+                    fd = _openDirect(device)
+                    try:
+                        block, identity = _identity(fd)
+                        size = os.lseek(fd, 0, os.SEEK_END)
+                        data = readRange(fd, offset, length)
+                    finally:
+                        os.close(fd)
+                    f.write(_rangeHeader.pack(len(device), block,
+                        identity[0], identity[1], offset, length, size,
+                        zlib.crc32(data) & 0xffffffff))
+                    f.write(device)
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            except:
+                f.close()
+                os.unlink(os.path.join(self._path, stored))
+                raise
+            f.close()
+
+            self._commit("backup", name, stored, None, "range")
+            return name
+
+        def _loadRanges(self, name):
+            """Return list of (device, block, identity, offset, size, data)"""
+            stored, origin = self._data[name]
+            if self._kind.get(name) != "range":
+                raise BackupException("Named backup %s is not a device range!"
+                        % (name,))
+
+            res = []
+            f = open(os.path.join(self._path, stored), "rb")
+            try:
+                magic, version, count = _rangesHeader.unpack(
+                        f.read(_rangesHeader.size))
+                if magic != "FAKR" or version != 1:
+                    raise BackupException("Named backup %s has unknown format"
+                            % (name,))
+                for i in range(count):
+                    (pathlen, block, ident1, ident2, offset, length, size,
+                            crc) = _rangeHeader.unpack(
+                                    f.read(_rangeHeader.size))
+                    device = f.read(pathlen)
+                    data = f.read(length)
+                    if len(data) != length or \
+                       zlib.crc32(data) & 0xffffffff != crc:
+                        raise BackupException("Range %d+%d of %s in the "
+                                "backup %s is damaged" %
+                                (offset, length, device, name))
+                    res.append((device, block, (ident1, ident2), offset, size,
+                        data))
+            finally:
+                f.close()
+            return res
+
+        def restoreRange(self, name, check = True):
+            """Write the ranges backed up under name back to their devices.
+
+            check - refuse to write anything when some of the devices has
+                    different identity or size than when it was backed up"""
+            ranges = self._loadRanges(name)
+            fds = {}
+            try:
+                for device, block, identity, offset, size, data in ranges:
+                    if device not in fds:
+                        fds[device] = os.open(device, os.O_WRONLY)
+                    fd = fds[device]
+                    if check and (_identity(fd) != (block, identity) or
+                            os.lseek(fd, 0, os.SEEK_END) != size):
+                        raise BackupException("Device %s has changed since "
+                                "it was backed up" % (device,))
+
+                for device, block, identity, offset, size, data in ranges:
+                    fd = fds[device]
+                    os.lseek(fd, offset, os.SEEK_SET)
+                    while data:
+                        data = data[os.write(fd, data):]
+
+                for fd in fds.values():
+                    os.fsync(fd)
+            finally:
+                for fd in fds.values():
+                    os.close(fd)
+            return True
+
         def restoreName(self, name, path = None):
             stored, origin = self._data[name]
             if origin is None:
                 raise BackupException("Named backup %s is not a filesystem "
                         "object!" % (name,))
 
-            assert self._origin[name]==origin
+            assert self._origin[origin]==name
 
             if path is None:
                 path = origin
 
-            if os.path.exists(path):
-                if os.path.isdir(path):
+            if os.path.lexists(path):
+                if os.path.isdir(path) and not os.path.islink(path):
                     shutil.rmtree(path)
                 else:
                     os.unlink(path)
 
+            kind = self._kind.get(name, "copy")
+            if kind == "absent":
+                return True
+            if not os.path.isdir(os.path.dirname(path) or "."):
+                os.makedirs(os.path.dirname(path))
             stored = os.path.join(self._path, stored)
 
-            if os.path.isdir(stored):
-                shutil.copytree(stored, path, symlinks = True)
+            # hardlinked files are never linked back, the backup has to stay
+            # intact when the restored file gets modified
+            if kind == "archive":
+                f = open(stored, "rb")
+                try:
+                    archive.unpack(f, path)
+                finally:
+                    f.close()
+            elif kind == "copy":
+                if os.path.isdir(stored):
+                    shutil.copytree(stored, path, symlinks = True)
+                else:
+                    shutil.copy2(stored, path)
+            elif os.path.isdir(stored):
+                snapshotTree(stored, path)
             else:
-                shutil.copy2(stored, path)
+                snapshotFile(stored, path)
             return True
 
         def restorePath(self, path, name = None):
@@ -194,27 +821,113 @@ class FileBackupStore(BackupStoreInterface):
 
             return self.restoreName(name, path)
 
+        def restoreAll(self):
+            """Restore all the backed up paths, the directories before the
+            files they contain"""
+            paths = [origin for stored, origin in self._data.values()
+                    if origin is not None]
+            for path in sorted(paths, key = len):
+                self.restoreName(self._origin[path])
+            return True
+
+        def _covered(self, path):
+            """Return True when path or one of its parents is backed up"""
+            while not self._origin.has_key(path):
+                parent = os.path.dirname(path)
+                if parent == path:
+                    return False
+                path = parent
+            return True
+
+        def preserve(self, path, replace = False):
+            """Back up path before its first change. The path which does not
+            exist yet is removed by the restore.
+
+            Returns False when the path was already backed up."""
+            path = os.path.abspath(path)
+            if self._covered(path):
+                return False
+            if os.path.lexists(path):
+                self.backupPath(path, replace = replace)
+            else:
+                self._commit("backup", path, None, path, "absent")
+            return True
+
+        def open(self, path, mode = "r", buffering = -1):
+            """Same as the builtin open, the file is backed up when it is
+            opened for writing"""
+            if mode[:1] in ("w", "a") or "+" in mode:
+                self.preserve(path)
+            return open(path, mode, buffering)
+
+        def unlink(self, path):
+            self.preserve(path, replace = True)
+            os.unlink(path)
+
+        def rename(self, src, dst):
+            # src lives on as dst and can be modified, so it is not linked
+            self.preserve(src)
+            self.preserve(dst, replace = True)
+            os.rename(src, dst)
+
+        def rewrite(self, path, data):
+            """Replace the content of the file by data, the new file is
+            renamed over the old one"""
+            self.preserve(path, replace = True)
+            fd, tmp = tempfile.mkstemp(prefix = os.path.basename(path),
+                    dir = os.path.dirname(os.path.abspath(path)))
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    f.write(data)
+                finally:
+                    f.close()
+                if os.path.exists(path):
+                    st = os.stat(path)
+                    os.chmod(tmp, stat.S_IMODE(st.st_mode))
+                    if os.geteuid() == 0:
+                        os.chown(tmp, st.st_uid, st.st_gid)
+                os.rename(tmp, path)
+            except:
+                os.unlink(tmp)
+                raise
+
+        def stage(self, path):
+            """Return new Stage collecting the changes of path"""
+            stage = Stage(self, path)
+            self._stages.append(stage)
+            return stage
+
+        def rollback(self):
+            """Throw away all the staged changes which were not committed"""
+            for stage in self._stages[:]:
+                stage.rollback()
+            return True
+
         def delete(self, name):
             stored, origin = self._data[name]
+            if self._kind.get(name) == "absent":
+                self._commit("delete", name)
+                return True
             stored = os.path.join(self._path, stored)
 
             if os.path.isdir(stored):
                 shutil.rmtree(stored)
+                if os.path.exists(stored + ".index"):
+                    os.unlink(stored + ".index")
             else:
                 os.unlink(stored)
 
-            del self._data[name]
-            if origin is not None:
-                del self._origin[origin]
-
-            self.saveMeta()
+            self._commit("delete", name)
 
             return True
 
         def cleanup(self):
+            self.rollback()
             _datakeys = self._data.keys()
             for name in _datakeys:
                 self.delete(name)
+            self._journal.remove()
             try:
                 os.remove(os.path.join(self._path, self._metafile))
             except OSError:
@@ -245,11 +958,17 @@ class FileBackupStore(BackupStoreInterface):
             return False
 
     class BackupPersistent(Backup):
+        hardlinks = False
+
         def cleanup(self):
+            self.rollback()
             self.saveMeta()
             return False
 
-    def __init__(self, rootpath = "/tmp", fullpath = ""):
+    def __init__(self, rootpath = "/tmp", fullpath = "", compress = False,
+            jobs = 0):
+        """compress - store the paths as compressed archives
+           jobs - number of compression threads, 0 for the number of CPUs"""
         if self.__class__._singleton:
             raise BackupException("BackupStore with %s type can have only "
                     "one instance" % (self.__name__,))
@@ -264,7 +983,7 @@ class FileBackupStore(BackupStoreInterface):
                 fullpath = ""
             else:
                 self._path = fullpath
-                os.makedirs(fullpath)
+                os.makedirs(fullpath, 0700)
 
         if not fullpath:
             if not os.path.isdir(rootpath):
@@ -274,18 +993,40 @@ class FileBackupStore(BackupStoreInterface):
                     dir = rootpath)
 
         self._backups = {}
+        self._jobs = None
+        if compress:
+            self._jobs = jobs or archive.cpus()
 
         self.__class__._singleton = weakref.proxy(self)
         # print("Backup system initialized")
 
+    def _space(self, id, persistent, reverting = False):
+        if persistent:
+            return self.BackupPersistent(id, self._path+"/"+id+"/",
+                    reverting = reverting, jobs = self._jobs)
+        else:
+            return self.Backup(id, self._path+"/"+id+"/",
+                    reverting = reverting, jobs = self._jobs)
+
     def getBackup(self, id, persistent = False):
         if not self._backups.has_key(id):
-            if persistent:
-                self._backups[id] = self.BackupPersistent(id, self._path+"/"+id+"/")
-            else:
-                self._backups[id] = self.Backup(id, self._path+"/"+id+"/")
+            self._backups[id] = self._space(id, persistent)
+        return self._backups[id]
+
+    def adoptBackup(self, id, persistent = False):
+        """Take over the backup space opened by other process which used
+        a copy of this store (the isolated plugin worker)"""
+        if not self._backups.has_key(id):
+            backup = self._space(id, persistent, reverting = True)
+            backup.loadMeta()
+            self._backups[id] = backup
         return self._backups[id]
 
+    def openBackups(self):
+        """Return list of (id, persistent) of the open backup spaces"""
+        return [(id, isinstance(backup, self.BackupPersistent))
+                for id, backup in self._backups.iteritems()]
+
     def closeBackup(self, id):
         if not self._backups.has_key(id):
             raise BackupException("Backup with id %s does not exist" % (id,))
@@ -0,0 +1,456 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2007 Martin Sivak <msivak@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+"""Deduplicating backup store.
+
+The content of the backed up files is split into chunks which are stored
+in an object pool under the sha256 of their content. The pool is shared by
+all backups and all runs, so the data which did not change since the last
+backup are not stored again. Every backed up path has a manifest listing
+its directories, files (with their chunks) and symlinks, the restore
+builds the tree again from the manifest and the pool."""
+
+import os
+import stat
+import shutil
+import errno
+import time
+import hashlib
+import tempfile
+import threading
+import logging
+import cPickle as pickle
+
+from backup import BackupException, FileBackupStore
+
+Logger = logging.getLogger("firstaidkit")
+
+class ObjectPool(object):
+    """Content addressed store of the file chunks.
+
+    The manifests which use the pool are registered in its refs directory,
+    collect removes the chunks none of them references. The stat cache
+    remembers the chunks of the files seen before, so unchanged files do
+    not have to be read again.
+
+    The pool directory must belong to the effective user and nobody else
+    may access it, the stat cache and the manifests are unpickled."""
+
+    chunksize = 128*1024
+    # unreferenced objects younger than this can belong to a backup which
+    # is just being written by another process
+    grace = 3600
+
+    def __init__(self, path):
+        self._path = path
+        self._objects = os.path.join(path, "objects")
+        self._refs = os.path.join(path, "refs")
+        try:
+            os.makedirs(path, 0700)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        st = os.lstat(path)
+        if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.geteuid() or \
+           st.st_mode & 077:
+            raise BackupException("Object pool %s is not a private "
+                    "directory of the user" % (path,))
+        for d in (self._objects, self._refs):
+            if not os.path.isdir(d):
+                os.makedirs(d, 0700)
+        self._lock = threading.Lock()
+        self._statcache = None
+        self._dirty = False # the stat cache was changed since sync
+
+    def _object(self, digest):
+        return os.path.join(self._objects, digest[:2], digest[2:])
+
+    def put(self, data):
+        """Store the chunk, return its digest"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._object(digest)
+        try:
+            if os.path.getsize(path) == len(data):
+                # keep it safe from collect running in other process
+                os.utime(path, None)
+                return digest
+        except OSError:
+            pass
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            try:
+                os.mkdir(directory, 0700)
+            except OSError, e:
+                if e.errno != errno.EEXIST:
+                    raise
+        fd, tmp = tempfile.mkstemp(dir = directory)
+        try:
+            f = os.fdopen(fd, "wb")
+            try:
+                f.write(data)
+            finally:
+                f.close()
+            os.rename(tmp, path)
+        except:
+            os.unlink(tmp)
+            raise
+        return digest
+
+    def get(self, digest):
+        f = open(self._object(digest), "rb")
+        try:
+            data = f.read()
+        finally:
+            f.close()
+        if hashlib.sha256(data).hexdigest() != digest:
+            raise BackupException("Chunk %s in the object pool %s is "
+                    "damaged" % (digest, self._path))
+        return data
+
+    def has(self, digest):
+        return os.path.exists(self._object(digest))
+
+    def storeFile(self, path, st):
+        """Store the content of the file, return list of its chunk
+        digests"""
+        key = (st.st_dev, st.st_ino, st.st_size, st.st_mtime, st.st_ctime)
+        self._lock.acquire()
+        try:
+            cache = self._loadStatcache()
+            cached = cache.get(path)
+        finally:
+            self._lock.release()
+        if cached is not None and cached[0] == key and \
+           all(map(self.has, cached[1])):
+            for digest in cached[1]:
+                os.utime(self._object(digest), None)
+            return cached[1]
+
+        chunks = []
+        f = open(path, "rb")
+        try:
+            while True:
+                data = f.read(self.chunksize)
+                if not data:
+                    break
+                chunks.append(self.put(data))
+        finally:
+            f.close()
+
+        self._lock.acquire()
+        try:
+            self._statcache[path] = (key, chunks)
+            self._dirty = True
+        finally:
+            self._lock.release()
+        return chunks
+
+    def _loadStatcache(self):
+        if self._statcache is None:
+            try:
+                f = open(os.path.join(self._path, "statcache"), "rb")
+                try:
+                    self._statcache = pickle.load(f)
+                finally:
+                    f.close()
+            except Exception:
+                self._statcache = {}
+        return self._statcache
+
+    def sync(self):
+        """Save the stat cache when it has changed"""
+        self._lock.acquire()
+        try:
+            if not self._dirty:
+                return
+            fd, tmp = tempfile.mkstemp(dir = self._path)
+            f = os.fdopen(fd, "wb")
+            try:
+                pickle.dump(self._statcache, f, pickle.HIGHEST_PROTOCOL)
+            finally:
+                f.close()
+            os.rename(tmp, os.path.join(self._path, "statcache"))
+            self._dirty = False
+        finally:
+            self._lock.release()
+
+    def _ref(self, manifest):
+        return os.path.join(self._refs,
+                hashlib.sha224(os.path.abspath(manifest)).hexdigest())
+
+    def register(self, manifest):
+        """Remember the manifest file, its chunks must not be collected"""
+        ref = self._ref(manifest)
+        if not os.path.lexists(ref):
+            os.symlink(os.path.abspath(manifest), ref)
+
+    def unregister(self, manifest):
+        try:
+            os.unlink(self._ref(manifest))
+        except OSError:
+            pass
+
+    def collect(self):
+        """Remove the chunks which are not used by any registered
+        manifest"""
+        limit = time.time() - self.grace
+        used = set()
+        for name in os.listdir(self._refs):
+            ref = os.path.join(self._refs, name)
+            try:
+                entries = loadManifest(ref)
+            except Exception:
+                # the backup is gone, unless its manifest is still being
+                # written by another process
+                try:
+                    if os.lstat(ref).st_mtime <= limit:
+                        os.unlink(ref)
+                except OSError:
+                    pass
+                continue
+            for entry in entries:
+                if entry[0] == "f":
+                    used.update(entry[4])
+
+        removed = set()
+        for prefix in os.listdir(self._objects):
+            directory = os.path.join(self._objects, prefix)
+            for name in os.listdir(directory):
+                path = os.path.join(directory, name)
+                if prefix + name in used or os.path.getmtime(path) > limit:
+                    continue
+                os.unlink(path)
+                removed.add(prefix + name)
+
+        # forget the files whose chunks are gone
+        self._lock.acquire()
+        try:
+            cache = self._loadStatcache()
+            for path, (key, chunks) in cache.items():
+                if removed.intersection(chunks):
+                    del cache[path]
+                    self._dirty = True
+        finally:
+            self._lock.release()
+        self.sync()
+        return len(removed)
+
+def loadManifest(path):
+    f = open(path, "rb")
+    try:
+        return pickle.load(f)
+    finally:
+        f.close()
+
+def _attrs(st):
+    return (stat.S_IMODE(st.st_mode), st.st_uid, st.st_gid, st.st_atime,
+            st.st_mtime)
+
+def _setAttrs(path, attrs):
+    mode, uid, gid, atime, mtime = attrs
+    if os.geteuid() == 0:
+        os.lchown(path, uid, gid)
+    os.chmod(path, mode)
+    os.utime(path, (atime, mtime))
+
+class ChunkedBackupStore(FileBackupStore):
+    """Backup store keeping the file contents in shared ObjectPool.
+
+    The values are stored the same way FileBackupStore does it."""
+
+    _singleton = None
+    poolfile = "__pool"
+
+    class Backup(FileBackupStore.Backup):
+        def __init__(self, id, path, pool = None, reverting = False):
+            FileBackupStore.Backup.__init__(self, id, path, reverting)
+            poolfile = os.path.join(self._path, ChunkedBackupStore.poolfile)
+            if pool is None:
+                pool = ObjectPool(open(poolfile).read())
+            else:
+                f = open(poolfile, "w")
+                f.write(pool._path)
+                f.close()
+            self._pool = pool
+
+        def _scan(self, path):
+            """Return the manifest entries of the path, file contents are
+            stored to the pool"""
+            entries = []
+            st = os.lstat(path)
+            if not stat.S_ISDIR(st.st_mode):
+                return [self._entry(path, "", st)]
+
+            entries.append(("d", "", _attrs(st)))
+            for root, dirs, files in os.walk(path):
+                rel = root[len(path):].lstrip("/")
+                for name in sorted(dirs + files):
+                    full = os.path.join(root, name)
+                    entries.append(self._entry(full, os.path.join(rel, name),
+                        os.lstat(full)))
+            return entries
+
+        def _entry(self, path, rel, st):
+            if stat.S_ISDIR(st.st_mode):
+                return ("d", rel, _attrs(st))
+            elif stat.S_ISLNK(st.st_mode):
+                return ("l", rel, _attrs(st), os.readlink(path))
+            elif stat.S_ISREG(st.st_mode):
+                return ("f", rel, _attrs(st), st.st_size,
+                        self._pool.storeFile(path, st))
+            else:
+                Logger.warning("Backup of special file %s skipped", path)
+                return ("s", rel, _attrs(st))
+
+        def backupPath(self, path, name = None, replace = False,
+                incremental = False):
+            # the pool never shares the files and every backup is incremental
+            if name is None:
+                name = path
+
+            if self._origin.has_key(path):
+                raise BackupException("Path %s already in the backup store %s!"
+                        % (path,self._id))
+            if self._data.has_key(name):
+                raise BackupException("Named backup %s already in the backup "
+                        "store %s!" % (name,self._id))
+
+            stored = hashlib.sha224(name).hexdigest()
+            manifest = os.path.join(self._path, stored)
+            # register first, so the chunks are safe while they are stored
+            self._pool.register(manifest)
+            entries = self._scan(path)
+            fd, tmp = tempfile.mkstemp(dir = self._path)
+            try:
+                f = os.fdopen(fd, "wb")
+                try:
+                    pickle.dump(entries, f, pickle.HIGHEST_PROTOCOL)
+                finally:
+                    f.close()
+                os.rename(tmp, manifest)
+            except:
+                os.unlink(tmp)
+                raise
+
+            self._commit("backup", name, stored, path, None)
+
+            return True
+
+        def restoreName(self, name, path = None):
+            if self._kind.get(name) == "absent":
+                return FileBackupStore.Backup.restoreName(self, name, path)
+            stored, origin = self._data[name]
+            if origin is None:
+                raise BackupException("Named backup %s is not a filesystem "
+                        "object!" % (name,))
+
+            if path is None:
+                path = origin
+
+            if os.path.lexists(path):
+                if os.path.isdir(path) and not os.path.islink(path):
+                    shutil.rmtree(path)
+                else:
+                    os.unlink(path)
+            if not os.path.isdir(os.path.dirname(path) or "."):
+                os.makedirs(os.path.dirname(path))
+
+            entries = loadManifest(os.path.join(self._path, stored))
+            directories = []
+            for entry in entries:
+                kind, rel, attrs = entry[:3]
+                target = os.path.join(path, rel).rstrip("/")
+                if kind == "d":
+                    os.mkdir(target, 0700)
+                    # the times would change when the content is created
+                    directories.append((target, attrs))
+                elif kind == "l":
+                    os.symlink(entry[3], target)
+                    if os.geteuid() == 0:
+                        os.lchown(target, attrs[1], attrs[2])
+                elif kind == "f":
+                    f = open(target, "wb")
+                    try:
+                        for digest in entry[4]:
+                            f.write(self._pool.get(digest))
+                    finally:
+                        f.close()
+                    _setAttrs(target, attrs)
+
+            for target, attrs in reversed(directories):
+                _setAttrs(target, attrs)
+            return True
+
+        def delete(self, name):
+            stored, origin = self._data[name]
+            if origin is None or self._kind.get(name) == "absent":
+                return FileBackupStore.Backup.delete(self, name)
+
+            manifest = os.path.join(self._path, stored)
+            os.unlink(manifest)
+            self._pool.unregister(manifest)
+
+            self._commit("delete", name)
+
+            return True
+
+        def cleanup(self):
+            # the stat cache is saved once per space, not for every path
+            self._pool.sync()
+            try:
+                os.remove(os.path.join(self._path,
+                    ChunkedBackupStore.poolfile))
+            except OSError:
+                pass
+            return FileBackupStore.Backup.cleanup(self)
+
+    class BackupPersistent(Backup):
+        def cleanup(self):
+            self._pool.sync()
+            self.rollback()
+            self.saveMeta()
+            return False
+
+    def __init__(self, rootpath = "/tmp", fullpath = "", pool = ""):
+        """pool - directory of the ObjectPool, by default fakbackup-pool
+                  next to the backup directory"""
+        FileBackupStore.__init__(self, rootpath, fullpath)
+        if not pool:
+            pool = os.path.join(os.path.dirname(self._path.rstrip("/")),
+                    "fakbackup-pool")
+        self._pool = ObjectPool(pool)
+        # leftovers of the previous runs
+        self._pool.collect()
+
+    def _space(self, id, persistent, reverting = False):
+        if persistent:
+            return self.BackupPersistent(id, self._path+"/"+id+"/",
+                    self._pool, reverting)
+        else:
+            return self.Backup(id, self._path+"/"+id+"/", self._pool,
+                    reverting)
+
+def openBackup(id, path):
+    """Return the persistent backup stored in path by any of the stores,
+    used when reverting"""
+    if os.path.exists(os.path.join(path, ChunkedBackupStore.poolfile)):
+        backup = ChunkedBackupStore.BackupPersistent(id, path,
+                reverting = True)
+    else:
+        backup = FileBackupStore.BackupPersistent(id, path, reverting = True)
+    backup.loadMeta()
+    return backup
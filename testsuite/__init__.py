@@ -15,4 +15,5 @@
 # along with this program; if not, write to the Free Software
 # Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
 
-modnames = ['initialization', "cli"]
+modnames = ['initialization', "cli", "scheduler", "deadlines", "manifest", "flows",
+            "reporting", "protocol", "fleet", "backup"]
@@ -0,0 +1,516 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+import unittest, tempfile, shutil, os, stat, time, StringIO
+from pyfirstaidkit.utils import ChunkedBackupStore, ObjectPool, openBackup, \
+        FileBackupStore
+from pyfirstaidkit.utils import archive, BackupException
+
+class Fixture(unittest.TestCase):
+    """Temporary directory with the data directory and the backup store,
+    the backup space "test" is opened unless backupid is None"""
+
+    storeclass = FileBackupStore
+    storeargs = {}
+    backupid = "test"
+    persistent = False
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.data = os.path.join(self.root, "data")
+        os.makedirs(os.path.join(self.data, "sub"))
+        self.prepare()
+        self.backup = None
+        self.store = self.newStore()
+        if self.backupid is not None:
+            self.backup = self.store.getBackup(self.backupid,
+                    persistent = self.persistent)
+
+    def tearDown(self):
+        self.backup = None
+        self.store = None
+        self.storeclass._singleton = None
+        shutil.rmtree(self.root)
+
+    def prepare(self):
+        """Create the data before the store"""
+        pass
+
+    def newStore(self):
+        self.store = None
+        self.storeclass._singleton = None
+        return self.storeclass(rootpath = os.path.join(self.root, "backups"),
+                **self.storeargs)
+
+    def path(self, name):
+        return os.path.join(self.data, name)
+
+    def write(self, name, data):
+        f = open(self.path(name), "w")
+        f.write(data)
+        f.close()
+
+    def read(self, name):
+        return open(self.path(name), "rb").read()
+
+class Chunked(Fixture):
+    storeclass = ChunkedBackupStore
+    backupid = None
+
+    def prepare(self):
+        self.write("a", "first file\n")
+        self.write("sub/b", "x" * (ObjectPool.chunksize * 2 + 10))
+        os.chmod(self.path("sub/b"), 0600)
+        os.symlink("../a", self.path("sub/link"))
+
+    def objects(self):
+        res = []
+        for root, dirs, files in os.walk(os.path.join(self.root, "backups",
+                "fakbackup-pool", "objects")):
+            res.extend(files)
+        return sorted(res)
+
+    def testRestore(self):
+        backup = self.store.getBackup("test")
+        backup.backupPath(self.data)
+        shutil.rmtree(os.path.join(self.data, "sub"))
+        self.write("a", "changed\n")
+        backup.restorePath(self.data)
+        self.assertEqual(self.read("a"), "first file\n")
+        self.assertEqual(len(self.read("sub/b")),
+                ObjectPool.chunksize * 2 + 10)
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.data, "sub",
+            "b")).st_mode), 0600)
+        self.assertEqual(os.readlink(os.path.join(self.data, "sub", "link")),
+                "../a")
+
+    def testDeduplication(self):
+        self.store.getBackup("first").backupPath(self.data)
+        objects = self.objects()
+        # "x" * chunksize is stored only once
+        self.assertEqual(len(objects), 3)
+        self.store.getBackup("second").backupPath(self.data)
+        self.assertEqual(self.objects(), objects)
+        self.write("a", "changed\n")
+        self.store.getBackup("third").backupPath(self.data)
+        self.assertEqual(len(self.objects()), 4)
+
+    def testCollect(self):
+        backup = self.store.getBackup("test", persistent = True)
+        backup.backupPath(self.data)
+        self.store.getBackup("other").backupPath(os.path.join(self.data, "a"))
+        self.store.closeBackup("other")
+        self.write("a", "changed\n")
+        self.store.getBackup("other").backupPath(os.path.join(self.data, "a"))
+        self.store.closeBackup("other")
+        self.store._pool.grace = 0
+        self.assertEqual(self.store._pool.collect(), 1)
+
+        # the persistent backup survives the store
+        path = self.store._path
+        self.store = self.newStore()
+        shutil.rmtree(self.data)
+        backup = openBackup("test", os.path.join(path, "test"))
+        backup.restoreName(self.data)
+        self.assertEqual(self.read("a"), "first file\n")
+
+    def testUnsafePool(self):
+        pool = os.path.join(self.root, "shared")
+        os.mkdir(pool, 0777)
+        os.chmod(pool, 0777)
+        self.assertRaises(BackupException, ObjectPool, pool)
+
+    def testDamagedChunk(self):
+        pool = self.store._pool
+        digest = pool.put("data")
+        f = open(pool._object(digest), "w")
+        f.write("evil")
+        f.close()
+        self.assertRaises(BackupException, pool.get, digest)
+        # planted object of other size is replaced
+        f = open(pool._object(digest), "w")
+        f.write("planted")
+        f.close()
+        pool.put("data")
+        self.assertEqual(pool.get(digest), "data")
+
+    def testPendingManifest(self):
+        pool = self.store._pool
+        manifest = os.path.join(self.root, "pending")
+        pool.register(manifest)
+        pool.collect()
+        self.assert_(os.path.lexists(pool._ref(manifest)))
+        pool.grace = 0
+        pool.collect()
+        self.failIf(os.path.lexists(pool._ref(manifest)))
+
+    def testStatcachePruned(self):
+        self.store.getBackup("other").backupPath(os.path.join(self.data, "a"))
+        self.store.closeBackup("other")
+        pool = self.store._pool
+        self.assert_(os.path.join(self.data, "a") in pool._statcache)
+        pool.grace = 0
+        self.assertEqual(pool.collect(), 1)
+        self.failIf(os.path.join(self.data, "a") in pool._statcache)
+
+    def testStatcacheSync(self):
+        statcache = os.path.join(self.store._pool._path, "statcache")
+        backup = self.store.getBackup("other")
+        backup.backupPath(self.path("a"))
+        backup.backupPath(self.path("sub"))
+        self.failIf(os.path.exists(statcache))
+        self.store.closeBackup("other")
+        self.assert_(os.path.exists(statcache))
+
+class Snapshot(Fixture):
+    def prepare(self):
+        self.file = self.path("file")
+        self.write("file", "original\n")
+
+    def replace(self, data):
+        self.write("file.new", data)
+        os.rename(self.file + ".new", self.file)
+
+    def testReplace(self):
+        self.backup.backupPath(self.file, replace = True)
+        self.assertTrue(self.backup._kind[self.file] in ("reflink",
+            "hardlink"))
+        self.replace("changed\n")
+        self.backup.restorePath(self.file)
+        self.assertEqual(open(self.file).read(), "original\n")
+
+        # the restored file is not linked to the backup
+        f = open(self.file, "w")
+        f.write("modified\n")
+        f.close()
+        self.backup.restorePath(self.file)
+        self.assertEqual(open(self.file).read(), "original\n")
+
+    def testCopy(self):
+        self.backup.backupPath(self.file)
+        self.assertTrue(self.backup._kind[self.file] in ("reflink", "copy"))
+        f = open(self.file, "w")
+        f.write("modified\n")
+        f.close()
+        self.backup.restorePath(self.file)
+        self.assertEqual(open(self.file).read(), "original\n")
+
+    def testPersistentReplace(self):
+        backup = self.store.getBackup("persistent", persistent = True)
+        backup.backupPath(self.file, replace = True)
+        self.assertNotEqual(backup._kind[self.file], "hardlink")
+        stored = os.path.join(backup._path, backup._data[self.file][0])
+        self.assertNotEqual(os.stat(stored).st_ino, os.stat(self.file).st_ino)
+
+class Journal(Fixture):
+    persistent = True
+
+    def setUp(self):
+        Fixture.setUp(self)
+        self.space = self.backup._path
+
+    def testCrash(self):
+        for i in range(20):
+            self.backup.backupValue(i, "value%d" % i)
+        self.backup.delete("value3")
+        self.assertFalse(os.path.exists(os.path.join(self.space,
+            "__meta.pickle")))
+
+        # the last record was not completely written
+        journal = os.path.join(self.space, "__meta.journal")
+        f = open(journal, "r+b")
+        f.truncate(os.path.getsize(journal) - 3)
+        f.close()
+
+        backup = openBackup("test", self.space)
+        self.assertEqual(backup.restoreValue("value19"), 19)
+        self.assertTrue(backup.exists(name = "value3"))
+        backup.backupValue("new", "value3b")
+        backup = openBackup("test", self.space)
+        self.assertEqual(backup.restoreValue("value3b"), "new")
+
+    def testCompaction(self):
+        for i in range(5):
+            self.backup.backupValue(i, "value%d" % i)
+        self.backup.delete("value0")
+        self.store.closeBackup("test")
+        self.assertFalse(os.path.exists(os.path.join(self.space,
+            "__meta.journal")))
+
+        backup = openBackup("test", self.space)
+        self.assertFalse(backup.exists(name = "value0"))
+        self.assertEqual(backup.restoreValue("value4"), 4)
+
+    def testAdopt(self):
+        # the space was opened by the isolated worker
+        self.backup.backupValue(1, "value")
+        del self.store._backups["test"]
+        backup = self.store.adoptBackup("test", persistent = True)
+        self.assertEqual(backup.restoreValue("value"), 1)
+        self.assertEqual(self.store.openBackups(), [("test", True)])
+
+class Compressed(Fixture):
+    storeargs = {"compress": True, "jobs": 3}
+
+    def prepare(self):
+        self.big = "".join([chr(i % 251) for i in range(300000)])
+        self.write("a", "first file\n")
+        self.write("sub/big", self.big)
+        os.chmod(self.path("sub"), 0750)
+        os.symlink("../a", self.path("sub/link"))
+        os.link(self.path("a"), self.path("hard"))
+
+    def testBlocks(self):
+        stream = StringIO.StringIO()
+        writer = archive.BlockWriter(stream, jobs = 3, blocksize = 1000)
+        for i in range(0, len(self.big), 777):
+            writer.write(self.big[i:i+777])
+        writer.close()
+        stream.seek(0)
+        reader = archive.BlockReader(stream)
+        self.assertEqual(reader.read(10), self.big[:10])
+        self.assertEqual(reader.read(), self.big[10:])
+        self.assertEqual(reader.read(10), "")
+
+    def testSmall(self):
+        started = []
+        pool = archive.ThreadPool
+        archive.ThreadPool = lambda jobs: started.append(jobs) or pool(jobs)
+        try:
+            for size in (999, 2500):
+                stream = StringIO.StringIO()
+                writer = archive.BlockWriter(stream, jobs = 3,
+                        blocksize = 1000)
+                writer.write("x" * size)
+                writer.close()
+                stream.seek(0)
+                self.assertEqual(archive.BlockReader(stream).read(),
+                        "x" * size)
+        finally:
+            archive.ThreadPool = pool
+        # only the data longer than one block start the threads
+        self.assertEqual(started, [3])
+
+    def testRestore(self):
+        self.backup.backupPath(self.data)
+        self.backup.backupPath(os.path.join(self.data, "a"), name = "a")
+        self.assertEqual(self.backup._kind[self.data], "archive")
+        shutil.rmtree(os.path.join(self.data, "sub"))
+        self.write("a", "changed\n")
+
+        self.backup.restoreName("a")
+        self.assertEqual(self.read("a"), "first file\n")
+
+        self.backup.restorePath(self.data)
+        self.assertEqual(self.read("sub/big"), self.big)
+        self.assertEqual(os.readlink(os.path.join(self.data, "sub", "link")),
+                "../a")
+        self.assertEqual(stat.S_IMODE(os.stat(os.path.join(self.data,
+            "sub")).st_mode), 0750)
+        self.assertEqual(os.stat(os.path.join(self.data, "a")).st_ino,
+                os.stat(os.path.join(self.data, "hard")).st_ino)
+
+class Incremental(Fixture):
+    backupid = None
+
+    def prepare(self):
+        self.write("a", "first file\n")
+        self.write("sub/b", "second file\n")
+
+    def runBackup(self):
+        self.store = self.newStore()
+        backup = self.store.getBackup("test", persistent = True)
+        backup.backupPath(self.data, incremental = True)
+        return backup
+
+    def inode(self, backup, name):
+        stored = backup._data[self.data][0]
+        return os.stat(os.path.join(backup._path, stored, name)).st_ino
+
+    def testReferences(self):
+        first = self.runBackup()
+        self.assertTrue(first._kind[self.data] in ("copy", "reflink"))
+        self.write("sub/b", "changed\n")
+        second = self.runBackup()
+        self.assertEqual(second._kind[self.data], "mixed")
+        self.assertEqual(self.inode(first, "a"), self.inode(second, "a"))
+        self.assertNotEqual(self.inode(first, "sub/b"),
+                self.inode(second, "sub/b"))
+
+        shutil.rmtree(first._path)
+        shutil.rmtree(self.data)
+        second.restorePath(self.data)
+        self.assertEqual(open(os.path.join(self.data, "a")).read(),
+                "first file\n")
+        self.assertEqual(open(os.path.join(self.data, "sub", "b")).read(),
+                "changed\n")
+
+    def testTimesPutBack(self):
+        os.utime(self.path("a"), (1000000000, 1000000000))
+        first = self.runBackup()
+        time.sleep(0.01)
+        f = open(self.path("a"), "r+")
+        f.write("FIRST")
+        f.close()
+        os.utime(self.path("a"), (1000000000, 1000000000))
+        second = self.runBackup()
+        self.assertNotEqual(self.inode(first, "a"), self.inode(second, "a"))
+
+    def testLiveInode(self):
+        first = self.runBackup()
+        # backup made by hardlinking the live file
+        stored = os.path.join(first._path, first._data[self.data][0], "a")
+        os.unlink(stored)
+        os.link(os.path.join(self.data, "a"), stored)
+        second = self.runBackup()
+        self.assertNotEqual(self.inode(second, "a"),
+                os.stat(os.path.join(self.data, "a")).st_ino)
+
+    def testForeignStore(self):
+        planted = os.path.join(self.root, "backups", "planted", "test")
+        os.makedirs(planted)
+        os.chmod(os.path.dirname(planted), 0755)
+        marker = os.path.join(self.root, "marker")
+        f = open(os.path.join(planted, "__meta.pickle"), "w")
+        f.write("cos\nmkdir\n(S'%s'\ntR." % marker)
+        f.close()
+        backup = self.runBackup()
+        self.failIf(os.path.exists(marker))
+        self.assertTrue(backup._kind[self.data] in ("copy", "reflink"))
+
+class Lazy(Fixture):
+    def prepare(self):
+        for name in ("a", "b", "c", "sub/d"):
+            self.write(name, name + "\n")
+
+    def testRestoreAll(self):
+        self.backup.unlink(self.path("a"))
+        self.backup.rewrite(self.path("b"), "new b\n")
+        f = self.backup.open(self.path("c"), "a")
+        f.write("more\n")
+        f.close()
+        self.backup.rename(self.path("b"), self.path("e"))
+        self.backup.rewrite(self.path("e"), "new e\n")
+        self.assertEqual(self.backup.open(self.path("e")).read(), "new e\n")
+        self.assertEqual(len(self.backup._data), 4)
+
+        self.backup.preserve(self.path("sub"))
+        self.assertFalse(self.backup.preserve(self.path("sub/d")))
+        self.backup.unlink(self.path("sub/d"))
+
+        self.backup.restoreAll()
+        self.assertEqual(sorted(os.listdir(self.data)), ["a", "b", "c", "sub"])
+        for name in ("a", "b", "c", "sub/d"):
+            self.assertEqual(open(self.path(name)).read(), name + "\n")
+
+    def testMissingParent(self):
+        self.backup.unlink(self.path("sub/d"))
+        os.rmdir(self.path("sub"))
+        self.backup.restoreAll()
+        self.assertEqual(self.read("sub/d"), "sub/d\n")
+
+class ChunkedLazy(Lazy):
+    storeclass = ChunkedBackupStore
+
+class Staging(Fixture):
+    def prepare(self):
+        for name in ("a", "b", "c", "sub/d"):
+            self.write(name, name + "\n")
+
+    def change(self):
+        stage = self.backup.stage(self.data)
+        f = stage.open("a", "w")
+        f.write("new a\n")
+        f.close()
+        f = stage.open("sub/d", "a")
+        f.write("more\n")
+        f.close()
+        stage.remove("b")
+        os.makedirs(stage.path("new/dir"))
+        self.assertEqual(stage.open("sub/d").read(), "sub/d\nmore\n")
+        self.assertEqual(stage.open("c").read(), "c\n")
+        self.assertRaises(IOError, stage.open, "b")
+        self.assertEqual(stage.changes(), ["a", "new", "sub/d"])
+        return stage
+
+    def unchanged(self):
+        self.assertEqual(sorted(os.listdir(self.data)), ["a", "b", "c", "sub"])
+        for name in ("a", "b", "c", "sub/d"):
+            self.assertEqual(open(self.path(name)).read(), name + "\n")
+
+    def testCommit(self):
+        stage = self.change()
+        self.unchanged()
+        stage.commit()
+        self.assertEqual(sorted(os.listdir(self.root)), ["backups", "data"])
+        self.assertEqual(sorted(os.listdir(self.data)),
+                ["a", "c", "new", "sub"])
+        self.assertEqual(open(self.path("a")).read(), "new a\n")
+        self.assertEqual(open(self.path("sub/d")).read(), "sub/d\nmore\n")
+        self.assertTrue(os.path.isdir(self.path("new/dir")))
+
+        self.backup.restoreAll()
+        self.unchanged()
+
+    def testRollback(self):
+        self.change()
+        self.backup.rollback()
+        self.assertEqual(sorted(os.listdir(self.root)), ["backups", "data"])
+        self.unchanged()
+        self.assertEqual(self.backup._data, {})
+
+class ChunkedStaging(Staging):
+    storeclass = ChunkedBackupStore
+
+class Ranges(Fixture):
+    def prepare(self):
+        self.disks = []
+        for i in range(2):
+            name = "disk%d" % i
+            self.write(name, "".join([chr((j + i) % 256)
+                                      for j in range(10000)]))
+            self.disks.append(self.path(name))
+
+    def overwrite(self, path, offset, data):
+        f = open(path, "r+b")
+        f.seek(offset)
+        f.write(data)
+        f.close()
+
+    def testRestore(self):
+        original = [self.read(d) for d in self.disks]
+        name = self.backup.backupRanges([(self.disks[0], 0, 446),
+            (self.disks[0], 5000, 3000), (self.disks[1], 9000, 1000)],
+            "boot")
+        self.overwrite(self.disks[0], 100, "x" * 6000)
+        self.overwrite(self.disks[1], 9500, "x" * 500)
+        self.backup.restoreRange(name)
+        self.assertEqual(self.read(self.disks[0])[:446], original[0][:446])
+        self.assertEqual(self.read(self.disks[0])[5000:8000],
+                original[0][5000:8000])
+        self.assertEqual(self.read(self.disks[1]), original[1])
+
+        self.assertRaises(BackupException, self.backup.backupRange,
+                self.disks[0], 9990, 20)
+
+    def testChanged(self):
+        name = self.backup.backupRange(self.disks[0], 0, 512)
+        self.overwrite(self.disks[0], 0, "x" * 512)
+        self.overwrite(self.disks[0], 10000, "y")
+        self.assertRaises(BackupException, self.backup.restoreRange, name)
+        self.assertEqual(self.read(self.disks[0])[:512], "x" * 512)
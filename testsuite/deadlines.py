@@ -0,0 +1,80 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+import unittest, time
+from pyfirstaidkit.plugins import Plugin
+from pyfirstaidkit.returns import *
+from pyfirstaidkit.reporting import Reports, TIMEOUT
+from pyfirstaidkit.dependency import Dependencies
+from pyfirstaidkit.utils import spawnvch
+
+class Sleeper(Plugin):
+    def prepare(self):
+        self._result = ReturnSuccess
+
+    def diagnose(self):
+        self.proc = spawnvch("/bin/sleep", ["sleep", "30"], "/")
+        self.proc.communicate()
+        self._result = ReturnSuccess
+
+    def clean(self):
+        while self.continuing():
+            time.sleep(0.05)
+        self._result = ReturnSuccess
+
+class Deadlines(unittest.TestCase):
+    def setUp(self):
+        self.reporting = Reports()
+        self.plugin = Sleeper("diagnose", self.reporting, Dependencies())
+
+    def run_flow(self):
+        start = time.time()
+        steps = [step for step, result in self.plugin]
+        return steps, time.time() - start
+
+    def timeouts(self):
+        res = []
+        while not self.reporting._queue.empty():
+            msg = self.reporting.get()
+            if msg["action"] == TIMEOUT:
+                res.append(msg["message"])
+        return res
+
+    def testStepTimeout(self):
+        self.plugin.setTimeouts(steps = {"diagnose": 0.5, "clean": 0.5})
+        steps, duration = self.run_flow()
+        self.assertEqual(steps, ["prepare", "diagnose", "clean"])
+        self.assert_(duration < 5)
+        self.assertNotEqual(self.plugin.proc.returncode, 0)
+        self.assertEqual(len(self.timeouts()), 2)
+
+    def testDeadline(self):
+        self.plugin.setTimeouts(timeout = 0.5, grace = 0.5)
+        steps, duration = self.run_flow()
+        self.assertEqual(steps, ["prepare", "diagnose", "clean"])
+        self.assert_(duration < 5)
+        timeouts = self.timeouts()
+        self.assertEqual(len(timeouts), 2)
+        self.assert_(timeouts[0].startswith("Deadline"))
+        self.assert_(timeouts[1].startswith("Cleanup"))
+
+    def testNoTimeout(self):
+        self.plugin.setTimeouts(steps = {"prepare": 10})
+        self.plugin.call("prepare")
+        self.assertEqual(self.plugin._result, ReturnSuccess)
+        self.assertEqual(self.timeouts(), [])
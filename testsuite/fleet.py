@@ -0,0 +1,264 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+
+import unittest, sys, os, threading, time, zipfile, logging, tempfile
+import shutil, subprocess
+from pyfirstaidkit import reporting, fleet
+from pyfirstaidkit.configuration import FAKConfig, Info, resetInfo
+from pyfirstaidkit.issue import SimpleIssue
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# shell sending result archive which does not match its checksum
+damaged = """
+import sys
+sys.path.insert(0, %r)
+from pyfirstaidkit import protocol
+sys.stdout.write("[firstaidkit-shell] Ready protocol=1\\n")
+sys.stdout.flush()
+while sys.stdin.readline() not in ("[commit]\\n", ""):
+    pass
+sys.stdout.write("[firstaidkit-shell] Starting\\n")
+writer = protocol.FrameWriter(sys.stdout)
+writer.control("attachment", 5, "0" * 64)
+writer.send(protocol.ATTACHMENT, "hello")
+writer.control("end")
+""" % (root,)
+
+# runs the shell, passes only the first bytes of its output and exits
+# leaving the shell alone, like a broken ssh connection
+cut = """
+import os, sys, subprocess
+shell = subprocess.Popen(sys.argv[2:], stdout = subprocess.PIPE)
+left = int(sys.argv[1])
+while left > 0:
+    data = os.read(shell.stdout.fileno(), left)
+    if not data:
+        break
+    os.write(1, data)
+    left -= len(data)
+os._exit(0)
+"""
+
+class Transport(fleet.LocalTransport):
+    """Local transport which counts the sessions"""
+    def __init__(self, command, transient = False):
+        fleet.LocalTransport.__init__(self, command)
+        self.spawned = 0
+        self.lock = threading.Lock()
+        self._transient = transient
+
+    def spawn(self, address):
+        self.lock.acquire()
+        self.spawned += 1
+        self.lock.release()
+        return fleet.LocalTransport.spawn(self, address)
+
+    def transient(self, returncode):
+        return self._transient
+
+class Fleet(unittest.TestCase):
+    def setUp(self):
+        self.reports = reporting.Reports(queue_importance = None)
+        self.received = []
+        self.reports.notify(self.callback)
+        self.cfg = FAKConfig()
+        self.cfg.operation.mode = "auto"
+        self.cfg.log.method = "none"
+
+    def tearDown(self):
+        resetInfo()
+
+    def callback(self, reports, message):
+        self.received.append(message)
+
+    def hosts(self, count):
+        return [("host%d" % i, "address%d" % i, self.cfg)
+                for i in range(count)]
+
+    def testLocalShell(self):
+        transport = fleet.LocalTransport([sys.executable,
+            os.path.join(root, "firstaidkit-shell"),
+            "-P", os.path.join(root, "plugins", "plugin_examples")])
+        executor = fleet.FleetExecutor(self.reports, transport, jobs = 2)
+        results = executor.run(self.hosts(2))
+        self.assertEqual(results, {"host0": fleet.OK, "host1": fleet.OK})
+        ends = [m["remote_name"] for m in self.received
+                if m["action"] == reporting.END]
+        self.assertEqual(sorted(ends), ["host0", "host1"])
+
+        archives = dict([(saveas, path) for path, saveas
+                         in Info._attachments])
+        self.assertEqual(sorted(archives.keys()),
+                ["remote_report_host0.zip", "remote_report_host1.zip"])
+        for path in archives.values():
+            self.assert_("results.ini" in zipfile.ZipFile(path).namelist())
+        resetInfo()
+        for path in archives.values():
+            self.failIf(os.path.exists(path))
+
+    def testAgent(self):
+        shell = os.path.join(root, "firstaidkit-shell")
+        tmpdir = tempfile.mkdtemp()
+        path = os.path.join(tmpdir, "agent")
+        agent = subprocess.Popen([sys.executable, shell, "-P",
+            os.path.join(root, "plugins", "plugin_examples"),
+            "--socket", path], stdout = open(os.devnull, "w"),
+            stderr = subprocess.STDOUT, close_fds = True)
+        try:
+            for i in range(100):
+                if os.path.exists(path):
+                    break
+                time.sleep(0.1)
+            transport = Transport([sys.executable, shell, "--connect", path])
+            executor = fleet.FleetExecutor(self.reports, transport, jobs = 2)
+            results = executor.run(self.hosts(3))
+            self.assertEqual(set(results.values()), set([fleet.OK]))
+            self.assertEqual(len(Info._attachments), 3)
+            self.assertEqual(agent.poll(), None)
+        finally:
+            agent.terminate()
+            agent.wait()
+            shutil.rmtree(tmpdir)
+
+    def testResume(self):
+        spool = tempfile.mkdtemp()
+        shell = [sys.executable, os.path.join(root, "firstaidkit-shell"),
+            "-P", os.path.join(root, "plugins", "plugin_examples"),
+            "--spool", spool]
+        transport = Transport([sys.executable, "-c", cut, "1500"] + shell)
+        spawn = transport.spawn
+        def once(address):
+            # the connection breaks only once
+            conn = spawn(address)
+            transport._command = shell
+            return conn
+        transport.spawn = once
+        delay = fleet.RemoteTask.resume_delay
+        fleet.RemoteTask.resume_delay = 0.01
+        try:
+            executor = fleet.FleetExecutor(self.reports, transport,
+                    resume = 2)
+            results = executor.run(self.hosts(1))
+            self.assertEqual(results, {"host0": fleet.OK})
+            self.assertEqual(transport.spawned, 2)
+            self.assertEqual(len([m for m in self.received
+                if m["remote"] and m["action"] == reporting.END]), 1)
+            self.assertEqual(len(Info._attachments), 1)
+            self.assertEqual(os.listdir(spool), [])
+        finally:
+            fleet.RemoteTask.resume_delay = delay
+            shutil.rmtree(spool)
+
+    def testDamagedArchive(self):
+        transport = fleet.LocalTransport([sys.executable, "-c", damaged])
+        executor = fleet.FleetExecutor(self.reports, transport)
+        results = executor.run(self.hosts(1))
+        self.assertEqual(Info._attachments, [])
+        self.assert_([m for m in self.received
+            if m["importance"] == logging.ERROR and
+               "damaged" in str(m["message"])])
+
+    def testConcurrency(self):
+        transport = Transport(["sh", "-c", "sleep 0.3"])
+        executor = fleet.FleetExecutor(self.reports, transport, jobs = 2)
+        start = time.time()
+        results = executor.run(self.hosts(4))
+        self.assert_(time.time() - start >= 0.6)
+        self.assertEqual(transport.spawned, 4)
+        self.assertEqual(set(results.values()), set([fleet.FAILED]))
+
+    def testRetry(self):
+        transport = Transport(["sh", "-c", "exit 255"], transient = True)
+        executor = fleet.FleetExecutor(self.reports, transport, retries = 2,
+                backoff = 0.01)
+        results = executor.run(self.hosts(1))
+        self.assertEqual(transport.spawned, 3)
+        self.assertEqual(results["host0"], fleet.TRANSIENT)
+
+    def testTimeout(self):
+        transport = Transport(["sh", "-c", "exec sleep 30"])
+        executor = fleet.FleetExecutor(self.reports, transport,
+                timeout = 0.5)
+        start = time.time()
+        results = executor.run(self.hosts(1))
+        self.assert_(time.time() - start < 10)
+        self.assertEqual(results["host0"], fleet.TIMEOUT)
+        self.assert_([m for m in self.received
+            if m["action"] == reporting.TIMEOUT])
+
+class Aggregator(unittest.TestCase):
+    def setUp(self):
+        self.aggregator = fleet.IssueAggregator()
+        self.origin = reporting.Origin("plugin")
+
+    def message(self, host, name = "issue", happened = True, fixed = False):
+        issue = SimpleIssue(name, "%s description" % name, remote_name = host)
+        issue.set(checked = True, happened = happened, fixed = fixed)
+        return reporting.Message(reporting.PLUGIN, self.origin,
+                reporting.ISSUE, logging.INFO, issue, None, None, "",
+                host is not None, host or "LOCAL", "")
+
+    def testGrouping(self):
+        for i in range(100):
+            self.aggregator.add(self.message("host%d" % i))
+        self.aggregator.add(self.message("host0", "other", happened = False))
+        self.assertEqual(self.aggregator.summary(), [
+            ("plugin", "issue", "Detected", 100, "issue description"),
+            ("plugin", "other", "No problem", 1, "other description")])
+        self.assertEqual(len(self.aggregator.hosts("plugin", "issue",
+            "Detected")), 100)
+        self.assertEqual(self.aggregator.host("host0"), [
+            ("plugin", "issue", "Detected"),
+            ("plugin", "other", "No problem")])
+
+    def testStateChange(self):
+        self.aggregator.add(self.message("host0"))
+        self.aggregator.add(self.message("host1"))
+        changed = self.aggregator.add(self.message("host0", fixed = True))
+        self.assertEqual(changed, [(("plugin", "issue", "Detected"), 1),
+            (("plugin", "issue", "Fixed"), 1)])
+        self.assertEqual(self.aggregator.add(self.message("host0",
+            fixed = True)), [])
+        self.assertEqual(self.aggregator.hosts("plugin", "issue", "Fixed"),
+                ["host0"])
+        self.assertEqual(len(self.aggregator), 2)
+
+    def testLocal(self):
+        self.assertEqual(self.aggregator.add(self.message(None)), [])
+        self.assertEqual(self.aggregator.summary(), [])
+
+    def testWatch(self):
+        changes = []
+        self.aggregator.watch(lambda key, count, description:
+                changes.append((key, count)))
+        self.aggregator.add(self.message("host0"))
+        self.aggregator.add(self.message("host0", fixed = True))
+        self.assertEqual(changes, [(("plugin", "issue", "Detected"), 1),
+            (("plugin", "issue", "Detected"), 0),
+            (("plugin", "issue", "Fixed"), 1)])
+        self.assertEqual(self.aggregator.hosts("plugin", "issue", "Detected"),
+                [])
+
+    def testLimit(self):
+        for i in range(10):
+            self.aggregator.add(self.message("host%d" % i))
+        hosts = self.aggregator.hosts("plugin", "issue", "Detected", limit = 3)
+        self.assertEqual(len(hosts), 3)
+        self.assert_(set(hosts) <= set(["host%d" % i for i in range(10)]))
@@ -0,0 +1,70 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+import unittest
+from pyfirstaidkit.plugins import Plugin, FlagTrackerPlugin, Flow
+from pyfirstaidkit.returns import *
+
+class Broken(Plugin):
+    flows = Flow.init(Plugin)
+    flows["broken"] = Flow({
+            Plugin.initial: {Return: "prepare"},
+            "prepare"     : {ReturnSuccess: "missing", ReturnFailure: "clean",
+                None: "clean"},
+            "missing"     : {Return: "loop"},
+            "loop"        : {Return: "missing"},
+            "orphan"      : {Return: "clean"},
+            "clean"       : {ReturnSuccess: Plugin.final}
+            })
+
+class Transitions(unittest.TestCase):
+    def setUp(self):
+        self.flow = Plugin.getFlow("fix")
+
+    def testDirect(self):
+        self.assertEqual(self.flow.next("diagnose", ReturnFailure), "backup")
+
+    def testNone(self):
+        self.assertEqual(self.flow.next("fix", None), "restore")
+
+    def testHierarchy(self):
+        flow = Flow({"step": {Return: "parent", ReturnSuccess: "success"}})
+        self.assertEqual(flow.next("step", ReturnSuccess), "success")
+        self.assertEqual(flow.next("step", ReturnTrue), "parent")
+        # None result does not use the Return edge
+        self.assertEqual(flow.next("step", None), None)
+
+    def testMissing(self):
+        self.assertEqual(self.flow.next("clean", ReturnTrue), None)
+        self.assertEqual(self.flow.next("nostep", ReturnSuccess), None)
+
+    def testShared(self):
+        self.assert_(Broken.getFlow("fix") is Plugin.getFlow("fix"))
+
+class Validation(unittest.TestCase):
+    def testDefaultFlows(self):
+        self.assertEqual(Plugin.validate(), [])
+        self.assertEqual(FlagTrackerPlugin.validate(), [])
+
+    def testBroken(self):
+        problems = Broken.getFlow("broken").validate(Broken)
+        self.assert_("step missing is not a method" in problems)
+        self.assert_("step orphan can't be reached" in problems)
+        self.assert_("step missing never reaches the final state" in problems)
+        self.assert_("step clean has no transition for ReturnFailure result"
+                in problems)
@@ -0,0 +1,69 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+import unittest, tempfile, shutil, os
+from pyfirstaidkit.manifest import PluginManifest, stamp
+
+class Manifest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.write("plugin.py", "pass\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def write(self, name, data):
+        f = open(os.path.join(self.path, name), "w")
+        f.write(data)
+        f.close()
+
+    def testRoundTrip(self):
+        manifest = PluginManifest(self.path)
+        manifest.set("plugin", stamp(self.path, "plugin"),
+                [("plugin", {"name": "Plugin"})])
+        manifest.save()
+
+        manifest = PluginManifest(self.path)
+        self.assertEqual(manifest.get("plugin", stamp(self.path, "plugin")),
+                [("plugin", {"name": "Plugin"})])
+
+    def testChangedModule(self):
+        manifest = PluginManifest(self.path)
+        manifest.set("plugin", stamp(self.path, "plugin"), [])
+        manifest.save()
+
+        self.write("plugin.py", "import os\n")
+        manifest = PluginManifest(self.path)
+        self.assertEqual(manifest.get("plugin", stamp(self.path, "plugin")),
+                None)
+
+    def testCompiledIgnored(self):
+        before = stamp(self.path, "plugin")
+        self.write("plugin.pyc", "compiled")
+        self.assertEqual(stamp(self.path, "plugin"), before)
+
+    def testPrune(self):
+        manifest = PluginManifest(self.path)
+        manifest.set("gone", (), [])
+        manifest.prune(["plugin"])
+        self.assertEqual(manifest.get("gone", ()), None)
+
+    def testReadOnly(self):
+        manifest = PluginManifest(os.path.join(self.path, "missing"))
+        manifest.set("plugin", (), [])
+        manifest.save()
@@ -0,0 +1,170 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+
+import unittest, os, tempfile, shutil
+from cStringIO import StringIO
+from pyfirstaidkit import protocol
+
+class Frames(unittest.TestCase):
+    def read(self, data):
+        reader = protocol.FrameReader(StringIO(data))
+        frames = []
+        while True:
+            frame = reader.read()
+            if frame is None:
+                return frames, reader
+            frames.append(frame)
+
+    def testRoundTrip(self):
+        data = protocol.frame(protocol.CONTROL, "short") + \
+               protocol.frame(protocol.MESSAGES, "long" * 1000)
+        frames, reader = self.read(data)
+        self.assertEqual(frames, [(protocol.CONTROL, "short"),
+                                  (protocol.MESSAGES, "long" * 1000)])
+        self.assertEqual(reader.skipped, 0)
+
+    def testCompression(self):
+        self.assert_(len(protocol.frame(protocol.MESSAGES, "x" * 1000))
+                < 100)
+
+    def testGarbage(self):
+        data = "printed text\n" + protocol.frame(protocol.CONTROL, "one") + \
+               "more" + protocol.frame(protocol.CONTROL, "two") + "tail"
+        frames, reader = self.read(data)
+        self.assertEqual([f[1] for f in frames], ["one", "two"])
+        self.assertEqual(reader.skipped, len("printed text\nmoretail"))
+
+    def testCorruptedPayload(self):
+        first = protocol.frame(protocol.CONTROL, "one")
+        first = first[:-1] + "X"
+        data = first + protocol.frame(protocol.CONTROL, "two")
+        frames, reader = self.read(data)
+        self.assertEqual([f[1] for f in frames], ["two"])
+        self.assertEqual(reader.broken, 1)
+
+    def testCorruptedHeader(self):
+        first = protocol.frame(protocol.CONTROL, "one")
+        # damaged length would make the reader wait for data
+        first = first[:8] + "\xff" + first[9:]
+        data = first + protocol.frame(protocol.CONTROL, "two")
+        frames, reader = self.read(data)
+        self.assertEqual([f[1] for f in frames], ["two"])
+
+    def testTruncated(self):
+        data = protocol.frame(protocol.CONTROL, "one") + \
+               protocol.frame(protocol.CONTROL, "two")[:-1]
+        frames, reader = self.read(data)
+        self.assertEqual([f[1] for f in frames], ["one"])
+        self.assertEqual(reader.offset, len(protocol.frame(protocol.CONTROL,
+            "one")))
+
+class Batching(unittest.TestCase):
+    def setUp(self):
+        self.stream = StringIO()
+        self.writer = protocol.FrameWriter(self.stream)
+
+    def messages(self):
+        reader = protocol.FrameReader(StringIO(self.stream.getvalue()))
+        res = []
+        while True:
+            frame = reader.read()
+            if frame is None:
+                return res
+            res.append(protocol.decode(frame[1]))
+
+    def testBatch(self):
+        batcher = protocol.MessageBatcher(self.writer, size = 3, delay = 60,
+                urgent = ("end",))
+        for i in range(4):
+            batcher.put({"action": "info", "message": i})
+        batcher.put({"action": "end", "message": None})
+        self.assertEqual([len(batch) for batch in self.messages()], [3, 2])
+
+    def testDelay(self):
+        batcher = protocol.MessageBatcher(self.writer, delay = 0.01)
+        batcher.put({"action": "info", "message": 1})
+        batcher._timer.join()
+        self.assertEqual(self.messages(), [[{"action": "info", "message": 1}]])
+
+class Broken(object):
+    """Connection which breaks after the first write"""
+    def __init__(self):
+        self.data = ""
+
+    def write(self, data):
+        if self.data:
+            raise IOError("broken pipe")
+        self.data += data
+
+    def flush(self):
+        pass
+
+class Spooling(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def testResume(self):
+        conn = Broken()
+        lost = []
+        spool = protocol.Spool(self.dir, conn, lambda: lost.append(True))
+        writer = protocol.FrameWriter(spool)
+        for i in range(3):
+            writer.control("step", i)
+        self.assertEqual(lost, [True])
+        spool.close()
+
+        reader = protocol.FrameReader(StringIO(conn.data))
+        reader.read()
+        rest = StringIO()
+        self.assert_(protocol.follow(self.dir, spool.session, reader.offset,
+            rest))
+        reader = protocol.FrameReader(StringIO(rest.getvalue()),
+                reader.offset)
+        self.assertEqual([protocol.decode(reader.read()[1])[1]
+                          for i in range(2)], [(1,), (2,)])
+
+        protocol.removeSpool(self.dir, spool.session)
+        self.assertEqual(os.listdir(self.dir), [])
+        self.failIf(protocol.follow(self.dir, spool.session, 0, rest))
+
+    def testUnsafeDirectory(self):
+        os.chmod(self.dir, 0755)
+        self.assertRaises(OSError, protocol.Spool, self.dir, StringIO())
+        os.chmod(self.dir, 0700)
+        link = self.dir + ".link"
+        os.symlink(self.dir, link)
+        try:
+            self.assertRaises(OSError, protocol.Spool, link, StringIO())
+        finally:
+            os.unlink(link)
+        spool = protocol.Spool(os.path.join(self.dir, "new"), StringIO())
+        self.assertEqual(os.stat(os.path.join(self.dir, "new")).st_mode & 0777,
+                0700)
+        spool.close()
+
+    def testSessionName(self):
+        spool = protocol.Spool(self.dir, StringIO())
+        spool.close()
+        self.assert_(protocol.follow(self.dir, spool.session, 0, StringIO()))
+        for name in ("../" + os.path.basename(self.dir), spool.session.upper(),
+                     spool.session + "0"):
+            self.failIf(protocol.follow(self.dir, name, 0, StringIO()))
@@ -0,0 +1,248 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+
+import unittest, logging, threading, time
+import cPickle as pickle
+from pyfirstaidkit import reporting
+
+class Origin(object):
+    name = "Test"
+
+class Counted(object):
+    """Format argument which counts how many times it got formatted"""
+    def __init__(self):
+        self.count = 0
+
+    def __str__(self):
+        self.count += 1
+        return "counted"
+
+class Filtering(unittest.TestCase):
+    def setUp(self):
+        self.reports = reporting.Reports(queue_importance = None)
+        self.received = []
+
+    def callback(self, reports, message):
+        self.received.append(message)
+
+    def testImportance(self):
+        self.reports.subscribe(self.callback, importance = logging.INFO)
+        self.reports.debug("debug", origin = Origin())
+        self.reports.info("info", origin = Origin())
+        self.assertEqual([m["message"] for m in self.received], ["info"])
+
+    def testActions(self):
+        self.reports.subscribe(self.callback,
+                actions = [reporting.ALERT])
+        self.reports.info("info", origin = Origin())
+        self.reports.alert("alert", origin = Origin())
+        self.assertEqual([m["message"] for m in self.received], ["alert"])
+        self.assert_(self.reports.wants(logging.INFO, reporting.ALERT))
+        self.failIf(self.reports.wants(logging.INFO, reporting.INFO))
+
+    def testMailboxes(self):
+        self.reports.subscribe(self.callback, mailboxes = True)
+        mb = self.reports.openMailbox()
+        mb.info("reply", origin = Origin())
+        mb.closeMailbox()
+        self.assertEqual([m["message"] for m in self.received], ["reply"])
+        self.assertEqual(mb.get(block = False)["message"], "reply")
+
+    def testQueue(self):
+        reports = reporting.Reports(queue_importance = logging.WARNING)
+        reports.info("info", origin = Origin())
+        reports.alert("alert", origin = Origin())
+        self.assertEqual(reports.get(block = False)["message"], "alert")
+        self.assert_(reports._queue.empty())
+
+class LazyFormat(unittest.TestCase):
+    def testFiltered(self):
+        reports = reporting.Reports(queue_importance = logging.INFO)
+        arg = Counted()
+        reports.debug("value %s", origin = Origin(), args = (arg,))
+        self.assertEqual(arg.count, 0)
+
+    def testFormattedOnce(self):
+        reports = reporting.Reports(queue_importance = 0)
+        arg = Counted()
+        reports.alert("value %s", origin = Origin(), args = (arg,))
+        message = reports.get(block = False)["message"]
+        self.assertEqual(str(message), "value counted")
+        self.assertEqual(str(message), "value counted")
+        self.assertEqual(arg.count, 1)
+
+class Messages(unittest.TestCase):
+    def setUp(self):
+        self.reports = reporting.Reports()
+        self.origin = Origin()
+
+    def testDictInterface(self):
+        self.reports.info("info", origin = self.origin)
+        message = self.reports.get(block = False)
+        self.assertEqual(message["action"], reporting.INFO)
+        self.assertEqual(message["remote_name"], "LOCAL")
+        message["remote"] = True
+        self.assertEqual(dict(message)["remote"], True)
+        self.assertRaises(KeyError, message.__getitem__, "unknown")
+
+    def testSharedOrigin(self):
+        self.reports.info("first", origin = self.origin)
+        self.reports.info("second", origin = self.origin)
+        first = self.reports.get(block = False)
+        second = self.reports.get(block = False)
+        self.assert_(first["origin"] is second["origin"])
+        self.failIf(first["origin"] is self.origin)
+
+    def testPickle(self):
+        self.reports.info("first", origin = self.origin)
+        self.reports.info("second", origin = self.origin)
+        messages = [self.reports.get(block = False) for i in range(2)]
+        loaded = pickle.loads(pickle.dumps(messages,
+                pickle.HIGHEST_PROTOCOL))
+        for key in ("level", "action", "importance", "message", "remote"):
+            self.assertEqual(loaded[0][key], messages[0][key])
+        self.assertEqual(loaded[0]["origin"].name, "Test")
+        self.assert_(loaded[0]["origin"] is loaded[1]["origin"])
+
+class Dispatching(unittest.TestCase):
+    def setUp(self):
+        self.reports = reporting.Reports(queue_importance = None)
+        self.origin = Origin()
+        self.received = []
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        self.reports.stopDispatcher()
+
+    def callback(self, reports, message):
+        # the first message holds the dispatcher until released
+        self.release.wait()
+        self.received.append(message)
+
+    def start(self, policy):
+        self.reports.subscribe(self.callback)
+        self.reports.startDispatcher(size = 3, batch = 1, policy = policy)
+        self.reports.info("first", origin = self.origin)
+        # wait for the dispatcher to take the first message
+        self.reports._dispatcher._cond.acquire()
+        while self.reports._dispatcher._buffer:
+            self.reports._dispatcher._cond.wait(0.1)
+        self.reports._dispatcher._cond.release()
+
+    def testOrder(self):
+        self.start(reporting.BLOCK)
+        self.release.set()
+        for i in range(10):
+            self.reports.info(str(i), origin = self.origin)
+        self.reports.stopDispatcher()
+        self.assertEqual([m["message"] for m in self.received],
+                ["first"] + [str(i) for i in range(10)])
+
+    def testDrop(self):
+        self.start(reporting.DROP)
+        self.reports.alert("alert", origin = self.origin)
+        for i in range(5):
+            self.reports.info(str(i), origin = self.origin)
+        self.release.set()
+        self.reports.stopDispatcher()
+        self.assertEqual([m["message"] for m in self.received],
+                ["first", "alert", "3", "4"])
+
+    def testCoalesce(self):
+        self.start(reporting.COALESCE)
+        for i in range(5):
+            self.reports.progress(i, 5, origin = self.origin)
+        self.release.set()
+        self.reports.stopDispatcher()
+        self.assertEqual([m["message"] for m in self.received][-1], (4, 5))
+        self.assert_(len(self.received) <= 4)
+
+    def testQuestionFirst(self):
+        self.start(reporting.BLOCK)
+        self.reports.info("info", origin = self.origin)
+        self.reports.put(reporting.Question("question"), self.origin,
+                reporting.PLUGIN, reporting.TEXT_QUESTION)
+        self.release.set()
+        self.reports.stopDispatcher()
+        self.assertEqual([m["action"] for m in self.received],
+                [reporting.INFO, reporting.TEXT_QUESTION, reporting.INFO])
+
+class ProgressWindow(unittest.TestCase):
+    def setUp(self):
+        self.reports = reporting.Reports(queue_importance = None,
+                progress_window = 60)
+        self.origin = Origin()
+        self.received = []
+        self.reports.subscribe(self.callback)
+
+    def callback(self, reports, message):
+        self.received.append(message["message"])
+
+    def testFirstAndLast(self):
+        for i in range(100):
+            self.reports.progress(i, 100, origin = self.origin)
+        self.reports.progress(100, 100, origin = self.origin)
+        self.assertEqual(self.received, [(0, 100), (100, 100)])
+
+    def testPendingFlushed(self):
+        for i in range(10):
+            self.reports.progress(i, 100, origin = self.origin)
+        self.reports.info("info", origin = self.origin)
+        self.assertEqual(self.received, [(0, 100), (9, 100), "info"])
+
+    def testOrigins(self):
+        other = Origin()
+        other.name = "Other"
+        self.reports.progress(0, 10, origin = self.origin)
+        self.reports.progress(0, 10, origin = other)
+        self.reports.progress(1, 10, origin = self.origin)
+        self.reports.info("info", origin = other)
+        self.assertEqual(self.received, [(0, 10), (0, 10), "info"])
+
+    def testTimedFlush(self):
+        self.reports.setProgressWindow(0.2)
+        for i in range(10):
+            self.reports.progress(i, 100, origin = self.origin)
+        time.sleep(0.5)
+        self.assertEqual(self.received, [(0, 100), (9, 100)])
+        time.sleep(0.3)
+        self.reports.info("info", origin = self.origin)
+        self.assertEqual(self.reports._progress, {})
+
+    def testFlushOrder(self):
+        # the final update is not delivered while the timer delivers
+        self.reports = reporting.Reports(queue_importance = None,
+                progress_window = 0.1)
+        def slow(reports, message):
+            if message["message"] == (1, 100):
+                time.sleep(0.3)
+            self.received.append(message["message"])
+        self.reports.subscribe(slow)
+        self.reports.progress(0, 100, origin = self.origin)
+        self.reports.progress(1, 100, origin = self.origin)
+        time.sleep(0.15)
+        self.reports.progress(100, 100, origin = self.origin)
+        self.assertEqual(self.received, [(0, 100), (1, 100), (100, 100)])
+
+    def testDisabled(self):
+        self.reports.setProgressWindow(0)
+        for i in range(5):
+            self.reports.progress(i, 5, origin = self.origin)
+        self.assertEqual(len(self.received), 5)
@@ -0,0 +1,102 @@
+# First Aid Kit - diagnostic and repair tool for Linux
+# Copyright (C) 2008 Joel Granados <jgranado@redhat.com>
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 2 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 675 Mass Ave, Cambridge, MA 02139, USA.
+
+
+import unittest, threading
+from pyfirstaidkit.dependency import Dependencies
+from pyfirstaidkit.scheduler import Scheduler
+
+class Readiness(unittest.TestCase):
+    def setUp(self):
+        self.deps = Dependencies()
+        self.scheduler = Scheduler(self.deps)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def testNoDeps(self):
+        self.scheduler.add("a")
+        self.assertEqual(self.scheduler.get(), "a")
+        self.assertEqual(self.scheduler.get(), None)
+
+    def testChain(self):
+        self.scheduler.add("second", deps = ["first"])
+        self.scheduler.add("first")
+        self.assertEqual(self.scheduler.get(), "first")
+        self.assertEqual(self.scheduler.get(), None)
+        self.deps.provide("first")
+        self.assertEqual(self.scheduler.get(), "second")
+        self.assertEqual(len(self.scheduler), 0)
+
+    def testActionFlag(self):
+        self.scheduler.add("tracker", deps = ["flag?"])
+        self.deps.unprovide("flag")
+        self.assertEqual(self.scheduler.get(), "tracker")
+
+    def testConflict(self):
+        self.deps.provide("broken")
+        self.scheduler.add("a", conflicts = ["broken"])
+        self.assertEqual(self.scheduler.get(), None)
+        self.deps.unprovide("broken")
+        self.assertEqual(self.scheduler.get(), "a")
+
+    def testConflictAfterQueued(self):
+        self.scheduler.add("a", conflicts = ["broken"])
+        self.deps.provide("broken")
+        self.assertEqual(self.scheduler.get(), None)
+        self.assertEqual(self.scheduler.blocked(),
+                [("a", set(), set(["broken"]))])
+
+    def testImpossible(self):
+        self.scheduler.add("a", deps = ["x"], conflicts = ["x"])
+        self.assertEqual(self.scheduler.impossible(), {"a": set(["x"])})
+
+    def testIgnoreDeps(self):
+        scheduler = Scheduler(self.deps, usedeps = False)
+        scheduler.add("a", deps = ["never"])
+        self.assertEqual(scheduler.get(), "a")
+        scheduler.close()
+
+class Parallel(unittest.TestCase):
+    def setUp(self):
+        self.deps = Dependencies()
+        self.scheduler = Scheduler(self.deps)
+
+    def tearDown(self):
+        self.scheduler.close()
+
+    def testWaitForRunning(self):
+        self.scheduler.add("first")
+        self.scheduler.add("second", deps = ["first"])
+        first = self.scheduler.get()
+        result = []
+        waiter = threading.Thread(target = lambda:
+                result.append(self.scheduler.get(wait = True)))
+        waiter.start()
+        self.deps.provide("first")
+        self.scheduler.done(first)
+        waiter.join(5)
+        self.assertEqual(result, ["second"])
+
+    def testNothingRunning(self):
+        self.scheduler.add("blocked", deps = ["never"])
+        self.assertEqual(self.scheduler.get(wait = True), None)
+
+    def testStop(self):
+        self.scheduler.add("a")
+        self.scheduler.stop()
+        self.assertEqual(self.scheduler.get(wait = True), None)